@@ -0,0 +1,98 @@
+# bench/archive_read.py
+"""
+A year of minutely ticks for one coin: Price ORM objects vs the memory-mapped archive.
+
+"before" loads the rows through the ORM like the backtesting scripts did;
+"after" is archive.load on the per-day .npy files written by the compaction job.
+
+    python -m bench.archive_read --days 365 --tick-seconds 60
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import timedelta
+
+import numpy as np
+from sqlalchemy import insert
+
+workdir = tempfile.mkdtemp()
+os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'archive.db')}"
+os.environ["PRICE_ARCHIVE_DIR"] = os.path.join(workdir, "price_archive")
+
+from server import archive, models, timeseries  # noqa: E402
+from server.database import SessionLocal, engine  # noqa: E402
+
+CID = "bitcoin"
+
+
+def generate(args, start):
+    rng = np.random.default_rng(5)
+    count = args.days * 86400 // args.tick_seconds
+    times = np.datetime64(start, "us") + np.arange(count) * np.timedelta64(args.tick_seconds, "s")
+    prices = 30000 * np.cumprod(rng.uniform(0.999, 1.001, count))
+    volumes = rng.integers(10**9, 10**10, count).astype(np.float64)
+    return times, prices, volumes
+
+
+def build_table(times, prices, volumes):
+    models.Base.metadata.create_all(bind=engine)
+    rows = [
+        {"cid": CID, "time_stamp": time_stamp, "current_price": price, "total_volume": int(volume)}
+        for time_stamp, price, volume in zip(times.tolist(), prices.tolist(), volumes.tolist())
+    ]
+    with engine.begin() as conn:
+        conn.execute(insert(models.Price), rows)
+
+
+def build_archive(times, prices, volumes):
+    days = times.astype("datetime64[D]")
+    bounds = np.flatnonzero(np.diff(days)) + 1
+    for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(times)]):
+        archive.write_day(CID, days[lo].item(), {
+            "time_stamp": times[lo:hi], "current_price": prices[lo:hi], "total_volume": volumes[lo:hi],
+        })
+
+
+def timed(label, fn, repeat):
+    best = None
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - begin
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:<40} {best * 1000:10.1f} ms  ({result})")
+
+
+def before(start, end):
+    db = SessionLocal()
+    try:
+        rows = db.query(models.Price).filter(
+            models.Price.cid == CID, models.Price.time_stamp >= start, models.Price.time_stamp < end
+        ).order_by(models.Price.time_stamp).all()
+        return f"{len(rows)} rows, mean {sum(row.current_price for row in rows) / len(rows):.2f}"
+    finally:
+        db.close()
+
+
+def after(start, end):
+    arrays = archive.load(CID, start, end)
+    return f"{len(arrays['time_stamp'])} rows, mean {arrays['current_price'].mean():.2f}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--tick-seconds", type=int, default=60)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    end = timeseries.floor_time(timeseries.utcnow(), 86400)
+    start = end - timedelta(days=args.days)
+    times, prices, volumes = generate(args, start)
+    build_table(times, prices, volumes)
+    build_archive(times, prices, volumes)
+    print(f"{len(times)} ticks, {len(archive.days(CID))} archived days")
+
+    timed("before: ORM Price objects", lambda: before(start, end), args.repeat)
+    timed("after:  archive.load (mmap)", lambda: after(start, end), args.repeat)
@@ -0,0 +1,148 @@
+# bench/async_load.py
+"""
+Sync vs async data layer under load: --clients concurrent clients against one uvicorn worker,
+first with the sync routes, then with DB_ASYNC=true. Each client loops over a mix of
+GET /crypto/bitcoin (fresh price from the database), GET /portfolio/{uid}/value, GET /users/me
+and POST /transaction/ for --seconds. Reports requests/sec, errors and p50/p99/p99.9 latency.
+
+    python -m bench.async_load --clients 500 --seconds 20
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+workdir = tempfile.mkdtemp()
+os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'load.db')}"
+os.environ["INGEST_IN_APP"] = "false"
+os.environ.setdefault("PRICE_DB_MAX_AGE", "3600")
+
+from sqlalchemy import insert  # noqa: E402
+
+from server import auth, models  # noqa: E402
+from server.database import engine  # noqa: E402
+
+COINS = ["bitcoin", "ethereum", "solana", "ripple", "tether"]
+START = datetime(2024, 1, 1)
+
+
+def populate(users: int):
+    models.Base.metadata.create_all(bind=engine)
+    now = datetime.now(timezone.utc)
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [{
+            "email": f"user{i}@example.com", "username": f"user{i}", "hashed_password": "x", "role": "user",
+            "deactivated": False, "time_registered": now,
+        } for i in range(1, users + 1)])
+        conn.execute(insert(models.Price), [{
+            "cid": cid, "current_price": 100.0 + i, "market_cap": 1, "market_cap_rank": i, "total_volume": 1,
+            "high_24h": 1.0, "low_24h": 1.0, "time_stamp": now,
+        } for i, cid in enumerate(COINS)])
+        conn.execute(insert(models.Portfolio), [{
+            "uid": uid, "cid": cid, "quantity": 1.0, "time_created": now,
+        } for uid in range(1, users + 1) for cid in COINS])
+    engine.dispose()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def client_loop(client, rng, tokens: dict, deadline: float, latencies: list, errors: dict):
+    while time.perf_counter() < deadline:
+        uid = rng.randint(1, len(tokens))
+        kind = rng.random()
+        started = time.perf_counter()
+        try:
+            if kind < 0.4:
+                response = await client.get(f"/crypto/{rng.choice(COINS)}")
+            elif kind < 0.7:
+                response = await client.get(f"/portfolio/{uid}/value")
+            elif kind < 0.9:
+                response = await client.get("/users/me", headers={"Authorization": f"Bearer {tokens[uid]}"})
+            else:
+                response = await client.post("/transaction/", json={
+                    "uid": uid, "wid": 1, "cid": rng.choice(COINS), "cid_target": "usd", "ex_rate": 100.0,
+                    "position": 0.1, "network": "bench", "success": True,
+                    "time_transaction": (START + timedelta(seconds=rng.randrange(10 ** 6))).isoformat(),
+                })
+            status = response.status_code
+        except httpx.TransportError as exc:
+            status = type(exc).__name__
+        latencies.append(time.perf_counter() - started)
+        if status != 200:
+            errors[status] = errors.get(status, 0) + 1
+
+
+async def load(args, base_url: str):
+    latencies, errors = [], {}
+    tokens = {uid: auth.create_access_token({"sub": f"user{uid}@example.com", "uid": uid, "role": "user"})
+              for uid in range(1, args.users + 1)}
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        deadline = time.perf_counter() + args.seconds
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(client, random.Random(i), tokens, deadline, latencies, errors)
+                               for i in range(args.clients)))
+        elapsed = time.perf_counter() - started
+    return len(latencies) / elapsed, sorted(latencies), errors
+
+
+def run(args, db_async: str):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server.main:app", "--port", str(port), "--log-level", "warning",
+         "--backlog", str(4 * args.clients)],
+        env=dict(os.environ, DB_ASYNC=db_async),
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        for _ in range(100):
+            try:
+                httpx.get(f"{base_url}/docs")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        rate, latencies, errors = asyncio.run(load(args, base_url))
+    finally:
+        server.terminate()
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            # Graceful shutdown waits for requests that may never finish
+            server.kill()
+            server.wait()
+    label = "async" if db_async == "true" else "sync"
+    print(f"{label:<6} {rate:8,.0f} requests/s  p50 {percentile(latencies, 0.5) * 1000:7.1f} ms  "
+          f"p99 {percentile(latencies, 0.99) * 1000:7.1f} ms  p99.9 {percentile(latencies, 0.999) * 1000:7.1f} ms  errors {errors or 0}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--mode", choices=("sync", "async", "both"), default="both")
+    parser.add_argument("--timeout", type=float, default=10, help="per request, slower ones count as errors")
+    args = parser.parse_args()
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    populate(args.users)
+    print(f"{args.clients} clients, {args.seconds:.0f} s per run, {os.cpu_count()} cores")
+    for mode in (("sync", "async") if args.mode == "both" else (args.mode,)):
+        run(args, "true" if mode == "async" else "false")
@@ -0,0 +1,51 @@
+# bench/auth.py
+"""
+Authenticated request throughput: GET /users/me requests per second with one bearer token,
+serially through the app, and the cost of the auth dependency on its own. Every request
+verifies the JWT and resolves the current user.
+
+    python -m bench.auth --requests 5000
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+workdir = tempfile.mkdtemp()
+os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'auth.db')}"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from server import auth, models  # noqa: E402
+from server.database import SessionLocal, engine  # noqa: E402
+from server.main import app  # noqa: E402
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    with TestClient(app) as client:
+        client.post("/users/", json={"email": "bench@example.com", "username": "bench", "password": "bench-password"}).raise_for_status()
+        response = client.post("/token", data={"username": "bench@example.com", "password": "bench-password"})
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        started = time.perf_counter()
+        for _ in range(args.requests):
+            client.get("/users/me", headers=headers).raise_for_status()
+        elapsed = time.perf_counter() - started
+    print(f"GET /users/me            {args.requests / elapsed:8,.0f} requests/s  ({elapsed / args.requests * 1000:.3f} ms/request)")
+
+    token = headers["Authorization"].split()[1]
+    db = SessionLocal()
+    started = time.perf_counter()
+    for _ in range(args.requests):
+        auth.get_current_user(db, token)
+        db.rollback()
+    elapsed = time.perf_counter() - started
+    db.close()
+    print(f"auth.get_current_user    {elapsed / args.requests * 1e6:8.1f} µs/call")
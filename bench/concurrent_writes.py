@@ -0,0 +1,101 @@
+# bench/concurrent_writes.py
+"""
+Concurrent trade creation: --concurrency clients POST /transaction/ against a multi-process
+server (uvicorn --workers, the same process model as gunicorn in compose) on one SQLite file.
+Reports committed requests/sec and failures (5xx, mostly "database is locked", and dropped
+connections), then the /db/stats pool counters of whichever worker answers.
+
+    python -m bench.concurrent_writes --workers 4 --concurrency 32 --requests 4000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+if not os.getenv("SQLALCHEMY_DATABASE_URL"):
+    workdir = tempfile.mkdtemp()
+    os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'concurrent.db')}"
+os.environ["INGEST_IN_APP"] = "false"
+
+from bench.write_path import trades  # noqa: E402
+
+from server import models  # noqa: E402
+from server.database import engine  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def writer(client, queue: list, counts: dict, errors: dict):
+    while queue:
+        try:
+            response = await client.post("/transaction/", json=queue.pop())
+        except httpx.TransportError as exc:
+            counts[5] = counts.get(5, 0) + 1
+            errors[type(exc).__name__] = errors.get(type(exc).__name__, 0) + 1
+            continue
+        counts[response.status_code // 100] = counts.get(response.status_code // 100, 0) + 1
+        if response.status_code >= 500:
+            errors[response.text[:80]] = errors.get(response.text[:80], 0) + 1
+
+
+async def run(args, base_url: str):
+    queue = list(trades(random.Random(7), args))
+    counts, errors = {}, {}
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(writer(client, queue, counts, errors) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        stats = (await client.get("/db/stats")).json() if args.stats else None
+    print(f"POST /transaction/ x{args.concurrency}, {args.workers} workers  "
+          f"{counts.get(2, 0) / elapsed:8,.0f} committed/s  {counts.get(5, 0)} failed  ({args.requests} requests in {elapsed:.1f} s)")
+    for text, count in errors.items():
+        print(f"  {count:6} x {text}")
+    if stats is not None:
+        print(f"  /db/stats: {stats}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--coins", type=int, default=10)
+    parser.add_argument("--no-stats", dest="stats", action="store_false")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    engine.dispose()
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server.main:app", "--port", str(port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        env=os.environ,
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        for _ in range(200):
+            try:
+                httpx.get(f"{base_url}/docs")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        print(engine.dialect.name)
+        asyncio.run(run(args, base_url))
+    finally:
+        server.terminate()
+        server.wait()
@@ -0,0 +1,94 @@
+# bench/history_query.py
+"""
+One-year chart for one coin, aggregated from raw Price ticks vs read from the rollup levels.
+
+"before" folds every raw tick of the year into candles (what a chart query had to do without
+rollups); "after" is timeseries.history, which reads the coarsest rollup level plus the raw tail.
+
+    python -m bench.history_query --coins 5 --tick-seconds 300 --days 365
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import timedelta
+
+workdir = tempfile.mkdtemp()
+os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'history.db')}"
+
+from sqlalchemy import insert  # noqa: E402
+
+from server import models, timeseries  # noqa: E402
+from server.database import SessionLocal, engine  # noqa: E402
+
+
+def generate(db, args, start):
+    rng = random.Random(3)
+    coins = [f"coin-{i}" for i in range(args.coins)]
+    prices = {c: rng.uniform(1, 1000) for c in coins}
+    ticks = args.days * 86400 // args.tick_seconds
+    batch = []
+    for i in range(ticks):
+        time_stamp = start + timedelta(seconds=i * args.tick_seconds)
+        for cid in coins:
+            prices[cid] *= rng.uniform(0.995, 1.005)
+            batch.append({"cid": cid, "time_stamp": time_stamp, "current_price": prices[cid], "total_volume": i})
+        if len(batch) >= 50_000:
+            db.execute(insert(models.Price), batch)
+            batch = []
+    if batch:
+        db.execute(insert(models.Price), batch)
+    db.commit()
+    return coins, ticks * len(coins)
+
+
+def timed(label, fn, repeat):
+    best = None
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - begin
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:<40} {best * 1000:10.1f} ms  ({len(result)} candles)")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--coins", type=int, default=5)
+    parser.add_argument("--tick-seconds", type=int, default=300)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--interval", default="1d")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    end = timeseries.floor_time(timeseries.utcnow(), 86400)
+    start = end - timedelta(days=args.days)
+    coins, rows = generate(db, args, start)
+    print(f"{rows} raw ticks, {args.coins} coins, {args.days} days")
+
+    begin = time.perf_counter()
+    written = timeseries.roll_up(db, now=end)
+    print(f"rollup: {sum(written.values())} candles in {time.perf_counter() - begin:.1f}s {written}")
+
+    seconds = timeseries.parse_interval(args.interval)
+    cid = coins[0]
+    before = timed(
+        f"before: raw ticks -> {args.interval} candles",
+        lambda: [
+            candle.as_dict(bucket_start) for (_, bucket_start), candle in sorted(timeseries.aggregate(
+                timeseries._source_rows(db, "raw", start, end, cid=cid), seconds
+            ).items())
+        ],
+        args.repeat,
+    )
+    after = timed(
+        f"after:  {timeseries.pick_level(seconds)} rollup -> {args.interval} candles",
+        lambda: timeseries.history(db, cid, seconds, start, end),
+        args.repeat,
+    )
+    assert before == after, "rollup candles differ from raw aggregation"
+    db.close()
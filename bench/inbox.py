@@ -0,0 +1,173 @@
+# bench/inbox.py
+"""
+Message delivery throughput and inbox latency.
+
+1. Delivery: --messages messages sent by --threads concurrent senders, once with an insert and
+   a commit per message (how a request used to write its message) and once through the
+   notification outbox, which batches them (server/notifications.py).
+2. Inbox: one user with --inbox messages (the older half read) among other users' messages.
+   Times the inbox routes through the app against the queries they replace: COUNT(*) of the
+   unread messages for the badge and OFFSET paging.
+3. Bulk mark-read, then retention compacting the inbox down to MESSAGE_KEEP_READ read messages.
+
+    python -m bench.inbox --inbox 1000000
+"""
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+workdir = tempfile.mkdtemp()
+os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'inbox.db')}"
+os.environ["INGEST_IN_APP"] = "false"
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import func, insert, select, update  # noqa: E402
+
+from server import auth, listing, models, notifications  # noqa: E402
+from server.database import SessionLocal, engine  # noqa: E402
+from server.main import app  # noqa: E402
+
+UID = 1
+messages = models.Message.__table__
+
+
+def senders(threads: int, count: int, send):
+    """
+    count messages split over threads calling send(i); returns the wall time.
+    """
+    def run(offset):
+        for i in range(offset, count, threads):
+            send(i)
+
+    workers = [threading.Thread(target=run, args=(offset,)) for offset in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - started
+
+
+def commit_per_message(i: int):
+    db = SessionLocal()
+    try:
+        db.add(models.Message(**notifications.message_row(1000 + i % 1000, i, "Transaction Alert", f"Message {i}")))
+        db.commit()
+    finally:
+        db.close()
+
+
+def delivery(args):
+    elapsed = senders(args.threads, args.messages, commit_per_message)
+    print(f"1. insert + commit per message   {args.messages / elapsed:8,.0f} messages/s")
+    before = dict(notifications.stats)
+    started = time.perf_counter()
+    enqueued = senders(args.threads, args.messages, lambda i: notifications.outbox.put(
+        [notifications.message_row(1000 + i % 1000, i, "Transaction Alert", f"Message {i}")]))
+    notifications.outbox.close()
+    elapsed = time.perf_counter() - started
+    batches = notifications.stats["batches"] - before["batches"]
+    print(f"   notification outbox            {args.messages / elapsed:8,.0f} messages/s written "
+          f"({batches} batches, {enqueued / args.messages * 1e6:.1f} us per send on the caller)")
+
+
+def populate(count: int, others: int):
+    started = time.perf_counter()
+    db = SessionLocal()
+    batch = 50_000
+    now = datetime.now(timezone.utc)
+    for start in range(0, count, batch):
+        rows = [notifications.message_row(UID, i, "Price Alert", f"Alert {i}", now) for i in range(start, min(count, start + batch))]
+        # Other users' messages interleaved, as in a shared table
+        rows += [notifications.message_row(2 + i % 5000, i, "Price Alert", f"Alert {i}", now) for i in range(others * len(rows) // count)]
+        notifications.write(db, rows)
+        db.commit()
+    db.close()
+    elapsed = time.perf_counter() - started
+    print(f"2. wrote {count:,} messages for user {UID} plus {others:,} for others with notifications.write: "
+          f"{(count + others) / elapsed:,.0f} messages/s")
+
+
+def timed(fn, runs: int):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+def inbox(args, client, headers):
+    db = SessionLocal()
+    last_mid = db.execute(select(func.max(messages.c.mid)).where(messages.c.uid == UID)).scalar()
+    half = db.execute(select(messages.c.mid).where(messages.c.uid == UID).order_by(messages.c.mid)
+                      .offset(args.inbox // 2).limit(1)).scalar()
+    started = time.perf_counter()
+    marked = notifications.mark_read(db, UID, up_to=half)
+    db.commit()
+    print(f"   marked the older {marked:,} read in {time.perf_counter() - started:.1f}s (POST /messages/read with up_to)")
+    deep = listing.encode_cursor("message", {"mid": db.execute(
+        select(messages.c.mid).where(messages.c.uid == UID).order_by(messages.c.mid).offset(100).limit(1)).scalar()})
+
+    def get(path, **params):
+        return lambda: client.get(path, params=params, headers=headers).raise_for_status()
+
+    runs = args.runs
+    results = [
+        ("GET /messages/unread (counter)", timed(get("/messages/unread"), runs)),
+        ("  vs SELECT COUNT(*) of unread", timed(lambda: db.execute(select(func.count()).select_from(messages).where(
+            messages.c.uid == UID, messages.c.read == False)).scalar(), max(3, runs // 10))),
+        ("GET /messages, newest page", timed(get("/messages"), runs)),
+        ("GET /messages, page at the oldest", timed(get("/messages", after=deep), runs)),
+        ("  vs OFFSET paging to the oldest", timed(lambda: db.execute(select(messages).where(messages.c.uid == UID)
+                                                                        .order_by(messages.c.mid.desc()).offset(args.inbox - 150)
+                                                                        .limit(50)).all(), max(3, runs // 10))),
+        ("GET /messages?unread=true", timed(get("/messages", unread="true"), runs)),
+    ]
+    for label, ms in results:
+        print(f"   {label:<36} {ms:8.2f} ms")
+
+    mids = [last_mid - i for i in range(0, 100, 2)]
+    ms = timed(lambda: client.post("/messages/read", json={"mids": mids}, headers=headers).raise_for_status(), 1)
+    counter = notifications.unread_count(db, UID)
+    actual = db.execute(select(func.count()).select_from(messages).where(messages.c.uid == UID, messages.c.read == False)).scalar()
+    print(f"3. POST /messages/read of 50 mids {ms:8.2f} ms; unread counter {counter:,}, COUNT(*) {actual:,}")
+    db.close()
+
+
+def retention():
+    db = SessionLocal()
+    db.execute(update(messages).where(messages.c.uid == UID).values(read=True, time_read=datetime.now(timezone.utc)))
+    db.commit()
+    started = time.perf_counter()
+    result = notifications.prune(db)
+    left = db.execute(select(func.count()).select_from(messages).where(messages.c.uid == UID)).scalar()
+    print(f"   prune: {result} in {time.perf_counter() - started:.1f}s, user {UID} keeps {left:,} messages")
+    db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20_000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--inbox", type=int, default=1_000_000)
+    parser.add_argument("--others", type=int, default=200_000)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.User).values(uid=UID, email="inbox@example.com", username="inbox", hashed_password="x", role="user"))
+    headers = {"Authorization": f"Bearer {auth.create_access_token({'sub': 'inbox@example.com', 'uid': UID, 'role': 'user'})}"}
+
+    delivery(args)
+    populate(args.inbox, args.others)
+    with TestClient(app) as client:
+        inbox(args, client, headers)
+    retention()
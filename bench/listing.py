@@ -0,0 +1,147 @@
+# bench/listing.py
+"""
+Listing one heavy trader's history: the old GET /transaction/{uid} (every row as an ORM object,
+then one JSON list) vs keyset pages and the NDJSON stream.
+
+Each mode runs in its own process so peak RSS is comparable; requests go straight to the ASGI
+app, since TestClient would buffer a streamed body.
+
+    python -m bench.listing --transactions 1000000
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+if not os.getenv("SQLALCHEMY_DATABASE_URL"):
+    workdir = tempfile.mkdtemp()
+    os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'listing.db')}"
+
+from sqlalchemy import insert, select  # noqa: E402
+
+from server import crud, listing, models  # noqa: E402
+from server.database import SessionLocal, engine  # noqa: E402
+
+START = datetime(2019, 1, 1)
+UID = 1
+BATCH = 50_000
+PAGES = 20
+
+
+def insert_trades(args):
+    rng = random.Random(3)
+    with engine.begin() as conn:
+        rows = []
+        for i in range(args.transactions + args.others):
+            rows.append({
+                "uid": UID if i < args.transactions else rng.randint(2, 1000), "wid": 1,
+                "cid": f"coin-{rng.randrange(50)}", "cid_target": "usd", "ex_rate": rng.uniform(1, 1000),
+                "position": rng.uniform(-5, 5), "network": "bench", "success": True,
+                "time_transaction": START + timedelta(seconds=rng.randrange(5 * 365 * 86400)),
+            })
+            if len(rows) == BATCH:
+                conn.execute(insert(models.Transaction), rows)
+                rows = []
+        if rows:
+            conn.execute(insert(models.Transaction), rows)
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def get(path: str, query: str = ""):
+    """
+    GET through the ASGI app: (seconds to first body byte, seconds to last, body bytes).
+    """
+    from server.main import app
+
+    started = time.perf_counter()
+    first, size = None, 0
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if requested:  # the client never disconnects
+            await asyncio.Event().wait()
+        requested = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal first, size
+        if message["type"] == "http.response.start":
+            assert message["status"] == 200, message
+        elif message["type"] == "http.response.body" and message.get("body"):
+            first = first or time.perf_counter() - started
+            size += len(message["body"])
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": query.encode(), "root_path": "",
+        "headers": [(b"host", b"bench")], "client": ("bench", 1), "server": ("bench", 80),
+    }
+    await app(scope, receive, send)
+    return first, time.perf_counter() - started, size
+
+
+def run(mode: str):
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    import server.main  # noqa: F401  app and its imports count towards the baseline
+
+    baseline = peak_rss_mb()
+    if mode == "all":
+        started = time.perf_counter()
+        db = SessionLocal()
+        body = JSONResponse(jsonable_encoder(crud.get_transactions_by_uid(db, uid=UID))).body
+        db.close()
+        elapsed = time.perf_counter() - started
+        result = f"{elapsed:8.2f} s, {len(body) / 1e6:.0f} MB body"
+    elif mode == "stream":
+        first, elapsed, size = asyncio.run(get(f"/transaction/{UID}", "format=ndjson"))
+        result = f"{elapsed:8.2f} s, first byte after {first * 1000:.0f} ms, {size / 1e6:.0f} MB body"
+    else:
+        # First page, and pages from all over the history
+        db = SessionLocal()
+        keys = select(models.Transaction.time_transaction, models.Transaction.tid).where(
+            models.Transaction.uid == UID
+        ).order_by(models.Transaction.time_transaction, models.Transaction.tid).limit(1)
+        total = db.query(models.Transaction).filter(models.Transaction.uid == UID).count()
+        cursors = [
+            listing.encode_cursor("transaction", db.execute(keys.offset(i)).one()._mapping)
+            for i in range(0, total, total // PAGES)
+        ]
+        db.close()
+        timings = [asyncio.run(get(f"/transaction/{UID}", "limit=1000"))[1]]
+        timings += [asyncio.run(get(f"/transaction/{UID}", f"limit=1000&after={after}"))[1] for after in cursors]
+        result = f"{statistics.median(timings) * 1000:8.2f} ms median, {max(timings) * 1000:.2f} ms worst of {len(timings)} pages"
+    print(f"{mode:<7} {result}, peak RSS +{peak_rss_mb() - baseline:.0f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transactions", type=int, default=1_000_000, help="rows of the listed user")
+    parser.add_argument("--others", type=int, default=200_000, help="rows of other users")
+    parser.add_argument("--mode", choices=("all", "page", "stream"))
+    args = parser.parse_args()
+
+    if args.mode:
+        run(args.mode)
+        sys.exit()
+
+    models.Base.metadata.create_all(bind=engine)
+    started = time.perf_counter()
+    insert_trades(args)
+    print(f"{args.transactions} transactions for uid {UID}, {args.others} for others (generated in {time.perf_counter() - started:.0f}s)")
+    print("before: every row as ORM objects and one JSON list")
+    for mode in ("all", "page", "stream"):
+        if mode == "page":
+            print("after: keyset pages of 1000 / NDJSON stream")
+        subprocess.run([sys.executable, "-m", "bench.listing", "--mode", mode], check=True, env=os.environ)
@@ -0,0 +1,130 @@
+# bench/login_storm.py
+"""
+Login storm: --concurrency clients POST /token in a loop against a uvicorn server while one
+client polls GET /crypto/bitcoin (served from a fresh Price row). Reports logins/sec,
+shed logins (503) and the price endpoint's p50/p99 latency, first without the storm, then
+during it.
+
+    python -m bench.login_storm --concurrency 32 --seconds 20
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+workdir = tempfile.mkdtemp()
+os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'storm.db')}"
+os.environ.setdefault("PRICE_DB_MAX_AGE", "3600")
+
+from sqlalchemy import insert  # noqa: E402
+
+from server import models, utils  # noqa: E402
+from server.database import engine  # noqa: E402
+
+PASSWORD = "storm-password"
+PROBE_INTERVAL = 0.01
+
+
+def populate(users: int):
+    models.Base.metadata.create_all(bind=engine)
+    hashed = utils.get_password_hash(PASSWORD)
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [{
+            "email": f"user{i}@example.com", "username": f"user{i}", "hashed_password": hashed, "role": "user",
+            "deactivated": False, "time_registered": datetime.now(timezone.utc),
+        } for i in range(users)])
+        conn.execute(insert(models.Price), [{
+            "cid": "bitcoin", "current_price": 50000.0, "market_cap": 1, "market_cap_rank": 1, "total_volume": 1,
+            "high_24h": 1.0, "low_24h": 1.0, "time_stamp": datetime.now(timezone.utc),
+        }])
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def probe(client, stop: asyncio.Event, latencies: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        (await client.get("/crypto/bitcoin")).raise_for_status()
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(PROBE_INTERVAL)
+
+
+async def login_loop(client, i: int, users: int, stop: asyncio.Event, counts: dict):
+    while not stop.is_set():
+        response = await client.post("/token", data={"username": f"user{i % users}@example.com", "password": PASSWORD})
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+        if response.status_code == 503:
+            await asyncio.sleep(float(response.headers.get("retry-after", "1")))
+        i += 1
+
+
+async def run(args, base_url: str):
+    limits = httpx.Limits(max_connections=args.concurrency + 10)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        # Starts the hashing pool
+        (await client.post("/token", data={"username": "user0@example.com", "password": PASSWORD})).raise_for_status()
+
+        quiet, stop = [], asyncio.Event()
+        task = asyncio.create_task(probe(client, stop, quiet))
+        await asyncio.sleep(args.seconds / 4)
+        stop.set()
+        await task
+
+        storm, counts, stop = [], {}, asyncio.Event()
+        tasks = [asyncio.create_task(login_loop(client, i, args.users, stop, counts)) for i in range(args.concurrency)]
+        tasks.append(asyncio.create_task(probe(client, stop, storm)))
+        started = time.perf_counter()
+        await asyncio.sleep(args.seconds)
+        stop.set()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    print(f"GET /crypto/bitcoin, no logins     p50 {percentile(quiet, 0.5) * 1000:7.1f} ms  p99 {percentile(quiet, 0.99) * 1000:7.1f} ms")
+    print(f"GET /crypto/bitcoin, login storm   p50 {percentile(storm, 0.5) * 1000:7.1f} ms  p99 {percentile(storm, 0.99) * 1000:7.1f} ms"
+          f"  ({len(storm)} requests)")
+    print(f"POST /token x{args.concurrency}  {counts.get(200, 0) / elapsed:6.1f} logins/s, "
+          f"{counts.get(503, 0)} shed (503), other: { {k: v for k, v in counts.items() if k not in (200, 503)} }")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--users", type=int, default=100)
+    args = parser.parse_args()
+
+    populate(args.users)
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server.main:app", "--port", str(port), "--log-level", "warning"],
+        env=os.environ,
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        for _ in range(100):
+            try:
+                httpx.get(f"{base_url}/docs")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        print(f"{os.cpu_count()} cores, argon2 t={utils.ARGON2_TIME_COST} m={utils.ARGON2_MEMORY_COST} KiB p={utils.ARGON2_PARALLELISM}")
+        asyncio.run(run(args, base_url))
+    finally:
+        server.terminate()
+        server.wait()
@@ -0,0 +1,93 @@
+# bench/lot_replay.py
+"""
+Replaying the transaction ledger into lot snapshots.
+
+  1. full rebuild: every trade streamed through the lot engine (what recomputing positions
+     from the ledger costs without snapshots)
+  2. catch-up after appending new trades: only trades newer than each snapshot are replayed
+  3. the per-transaction path: crud.create_transaction updating one snapshot in place
+
+    python -m bench.lot_replay --transactions 10000000 --users 100000 --coins 20 --method fifo
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+workdir = tempfile.mkdtemp()
+os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'ledger.db')}"
+
+from server import crud, lots, models, schemas  # noqa: E402
+from server.database import SessionLocal, engine  # noqa: E402
+
+START = datetime(2024, 1, 1)
+CHUNK = 200_000
+
+
+def insert_trades(rng, args, count: int, first_second: int):
+    coins = [f"coin-{i}" for i in range(args.coins)]
+    inserted = 0
+    while inserted < count:
+        rows = []
+        for i in range(inserted, min(count, inserted + CHUNK)):
+            stamp = START + timedelta(seconds=first_second + i)
+            quantity = rng.uniform(0.1, 5) if rng.random() < 0.6 else -rng.uniform(0.1, 5)
+            rows.append((
+                rng.randint(1, args.users), 1, rng.choice(coins), "usd", rng.uniform(1, 1000), quantity, "bench", 1,
+                stamp.strftime("%Y-%m-%d %H:%M:%S.%f"),
+            ))
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                'INSERT INTO "transaction" (uid, wid, cid, cid_target, ex_rate, position, network, success, time_transaction)'
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        inserted += len(rows)
+
+
+def timed(label: str, fn, count: int):
+    started = time.perf_counter()
+    replayed = fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<36} {elapsed:9.2f} s  {replayed} trades replayed, {count / elapsed:,.0f} trades/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transactions", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--coins", type=int, default=20)
+    parser.add_argument("--method", choices=lots.METHODS, default="fifo")
+    parser.add_argument("--append", type=float, default=0.01, help="fraction of new trades for the catch-up run")
+    parser.add_argument("--records", type=int, default=1000, help="single transactions through crud")
+    args = parser.parse_args()
+
+    rng = random.Random(8)
+    models.Base.metadata.create_all(bind=engine)
+    started = time.perf_counter()
+    insert_trades(rng, args, args.transactions, 0)
+    print(f"{args.transactions} trades, {args.users} users x {args.coins} coins (generated in {time.perf_counter() - started:.0f}s)")
+
+    db = SessionLocal()
+    try:
+        timed(f"full rebuild ({args.method})", lambda: lots.rebuild(db, args.method), args.transactions)
+
+        appended = int(args.transactions * args.append)
+        insert_trades(rng, args, appended, args.transactions)
+        timed(f"catch-up after +{appended} trades", lambda: lots.catch_up(db, args.method), appended)
+
+        lots.LOT_METHOD = args.method
+        started = time.perf_counter()
+        for i in range(args.records):
+            crud.create_transaction(db, schemas.TransactionCreate(
+                uid=rng.randint(1, args.users), wid=1, cid=f"coin-{rng.randrange(args.coins)}", cid_target="usd",
+                ex_rate=rng.uniform(1, 1000), position=rng.uniform(0.1, 5), network="bench", success=True,
+                time_transaction=datetime.now(timezone.utc),
+            ))
+            db.commit()
+        elapsed = time.perf_counter() - started
+        print(f"{'crud.create_transaction':<36} {elapsed / args.records * 1000:9.2f} ms/transaction incl. snapshot update")
+    finally:
+        db.close()
@@ -0,0 +1,231 @@
+# bench/metrics_overhead.py
+"""
+Cost of the Prometheus instrumentation (server/metrics.py), and its aggregation across workers.
+
+1. Overhead: one uvicorn worker with METRICS_ENABLED=false, =true, and =true in multiprocess
+   mode (PROMETHEUS_MULTIPROC_DIR), --clients clients looping over GET /crypto/bitcoin (fresh
+   price from the database) and GET /portfolio/{uid}/value for --seconds. The configurations
+   take turns --rounds times; reports the median requests/sec, p50 latency and the server's
+   CPU time per request (from /proc, Linux only).
+2. Aggregation: --workers uvicorn workers on one PROMETHEUS_MULTIPROC_DIR, --requests requests,
+   each on a new connection so they spread over the workers; then the request count of one
+   scrape of /metrics against the number sent, with and without multiprocess mode.
+
+    python -m bench.metrics_overhead --clients 8 --seconds 10 --rounds 3
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+workdir = tempfile.mkdtemp()
+os.environ["LEADER_LOCK_DIR"] = workdir
+os.environ["PRICE_BUS_DIR"] = workdir
+
+# Sets up the database (and INGEST_IN_APP=false) on import
+from bench.async_load import free_port, percentile, populate  # noqa: E402
+
+CONFIGS = {
+    "metrics off": {"METRICS_ENABLED": "false"},
+    "metrics on": {"METRICS_ENABLED": "true"},
+    "metrics on, multiprocess": {"METRICS_ENABLED": "true", "PROMETHEUS_MULTIPROC_DIR": os.path.join(workdir, "prom")},
+}
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def start_server(env: dict, workers: int = 1):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server.main:app", "--port", str(port), "--log-level", "warning",
+         "--workers", str(workers)],
+        env=dict(os.environ, **env),
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            httpx.get(f"{base_url}/docs")
+            break
+        except httpx.TransportError:
+            time.sleep(0.1)
+    return server, base_url
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(10)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+async def client_loop(client, i: int, users: int, deadline: float, latencies: list):
+    n = i
+    while time.perf_counter() < deadline:
+        path = "/crypto/bitcoin" if n % 2 else f"/portfolio/{n % users + 1}/value"
+        n += 1
+        started = time.perf_counter()
+        (await client.get(path)).raise_for_status()
+        latencies.append(time.perf_counter() - started)
+
+
+async def load(base_url: str, clients: int, seconds: float, users: int):
+    latencies = []
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        # Warm up connections, pool and caches
+        await asyncio.gather(*(client.get("/crypto/bitcoin") for _ in range(clients)))
+        started = time.perf_counter()
+        deadline = started + seconds
+        await asyncio.gather(*(client_loop(client, i, users, deadline, latencies) for i in range(clients)))
+        elapsed = time.perf_counter() - started
+    return len(latencies), elapsed, sorted(latencies)
+
+
+def overhead(args):
+    results = {name: [] for name in CONFIGS}
+    for _ in range(args.rounds):
+        for name, env in CONFIGS.items():
+            server, base_url = start_server(env)
+            try:
+                cpu_before = cpu_seconds(server.pid)
+                count, elapsed, latencies = asyncio.run(load(base_url, args.clients, args.seconds, args.users))
+                cpu = cpu_seconds(server.pid) - cpu_before
+            finally:
+                stop_server(server)
+            results[name].append((count / elapsed, percentile(latencies, 0.5), cpu / count))
+    base = statistics.median(r[2] for r in results["metrics off"])
+    print(f"1. {args.clients} clients, {args.seconds:.0f}s x {args.rounds} rounds, medians")
+    for name, runs in results.items():
+        rate = statistics.median(r[0] for r in runs)
+        p50 = statistics.median(r[1] for r in runs)
+        cpu = statistics.median(r[2] for r in runs)
+        print(f"   {name:<26} {rate:8,.0f} req/s  p50 {p50 * 1000:6.2f} ms  "
+              f"server CPU {cpu * 1e6:6.0f} us/request ({(cpu / base - 1) * 100:+.1f}%)")
+    return base
+
+
+async def _bare_app(scope, receive, send):
+    scope["route"] = ROUTE
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+class _Route:
+    path = "/crypto/{coin_id}"
+
+
+ROUTE = _Route()
+
+
+def best_of(fn, runs: int = 5):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return min(samples)
+
+
+def instrumentation_cost(n: int) -> dict:
+    """
+    Seconds per request of the middleware and of the engine listeners, in this process's metrics mode.
+    """
+    from sqlalchemy import create_engine
+
+    from server import metrics
+
+    async def send(message):
+        pass
+
+    async def requests(app):
+        scope = {"type": "http", "method": "GET", "path": "/crypto/bitcoin"}
+        for _ in range(n):
+            await app(dict(scope), None, send)
+
+    middleware = metrics.MetricsMiddleware(_bare_app)
+    bare = best_of(lambda: asyncio.run(requests(_bare_app)))
+    wrapped = best_of(lambda: asyncio.run(requests(middleware)))
+
+    def statements(engine):
+        def run():
+            metrics._request_queries.set([0, 0.0])
+            for _ in range(n):
+                # One checkout, one statement, one checkin: the database side of GET /crypto/{coin_id}
+                with engine.connect() as conn:
+                    conn.exec_driver_sql("SELECT 1")
+        return run
+
+    plain_engine = create_engine(f"sqlite:///{os.path.join(workdir, 'cost.db')}")
+    instrumented_engine = create_engine(f"sqlite:///{os.path.join(workdir, 'cost.db')}")
+    metrics.instrument_engine(instrumented_engine, "bench")
+    plain = best_of(statements(plain_engine))
+    instrumented = best_of(statements(instrumented_engine))
+    return {"middleware": (wrapped - bare) / n, "database": (instrumented - plain) / n}
+
+
+def cost(args, server_cpu: float):
+    print(f"2. instrumentation cost per request, best of 5 x {args.iterations:,} (middleware; pool and cursor listeners "
+          f"around one statement)")
+    for name in ("metrics on", "metrics on, multiprocess"):
+        env = dict(os.environ, **CONFIGS[name])
+        output = subprocess.run([sys.executable, "-m", "bench.metrics_overhead", "--cost-only", str(args.iterations)],
+                                env=env, capture_output=True, text=True, check=True).stdout
+        middleware, database = (float(v) for v in output.split())
+        total = middleware + database
+        print(f"   {name:<26} middleware {middleware * 1e6:5.1f} us + database {database * 1e6:5.1f} us = "
+              f"{total * 1e6:5.1f} us, {total / server_cpu * 100:.1f}% of the server's CPU per request")
+
+
+def scraped_requests(text: str, route: str) -> int:
+    prefix = f'http_request_duration_seconds_count{{method="GET",route="{route}",status="200"}}'
+    return sum(int(float(line.rsplit(" ", 1)[1])) for line in text.splitlines() if line.startswith(prefix))
+
+
+def aggregation(args):
+    print(f"3. {args.workers} workers, {args.requests} requests to /crypto/{{coin_id}}")
+    for name in ("metrics on", "metrics on, multiprocess"):
+        env = dict(CONFIGS[name])
+        if "PROMETHEUS_MULTIPROC_DIR" in env:
+            env["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(dir=workdir)
+        server, base_url = start_server(env, args.workers)
+        try:
+            with httpx.Client(base_url=base_url, headers={"Connection": "close"}) as client:
+                for _ in range(args.requests):
+                    client.get("/crypto/bitcoin").raise_for_status()
+                scraped = scraped_requests(client.get("/metrics").text, "/crypto/{coin_id}")
+        finally:
+            stop_server(server)
+        print(f"   {name:<26} one scrape counts {scraped} of {args.requests}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--iterations", type=int, default=20_000)
+    parser.add_argument("--cost-only", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cost_only:
+        print(*instrumentation_cost(args.cost_only).values())
+        sys.exit()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    populate(args.users)
+    server_cpu = overhead(args)
+    cost(args, server_cpu)
+    aggregation(args)
@@ -0,0 +1,141 @@
+# bench/numeric_columns.py
+"""
+check_price_targets matching and portfolio valuation, String columns vs NUMERIC columns.
+
+"before" builds the legacy text schema and evaluates in Python with float() like the old crud code;
+"after" uses the current models and the SQL-side predicates/sums in alerts and crud
+(the "after" alert query only looks at the newest price per coin).
+
+    python -m bench.numeric_columns --prices 1000000 --coins 200 --alerts 1000 --users 1000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+workdir = tempfile.mkdtemp()
+AFTER_PATH = os.path.join(workdir, "after.db")
+BEFORE_PATH = os.path.join(workdir, "before.db")
+os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{AFTER_PATH}"
+
+from server import alerts, crud, models  # noqa: E402
+from server.database import SessionLocal, engine  # noqa: E402
+
+LEGACY_DDL = [
+    "CREATE TABLE price (pid INTEGER PRIMARY KEY, cid VARCHAR, current_price VARCHAR, time_stamp TIMESTAMP)",
+    "CREATE INDEX idx_price_cid_timestamp ON price (cid, time_stamp)",
+    "CREATE TABLE alert_subscription (asid INTEGER PRIMARY KEY, uid INTEGER, cid VARCHAR, subscription_active BOOLEAN)",
+    "CREATE TABLE price_alert_subscription (pasid INTEGER PRIMARY KEY, asid INTEGER, threshold VARCHAR)",
+    "CREATE TABLE portfolio (uid INTEGER, cid VARCHAR, quantity VARCHAR, PRIMARY KEY (uid, cid))",
+]
+
+
+def generate(args):
+    rng = random.Random(7)
+    coins = [f"coin-{i}" for i in range(args.coins)]
+    base = {c: rng.uniform(1, 1000) for c in coins}
+    prices = [
+        (i + 1, coins[i % args.coins], base[coins[i % args.coins]] * rng.uniform(0.8, 1.2), f"2024-01-01 00:{i // args.coins % 60:02d}:00")
+        for i in range(args.prices)
+    ]
+    subscriptions = [(i + 1, rng.randrange(args.users), rng.choice(coins)) for i in range(args.alerts)]
+    thresholds = [(i + 1, i + 1, base[subscriptions[i][2]] * rng.uniform(0.5, 1.5)) for i in range(args.alerts)]
+    holdings = [(uid, c, rng.uniform(0.1, 10)) for uid in range(args.users) for c in rng.sample(coins, 10)]
+    return prices, subscriptions, thresholds, holdings
+
+
+def build_before(data):
+    prices, subscriptions, thresholds, holdings = data
+    conn = sqlite3.connect(BEFORE_PATH)
+    for ddl in LEGACY_DDL:
+        conn.execute(ddl)
+    conn.executemany("INSERT INTO price VALUES (?, ?, ?, ?)", [(p, c, str(v), t) for p, c, v, t in prices])
+    conn.executemany("INSERT INTO alert_subscription VALUES (?, ?, ?, 1)", subscriptions)
+    conn.executemany("INSERT INTO price_alert_subscription VALUES (?, ?, ?)", [(a, b, str(t)) for a, b, t in thresholds])
+    conn.executemany("INSERT INTO portfolio VALUES (?, ?, ?)", [(u, c, str(q)) for u, c, q in holdings])
+    conn.commit()
+    return conn
+
+
+def build_after(data):
+    prices, subscriptions, thresholds, holdings = data
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "INSERT INTO price (pid, cid, current_price, time_stamp) VALUES (?, ?, ?, ?)", prices
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO alert_subscription (asid, uid, cid, subscription_active) VALUES (?, ?, ?, 1)", subscriptions
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO price_alert_subscription (pasid, asid, cid, threshold) VALUES (?, ?, ?, ?)",
+            [(pasid, asid, subscriptions[asid - 1][2], threshold) for pasid, asid, threshold in thresholds]
+        )
+        conn.exec_driver_sql("INSERT INTO portfolio (uid, cid, quantity) VALUES (?, ?, ?)", holdings)
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    print(f"{label:<40} {time.perf_counter() - start:8.3f} s  ({result})")
+
+
+def before_targets(conn):
+    rows = conn.execute(
+        "SELECT pas.threshold, p.current_price FROM price_alert_subscription pas"
+        " JOIN alert_subscription a ON pas.asid = a.asid"
+        " JOIN price p ON a.cid = p.cid WHERE a.subscription_active = 1"
+    )
+    matches = 0
+    for threshold, current_price in rows:
+        threshold, current_price = float(threshold), float(current_price)
+        if abs(current_price - threshold) / threshold <= 0.1:
+            matches += 1
+    return f"{matches} matches"
+
+
+def before_valuation(conn, users):
+    total = 0.0
+    for uid in range(users):
+        for cid, quantity in conn.execute("SELECT cid, quantity FROM portfolio WHERE uid = ?", (uid,)).fetchall():
+            price = conn.execute(
+                "SELECT current_price FROM price WHERE cid = ? ORDER BY time_stamp DESC LIMIT 1", (cid,)
+            ).fetchone()
+            if price:
+                total += float(quantity) * float(price[0])
+    return f"total {total:.2f}"
+
+
+def after_targets():
+    db = SessionLocal()
+    try:
+        return f"{len(alerts.find_triggered(db))} matches"
+    finally:
+        db.close()
+
+
+def after_valuation(users):
+    db = SessionLocal()
+    try:
+        return f"total {sum(crud.get_portfolio_value(db, uid) for uid in range(users)):.2f}"
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prices", type=int, default=1_000_000)
+    parser.add_argument("--coins", type=int, default=200)
+    parser.add_argument("--alerts", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    data = generate(args)
+    conn = build_before(data)
+    build_after(data)
+    timed("before: price targets (String + float())", lambda: before_targets(conn))
+    timed("after:  price targets (NUMERIC in SQL)", after_targets)
+    timed("before: portfolio valuation", lambda: before_valuation(conn, args.users))
+    timed("after:  portfolio valuation", lambda: after_valuation(args.users))
@@ -0,0 +1,104 @@
+# bench/portfolio_valuation.py
+"""
+Valuing every user's portfolio: per-user Python loop vs portfolio.value_all.
+
+"before" is what the dashboard did per user: load the Portfolio rows, look up each coin's
+latest price and sum quantity * price in Python (value only, no P&L). It runs on a sample of
+users and is extrapolated. "after" values all users, including cost basis and P&L, in one pass.
+
+    python -m bench.portfolio_valuation --users 100000 --holdings 50 --coins 500
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+workdir = tempfile.mkdtemp()
+os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'portfolio.db')}"
+
+from server import crud, models, portfolio  # noqa: E402
+from server.database import SessionLocal, engine  # noqa: E402
+
+CHUNK_USERS = 2000
+
+
+def generate(args):
+    rng = random.Random(11)
+    coins = [f"coin-{i}" for i in range(args.coins)]
+    base = {c: rng.uniform(0.01, 5000) for c in coins}
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "INSERT INTO price (cid, current_price, price_change_24h, time_stamp) VALUES (?, ?, ?, ?)",
+            [(c, p, p * rng.uniform(-0.1, 0.1), "2026-01-01 00:00:00.000000") for c, p in base.items()],
+        )
+    trades = 0
+    for first in range(1, args.users + 1, CHUNK_USERS):
+        holdings, transactions = [], []
+        for uid in range(first, min(first + CHUNK_USERS, args.users + 1)):
+            for cid in rng.sample(coins, args.holdings):
+                bought = rng.uniform(0.1, 10)
+                transactions.append((uid, cid, bought, base[cid] * rng.uniform(0.5, 1.5), 1, "2025-01-01 00:00:00.000000"))
+                quantity = bought
+                if rng.random() < args.sell_ratio:
+                    sold = bought * rng.uniform(0.1, 0.9)
+                    transactions.append((uid, cid, -sold, base[cid] * rng.uniform(0.5, 1.5), 1, "2025-06-01 00:00:00.000000"))
+                    quantity -= sold
+                holdings.append((uid, cid, quantity))
+        with engine.begin() as conn:
+            conn.exec_driver_sql("INSERT INTO portfolio (uid, cid, quantity) VALUES (?, ?, ?)", holdings)
+            conn.exec_driver_sql(
+                'INSERT INTO "transaction" (uid, cid, position, ex_rate, success, time_transaction) VALUES (?, ?, ?, ?, ?, ?)',
+                transactions,
+            )
+        trades += len(transactions)
+    return trades
+
+
+def before(users: list):
+    db = SessionLocal()
+    try:
+        total = 0.0
+        for uid in users:
+            for entry in crud.get_portfolio_by_uid(db, uid):
+                price = crud.get_latest_price(db, entry.cid)
+                if price is not None:
+                    total += entry.quantity * price.current_price
+        return total
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--holdings", type=int, default=50)
+    parser.add_argument("--coins", type=int, default=500)
+    parser.add_argument("--sell-ratio", type=float, default=0.2)
+    parser.add_argument("--sample", type=int, default=200, help="users timed for the per-user loop")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    trades = generate(args)
+    print(f"{args.users} users x {args.holdings} holdings, {trades} trades (generated in {time.perf_counter() - started:.0f}s)")
+
+    sample = random.Random(1).sample(range(1, args.users + 1), min(args.sample, args.users))
+    started = time.perf_counter()
+    before(sample)
+    elapsed = time.perf_counter() - started
+    print(f"before: per-user loop            {elapsed / len(sample) * 1000:8.2f} ms/user, "
+          f"~{elapsed / len(sample) * args.users:.0f} s for all users (value only)")
+
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        columns = portfolio._load(db)
+        loaded = time.perf_counter()
+        valuation = portfolio.evaluate(*columns)
+        done = time.perf_counter()
+    finally:
+        db.close()
+    print(f"after:  value_all                {done - started:8.2f} s for {len(valuation)} users "
+          f"(load {loaded - started:.2f} s, NumPy {done - loaded:.2f} s)")
+    print(f"        total value {valuation.total_value.sum():,.2f}, realized {valuation.total_realized.sum():,.2f}")
@@ -0,0 +1,130 @@
+# bench/price_fanout.py
+"""
+Price push fan-out to --subscribers simulated subscribers in one worker.
+
+Each subscriber follows 1-3 of --coins coins and runs the same loop as a /ws/prices connection,
+minus the socket write; --slow of them take 3 tick intervals per message, to exercise
+drop-to-latest. Every tick changes all coins and goes through price_stream.publish(), i.e. over
+the unix socket bus to this process's broker. Reports the cost of a tick, the delay until the
+fast subscribers have their message, drops and memory. For comparison, the database time of
+the polling model, where every subscriber reads its coins from GET /crypto/{coin_id} each tick.
+
+    python -m bench.price_fanout --subscribers 10000 --ticks 50
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import tempfile
+import time
+from datetime import datetime, timezone
+
+workdir = tempfile.mkdtemp()
+os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'fanout.db')}"
+os.environ["PRICE_BUS_DIR"] = workdir
+
+from sqlalchemy import insert  # noqa: E402
+
+from server import crud, models, price_stream  # noqa: E402
+from server.database import SessionLocal, engine  # noqa: E402
+
+published_at = {}
+
+
+async def consumer(sub, slow_delay, delays: list):
+    while True:
+        message = await sub.next_message()
+        tick = int(message.rsplit('"tick":', 1)[1].split("}", 1)[0])
+        if slow_delay:
+            await asyncio.sleep(slow_delay)
+        else:
+            delays.append(time.perf_counter() - published_at[tick])
+
+
+def prices(coins, tick):
+    return {cid: {"coin_id": cid, "current_price": 100.0 + tick, "tick": tick} for cid in coins}
+
+
+async def run(args, coins, rng):
+    await price_stream.bus.start()
+    delays, tasks, contexts = [], [], []
+    for i in range(args.subscribers):
+        context = price_stream.subscription(rng.sample(coins, rng.randint(1, 3)))
+        contexts.append(context)
+        slow = i < args.subscribers * args.slow
+        tasks.append(asyncio.create_task(consumer(context.__enter__(), 3 * args.interval if slow else 0, delays)))
+    rss_subscribed = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    publish_times = []
+    fan_out = price_stream.broker.publish
+
+    def timed_fan_out(tick_prices):
+        started = time.perf_counter()
+        fan_out(tick_prices)
+        publish_times.append(time.perf_counter() - started)
+
+    price_stream.broker.publish = timed_fan_out  # called by the bus when the tick arrives
+    for tick in range(args.ticks):
+        published_at[tick] = time.perf_counter()
+        await price_stream.publish(prices(coins, tick))
+        await asyncio.sleep(args.interval)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for context in contexts:
+        context.__exit__(None, None, None)
+    price_stream.bus.close()
+    return delays, publish_times, rss_subscribed
+
+
+def polling_cost(coins, rng, subscribers):
+    """
+    Database time of one polling round: every subscriber reads each of its coins.
+    """
+    db = SessionLocal()
+    reads = [cid for _ in range(subscribers) for cid in rng.sample(coins, rng.randint(1, 3))]
+    started = time.perf_counter()
+    for cid in reads:
+        crud.get_latest_price(db, cid)
+    db.close()
+    return len(reads), time.perf_counter() - started
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, default=10_000)
+    parser.add_argument("--coins", type=int, default=50)
+    parser.add_argument("--ticks", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=0.2, help="seconds between ticks")
+    parser.add_argument("--slow", type=float, default=0.05, help="fraction of slow subscribers")
+    args = parser.parse_args()
+
+    coins = [f"coin-{i}" for i in range(args.coins)]
+    rng = random.Random(3)
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    cpu_start = time.process_time()
+    delays, publish_times, rss_subscribed = asyncio.run(run(args, coins, rng))
+    cpu = time.process_time() - cpu_start
+    stats = price_stream.stats
+    print(f"{args.subscribers} subscribers ({args.slow:.0%} slow), {args.coins} coins, {args.ticks} ticks every {args.interval}s")
+    print(f"broker fan-out per tick      p50 {percentile(publish_times, 0.5) * 1000:6.1f} ms  max {max(publish_times) * 1000:6.1f} ms")
+    print(f"delivery delay, fast subs    p50 {percentile(delays, 0.5) * 1000:6.1f} ms  p99 {percentile(delays, 0.99) * 1000:6.1f} ms"
+          f"  ({len(delays):,} messages)")
+    print(f"pushed {stats['pushed']:,} coin updates, dropped {stats['dropped']:,} for slow subscribers, "
+          f"CPU {cpu / args.ticks * 1000:.1f} ms/tick, "
+          f"{(rss_subscribed - rss_start) * 1024 / args.subscribers:,.0f} bytes/subscriber")
+
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.Price), [{
+            "cid": cid, "current_price": 100.0, "time_stamp": datetime.now(timezone.utc),
+        } for cid in coins for _ in range(100)])
+    reads, elapsed = polling_cost(coins, rng, args.subscribers)
+    print(f"polling instead: {reads:,} GET /crypto reads per round, {elapsed * 1000:,.0f} ms of database time alone "
+          f"(push: 1 upstream read per tick)")
@@ -0,0 +1,204 @@
+# bench/profiling.py
+"""
+Cost of request profiling and the slow-query log (server/profiling.py), and what they capture.
+
+1. End to end: one uvicorn worker with PROFILE_SAMPLE_RATE=0, 0.01 and 1 (every request
+   profiled), --clients clients looping over GET /crypto/bitcoin and GET /portfolio/{uid}/value
+   for --seconds, the rates taking turns --rounds times. Median requests/sec, p50 and server
+   CPU per request, as in bench/metrics_overhead.py, plus PROFILING_ENABLED=false.
+2. In process, best of 5 x --iterations: the middleware on a request that isn't profiled, the
+   cursor listeners around one statement, and one stack sample of a request waiting on a
+   threadpool thread.
+3. An admin's X-Debug-Profile request to GET /portfolio/{uid}/summary: the functions its
+   samples end in, its statements, and the slow-query log with SLOW_QUERY_MS=0.25.
+
+    python -m bench.profiling --clients 8 --seconds 10 --rounds 3
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+
+import httpx
+
+from bench.async_load import percentile, populate
+from bench.metrics_overhead import best_of, cpu_seconds, load, start_server, stop_server, workdir
+
+CONFIGS = {
+    "profiling disabled": {"PROFILING_ENABLED": "false"},
+    "sample rate 0": {"PROFILE_SAMPLE_RATE": "0"},
+    "sample rate 0.01": {"PROFILE_SAMPLE_RATE": "0.01"},
+    "sample rate 1": {"PROFILE_SAMPLE_RATE": "1"},
+}
+
+
+def end_to_end(args):
+    results = {name: [] for name in CONFIGS}
+    for _ in range(args.rounds):
+        for name, env in CONFIGS.items():
+            server, base_url = start_server(dict(env, SLOW_QUERY_MS="250"))
+            try:
+                cpu_before = cpu_seconds(server.pid)
+                count, elapsed, latencies = asyncio.run(load(base_url, args.clients, args.seconds, args.users))
+                cpu = cpu_seconds(server.pid) - cpu_before
+            finally:
+                stop_server(server)
+            results[name].append((count / elapsed, percentile(latencies, 0.5), cpu / count))
+    base = statistics.median(r[2] for r in results["profiling disabled"])
+    print(f"1. {args.clients} clients, {args.seconds:.0f}s x {args.rounds} rounds, medians")
+    for name, runs in results.items():
+        rate = statistics.median(r[0] for r in runs)
+        p50 = statistics.median(r[1] for r in runs)
+        cpu = statistics.median(r[2] for r in runs)
+        print(f"   {name:<20} {rate:8,.0f} req/s  p50 {p50 * 1000:6.2f} ms  "
+              f"server CPU {cpu * 1e6:6.0f} us/request ({(cpu / base - 1) * 100:+.1f}%)")
+    return base
+
+
+class _Route:
+    path = "/crypto/{coin_id}"
+
+
+async def _bare_app(scope, receive, send):
+    scope["route"] = _Route
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+def in_process(args, server_cpu: float):
+    from sqlalchemy import create_engine
+
+    from server import metrics, profiling
+
+    n = args.iterations
+    profiling.PROFILE_SAMPLE_RATE = 0
+
+    async def send(message):
+        pass
+
+    async def requests(app):
+        scope = {"type": "http", "method": "GET", "path": "/crypto/bitcoin",
+                 "headers": [(b"host", b"localhost"), (b"accept", b"*/*"), (b"user-agent", b"bench")]}
+        for _ in range(n):
+            await app(dict(scope), None, send)
+
+    middleware = profiling.ProfilingMiddleware(_bare_app)
+    unprofiled = best_of(lambda: asyncio.run(requests(middleware))) - best_of(lambda: asyncio.run(requests(_bare_app)))
+
+    def statements(engine):
+        def run():
+            for _ in range(n):
+                with engine.connect() as conn:
+                    conn.exec_driver_sql("SELECT 1")
+        return run
+
+    engines = [create_engine(f"sqlite:///{os.path.join(workdir, 'cost.db')}") for _ in range(4)]
+    profiling.instrument_engine(engines[1], "bench")
+    for metered in engines[2:]:
+        metrics.instrument_engine(metered, "bench")
+    profiling.instrument_engine(engines[3], "bench")
+    # Taking turns, as the machine's speed drifts
+    timings = [[] for _ in engines]
+    for _ in range(5):
+        for engine, samples in zip(engines, timings):
+            samples.append(best_of(statements(engine), 1))
+    plain, alone, metered, both = (min(samples) for samples in timings)
+    listeners, on_metrics = alone - plain, both - metered
+
+    # A profiled request blocked on a threadpool thread, as a sync route is, about as deep as one
+    # through the app (middleware, routing, dependencies) and its handler
+    release = threading.Event()
+
+    def handler(depth=10):
+        if depth:
+            return handler(depth - 1)
+        release.wait()
+
+    async def sampled():
+        from starlette.concurrency import run_in_threadpool
+
+        async def route(depth=25):
+            if depth:
+                return await route(depth - 1)
+            await run_in_threadpool(handler)
+
+        task = asyncio.create_task(route())
+        await asyncio.sleep(0.05)
+        profile = profiling.Profile({"method": "GET", "path": "/"}, "bench")
+        profile.task, profile.frame = task, task.get_coro().cr_frame
+        per_sample = best_of(lambda: [profile.sample(sys._current_frames()) for _ in range(n // 10)]) / (n // 10)
+        release.set()
+        await task
+        return per_sample, profile
+
+    per_sample, profile = asyncio.run(sampled())
+    stack = next(iter(profile.collapsed_stacks())).split(";")
+    print(f"2. in process, best of 5 x {n:,}")
+    print(f"   request not profiled       {unprofiled / n * 1e6:6.2f} us")
+    print(f"   cursor listeners           {listeners / n * 1e6:6.2f} us per statement, "
+          f"{on_metrics / n * 1e6:.2f} us on top of the metrics listeners")
+    print(f"   one stack sample           {per_sample * 1e6:6.2f} us ({len(stack)} frames, ending in {stack[-1]})")
+    samples_per_request = server_cpu / profiling.PROFILE_INTERVAL
+    at_one_percent = 0.01 * samples_per_request * per_sample
+    for label, cost in (("alone", listeners), ("with metrics on", on_metrics)):
+        per_request = (unprofiled + cost) / n + at_one_percent
+        print(f"   => at 1% sampling, one statement per request, {label}: {per_request * 1e6:.1f} us, "
+              f"{per_request / server_cpu * 100:.2f}% of {server_cpu * 1e6:.0f} us per request")
+    print(f"      (a profiled request of that length takes ~{samples_per_request:.1f} samples)")
+
+
+def capture(args):
+    from sqlalchemy import insert
+
+    from server import auth, models
+    from server.database import engine
+
+    with engine.begin() as conn:
+        conn.execute(insert(models.User).values(email="admin@example.com", username="admin", hashed_password="x",
+                                                role="admin", deactivated=False,
+                                                time_registered=datetime.now(timezone.utc)))
+        uid = conn.execute(models.User.__table__.select().where(models.User.email == "admin@example.com")).first().uid
+    engine.dispose()
+    headers = {"Authorization": f"Bearer {auth.create_access_token({'sub': 'admin@example.com', 'uid': uid, 'role': 'admin'})}"}
+    server, base_url = start_server({"SLOW_QUERY_MS": "0.25", "PROFILE_INTERVAL": "0.001"})
+    try:
+        with httpx.Client(base_url=base_url, headers=headers) as client:
+            response = client.get("/portfolio/1/summary", headers={"X-Debug-Profile": "1"})
+            profile = client.get(f"/debug/profiles/{response.headers['x-profile-id']}").json()
+            slow = client.get("/debug/slow-queries").json()
+    finally:
+        stop_server(server)
+    print(f"3. GET /portfolio/1/summary with X-Debug-Profile: {profile['duration_ms']:.1f} ms, "
+          f"{profile['samples']} samples, {profile['query_count']} statements in {profile['query_ms']:.1f} ms")
+    leaves = Counter()
+    for stack, count in profile["stacks"].items():
+        leaves[stack.rsplit(";", 1)[-1]] += count
+    for leaf, count in leaves.most_common(5):
+        print(f"   {count:4} samples in {leaf}")
+    for query in profile["queries"]:
+        print(f"   {query['ms']:7.2f} ms at {query['at_ms']:7.2f} ms  {' '.join(query['statement'].split())[:90]}")
+    print(f"   slow-query log (SLOW_QUERY_MS=0.25): {len(slow['queries'])} statements")
+    for query in slow["queries"][:2]:
+        print(f"   {query['ms']:7.2f} ms {query['route']}: {' '.join(query['statement'].split())[:70]}")
+        print(f"           plan {query['plan']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--iterations", type=int, default=20_000)
+    args = parser.parse_args()
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    populate(args.users)
+    server_cpu = end_to_end(args)
+    in_process(args, server_cpu)
+    capture(args)
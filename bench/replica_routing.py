@@ -0,0 +1,133 @@
+# bench/replica_routing.py
+"""
+Read replica routing on two local SQLite files: a primary and a replica that a background
+thread refreshes with SQLite's backup API every --sync-interval seconds, standing in for
+replication. Checks, through the app:
+
+  1. reads go to the replica once its heartbeat is fresh (and how fast they are);
+  2. read-your-writes: after a POST the writing client reads its row from the primary while
+     the replica, paused, does not have it yet; a client without the cookie reads the replica;
+  3. with replication stopped the replica falls out of rotation after REPLICA_MAX_LAG and
+     reads fall back to the primary, then it comes back once replication resumes.
+
+    python -m bench.replica_routing
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+workdir = tempfile.mkdtemp()
+PRIMARY = os.path.join(workdir, "primary.db")
+REPLICA = os.path.join(workdir, "replica.db")
+os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{PRIMARY}"
+os.environ["SQLALCHEMY_REPLICA_URLS"] = f"sqlite:///{REPLICA}"
+os.environ.setdefault("REPLICA_MAX_LAG", "3")
+os.environ.setdefault("REPLICA_CHECK_INTERVAL", "0.2")
+os.environ["INGEST_IN_APP"] = "false"
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+from server import models, replicas  # noqa: E402
+from server.database import engine  # noqa: E402
+from server.main import app  # noqa: E402
+
+START = datetime(2024, 1, 1)
+
+
+class Replication(threading.Thread):
+    def __init__(self, interval: float):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.running = threading.Event()
+        self.running.set()
+
+    def copy(self):
+        source, target = sqlite3.connect(PRIMARY), sqlite3.connect(REPLICA, timeout=10)
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+            target.close()
+
+    def run(self):
+        while True:
+            if self.running.is_set():
+                self.copy()
+            time.sleep(self.interval)
+
+
+def wait_for(condition, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("condition not reached")
+        time.sleep(0.05)
+
+
+def transaction(i: int):
+    return {"uid": 1, "wid": 1, "cid": f"coin-{i % 5}", "cid_target": "usd", "ex_rate": 100.0, "position": 1.0,
+            "network": "bench", "success": True, "time_transaction": (START + timedelta(seconds=i)).isoformat()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--reads", type=int, default=500)
+    parser.add_argument("--sync-interval", type=float, default=0.3)
+    args = parser.parse_args()
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.Transaction), [
+            dict(transaction(i), time_transaction=START + timedelta(seconds=i)) for i in range(args.rows)
+        ])
+    replication = Replication(args.sync_interval)
+    replication.copy()
+    replica = replicas.replicas[0]
+
+    with TestClient(app) as client:
+        replication.start()
+        wait_for(lambda: replica.healthy)
+
+        before = dict(replicas.stats)
+        started = time.perf_counter()
+        for _ in range(args.reads):
+            client.get("/transaction/1", params={"limit": 100}).raise_for_status()
+        elapsed = time.perf_counter() - started
+        print(f"1. {args.reads} reads: {replicas.stats['replica_reads'] - before['replica_reads']} on the replica, "
+              f"{replicas.stats['fallback_reads'] - before['fallback_reads']} fell back "
+              f"({args.reads / elapsed:,.0f} requests/s, replica lag {replica.lag}s)")
+
+        replication.running.clear()
+        time.sleep(args.sync_interval * 2)  # let a copy in progress finish
+        response = client.post("/transaction/", json=transaction(args.rows))
+        response.raise_for_status()
+        cookie = client.cookies.get(replicas.STICKY_COOKIE)
+        client.cookies.clear()
+
+        def newest(headers=None):
+            rows = client.get("/transaction/1", params={"format": "ndjson"}, headers=headers).text.splitlines()
+            return len(rows)
+
+        print(f"2. after a write (cookie {'set' if cookie else 'MISSING'}): writer sees {newest({'Cookie': f'{replicas.STICKY_COOKIE}={cookie}'})} rows, "
+              f"other clients see {newest()} rows (primary has {args.rows + 1})")
+
+        before = dict(replicas.stats)
+        wait_for(lambda: not replica.healthy)
+        stale_after = replica.lag
+        for _ in range(20):
+            client.get("/portfolio/1/value").raise_for_status()
+        print(f"3. replication stopped: out of rotation at lag {stale_after}s, "
+              f"{replicas.stats['fallback_reads'] - before['fallback_reads']}/20 reads fell back to the primary")
+        replication.running.set()
+        started = time.monotonic()
+        wait_for(lambda: replica.healthy)
+        print(f"   replication resumed: back in rotation after {time.monotonic() - started:.1f}s, "
+              f"replica now has {newest()} rows")
@@ -0,0 +1,152 @@
+# bench/scheduler.py
+"""
+The scheduler inside the API: --workers uvicorn workers, all with SCHEDULER_IN_APP, against
+the fake upstream, with --clients clients loading the API meanwhile. Jobs get short intervals
+and the set-based alert job runs (ALERT_STREAM_ENABLED=false) over --alerts alerts on --coins
+coins, whose fake 24h changes make some volatile and some calm.
+
+Checks that each job ran in exactly one worker (ingest runs x coins = Price rows), and reports
+per job the runs, coalesced slots, run time and lag, and how many coin evaluations the per-coin
+cadence saved over evaluating every coin each run.
+
+    python -m bench.scheduler --workers 3 --seconds 30
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+workdir = tempfile.mkdtemp()
+os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'scheduler.db')}"
+os.environ["LEADER_LOCK_DIR"] = workdir
+os.environ["PRICE_BUS_DIR"] = workdir
+
+from sqlalchemy import func, insert, select  # noqa: E402
+
+from server import models  # noqa: E402
+from server.database import engine  # noqa: E402
+from server.fake_upstream import start_fake_upstream  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def populate(coins: list, alerts: int):
+    models.Base.metadata.create_all(bind=engine)
+    rng = random.Random(5)
+    now = datetime.now(timezone.utc)
+    with engine.begin() as conn:
+        conn.execute(insert(models.AlertSubscription), [{
+            "asid": asid, "uid": asid % 1000 + 1, "cid": rng.choice(coins), "alert_type": "price",
+            "time_subscribed": now, "subscription_active": True,
+        } for asid in range(1, alerts + 1)])
+        conn.execute(insert(models.PriceAlertSubscription), [{
+            "asid": asid, "threshold": rng.uniform(0.1, 50000), "threshold_percentage": 5,
+        } for asid in range(1, alerts + 1)])
+    engine.dispose()
+
+
+async def load(base_url: str, clients: int, deadline: float):
+    async def client_loop(client):
+        count = 0
+        while time.monotonic() < deadline:
+            await client.get("/portfolio/1/value")
+            count += 1
+        return count
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        return sum(await asyncio.gather(*(client_loop(client) for _ in range(clients))))
+
+
+def collect(base_url: str, workers: int) -> dict:
+    """
+    /scheduler/stats of every worker, by pid.
+    """
+    views = {}
+    for _ in range(50 * workers):
+        # A new connection each time, so that any worker may accept it
+        view = httpx.get(f"{base_url}/scheduler/stats", headers={"Connection": "close"}).json()
+        views[view["pid"]] = view["jobs"]
+        if len(views) == workers:
+            break
+    return views
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--interval", type=float, default=0.5, help="ingest and alert evaluation interval")
+    parser.add_argument("--coins", type=int, default=50)
+    parser.add_argument("--alerts", type=int, default=20_000)
+    parser.add_argument("--clients", type=int, default=8)
+    args = parser.parse_args()
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    coins = [f"coin-{i}" for i in range(args.coins)]
+    populate(coins, args.alerts)
+    upstream, _ = start_fake_upstream()
+    port = free_port()
+    env = dict(
+        os.environ, INGEST_IN_APP="true", COINGECKO_API_URL=f"http://127.0.0.1:{upstream.server_address[1]}",
+        INGEST_COINS=",".join(coins), INGEST_INTERVAL=str(args.interval), ALERT_STREAM_ENABLED="false",
+        ALERT_EVAL_INTERVAL=str(args.interval), ALERT_CALM_INTERVAL=str(args.interval * 10),
+        ROLLUP_INTERVAL="5", MESSAGE_PRUNE_INTERVAL="10", HASH_WORKERS="0",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server.main:app", "--port", str(port), "--workers", str(args.workers),
+         "--log-level", "warning"], env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(100):
+            try:
+                httpx.get(f"{base_url}/scheduler/stats")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        started = time.monotonic()
+        requests = asyncio.run(load(base_url, args.clients, started + args.seconds))
+        elapsed = time.monotonic() - started
+        views = collect(base_url, args.workers)
+    finally:
+        server.terminate()
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+        upstream.shutdown()
+
+    print(f"{args.workers} workers, {elapsed:.0f} s, {requests / elapsed:,.0f} API requests/s alongside, "
+          f"stats from {len(views)} workers")
+    for name in next(iter(views.values())):
+        leaders = [pid for pid, jobs in views.items() if jobs[name]["leader"]]
+        job = views[leaders[0]][name] if len(leaders) == 1 else None
+        if job is None:
+            print(f"  {name:<18} leaders: {leaders or 'none'}")
+            continue
+        ms = lambda value: "-" if value is None else f"{value * 1000:g}"
+        print(f"  {name:<18} 1 leader (pid {leaders[0]}), every {job['interval']:g}s: {job['runs']} runs, "
+              f"{job['failures']} failed, {job['coalesced']} coalesced, run time p50 <= {ms(job['runtime']['p50'])} ms "
+              f"p99 <= {ms(job['runtime']['p99'])} ms, lag p50 <= {ms(job['lag']['p50'])} ms p99 <= {ms(job['lag']['p99'])} ms")
+        if name == "ingest":
+            with engine.connect() as conn:
+                rows = conn.execute(select(func.count()).select_from(models.Price)).scalar()
+            print(f"  {'':<18} {rows} Price rows: {rows / args.coins:g} polls of {args.coins} coins (the last ones after the stats)")
+        if job.get("details"):
+            details = job["details"]
+            print(f"  {'':<18} {details['evaluated']} coin evaluations instead of {details['evaluated'] + details['skipped']} "
+                  f"without the cadence, {details['fired']} alerts fired")
@@ -0,0 +1,122 @@
+# bench/serialization.py
+"""
+Serialization cost per row of the read routes, by mode.
+
+For each endpoint: fetching the rows as ORM objects (the old routes) vs Core tuples, then
+encoding them the old way (jsonable_encoder over the ORM objects, or response_model validation
+for lots) and in each serialization mode. Best of --repeat runs, in microseconds per row.
+
+    python -m bench.serialization
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+workdir = tempfile.mkdtemp()
+os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'serialization.db')}"
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+from sqlalchemy import insert, select  # noqa: E402
+
+from server import listing, models, schemas, serialization  # noqa: E402
+from server.database import SessionLocal, engine  # noqa: E402
+
+START = datetime(2024, 1, 1)
+UID = 1
+
+
+def populate(rng, args):
+    with engine.begin() as conn:
+        conn.execute(insert(models.Transaction), [{
+            "uid": UID, "wid": 1, "cid": f"coin-{rng.randrange(50)}", "cid_target": "usd",
+            "ex_rate": rng.uniform(1, 1000), "position": rng.uniform(-5, 5), "network": "bench",
+            "success": True, "time_transaction": START + timedelta(seconds=i),
+        } for i in range(args.rows)])
+        conn.execute(insert(models.Wallet), [{
+            "uid": UID, "wname": f"wallet {i}", "address": f"0x{i:040x}", "time_added": START, "time_accessed": START,
+        } for i in range(args.rows)])
+        conn.execute(insert(models.Portfolio), [{
+            "uid": UID, "cid": f"coin-{i}", "quantity": rng.uniform(0, 100), "time_created": START,
+        } for i in range(args.rows)])
+        conn.execute(insert(models.LotSnapshot), [{
+            "uid": UID, "cid": f"coin-{i}", "method": "fifo", "quantity": 10.0, "cost_basis": 1000.0, "realized_pnl": 0.0,
+            "lots": [[0.5, rng.uniform(1, 1000), (START + timedelta(days=j)).isoformat()] for j in range(20)],
+            "last_tid": i, "last_time": START, "stale": False, "time_updated": START,
+        } for i in range(args.rows)])
+
+
+def candles(rng, count):
+    return {
+        "coin_id": "bitcoin", "interval": "1m", "source": "1m",
+        "candles": [{
+            "time": (START + timedelta(minutes=i)).isoformat(), "open": rng.uniform(1, 1e5), "high": rng.uniform(1, 1e5),
+            "low": rng.uniform(1, 1e5), "close": rng.uniform(1, 1e5), "volume": rng.uniform(1, 1e9), "samples": 60,
+        } for i in range(count)],
+    }
+
+
+def best(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def old_encode(content, response_model=None):
+    if response_model is not None:
+        # FastAPI with response_model: validate the ORM objects' attributes, then dump
+        adapter = TypeAdapter(List[response_model])
+        return adapter.dump_json(adapter.validate_python(content, from_attributes=True))
+    # Without: jsonable_encoder, then JSONResponse.render
+    return serialization._encode(jsonable_encoder(content)).encode()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    rng = random.Random(5)
+    populate(rng, args)
+    db = SessionLocal()
+    lot_table = models.LotSnapshot.__table__
+
+    endpoints = [
+        # name, ORM query, Core query, schema, old route's response_model
+        ("transaction", select(models.Transaction).where(models.Transaction.uid == UID),
+         listing.query("transaction", UID), schemas.TransactionOut, None),
+        ("wallet", select(models.Wallet).where(models.Wallet.uid == UID), listing.query("wallet", UID), schemas.WalletOut, None),
+        ("portfolio", select(models.Portfolio).where(models.Portfolio.uid == UID),
+         listing.query("portfolio", UID), schemas.PortfolioOut, None),
+        ("lots", select(models.LotSnapshot).where(models.LotSnapshot.uid == UID),
+         select(*(lot_table.c[name] for name in schemas.LotPositionOut.model_fields)).where(lot_table.c.uid == UID),
+         schemas.LotPositionOut, schemas.LotPositionOut),
+    ]
+    print(f"{args.rows} rows per endpoint, µs/row (best of {args.repeat})")
+    print(f"{'endpoint':<12} {'ORM fetch':>10} {'Core fetch':>11} {'old encode':>11} {'encoder':>8} {'validated':>10} {'raw':>8}")
+    for name, orm_query, core_query, schema, response_model in endpoints:
+        def orm_fetch():
+            db.expunge_all()
+            return db.execute(orm_query).scalars().all()
+        orm_time, objects = best(orm_fetch, args.repeat)
+        core_time, rows = best(lambda: serialization.rows(db.execute(core_query)), args.repeat)
+        encoded = [best(lambda: old_encode(objects, response_model), args.repeat)[0]]
+        encoded += [best(lambda: serialization.dumps(rows, schema, mode), args.repeat)[0] for mode in serialization.MODES]
+        print(f"{name:<12} {orm_time / len(rows) * 1e6:10.2f} {core_time / len(rows) * 1e6:11.2f} "
+              + " ".join(f"{t / len(rows) * 1e6:{w}.2f}" for t, w in zip(encoded, (11, 8, 10, 8))))
+
+    content = candles(rng, args.rows)
+    encoded = [best(lambda: old_encode(content), args.repeat)[0]]
+    encoded += [best(lambda: serialization.dumps(content, None, mode), args.repeat)[0] for mode in serialization.MODES]
+    print(f"{'history':<12} {'':>10} {'':>11} " + " ".join(f"{t / args.rows * 1e6:{w}.2f}" for t, w in zip(encoded, (11, 8, 10, 8)))
+          + "  (candles are dicts, validated falls back to encoder)")
+    db.close()
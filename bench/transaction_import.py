@@ -0,0 +1,91 @@
+# bench/transaction_import.py
+"""
+Importing transaction history: POST /transaction/ per record vs the streamed bulk import.
+
+"before" posts a sample of the records one by one (transaction, portfolio update and message,
+each committed) and is extrapolated to the whole file. "after" streams the whole file as one
+CSV upload to POST /transaction/import.
+
+    python -m bench.transaction_import --transactions 1000000 --users 10000 --coins 50
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+workdir = tempfile.mkdtemp()
+os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'import.db')}"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from server import models, transaction_import  # noqa: E402
+from server.database import engine  # noqa: E402
+from server.main import app  # noqa: E402
+
+START = datetime(2019, 1, 1)
+UPLOAD_CHUNK = 64 * 1024
+
+
+def records(rng, args):
+    """
+    Exchange-like history: sells only ever close part of what the user holds.
+    """
+    coins = [f"coin-{i}" for i in range(args.coins)]
+    held = {}
+    for i in range(args.transactions):
+        uid, cid = rng.randint(1, args.users), rng.choice(coins)
+        holding = held.get((uid, cid), 0.0)
+        quantity = -holding * rng.uniform(0.1, 1) if holding and rng.random() < 0.4 else rng.uniform(0.1, 5)
+        held[(uid, cid)] = holding + quantity
+        yield {
+            "uid": uid, "wid": 1, "cid": cid, "cid_target": "usd",
+            "ex_rate": round(rng.uniform(1, 1000), 8), "position": round(quantity, 8), "network": "bench",
+            "success": True, "time_transaction": (START + timedelta(seconds=i * 60)).isoformat(),
+        }
+
+
+def write_csv(path: str, rows):
+    with open(path, "w") as f:
+        f.write(",".join(transaction_import.COLUMNS) + "\n")
+        for row in rows:
+            f.write(",".join(str(row[name]).lower() if name == "success" else str(row[name]) for name in transaction_import.COLUMNS) + "\n")
+
+
+def upload(path: str):
+    with open(path, "rb") as f:
+        while chunk := f.read(UPLOAD_CHUNK):
+            yield chunk
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transactions", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--coins", type=int, default=50)
+    parser.add_argument("--sample", type=int, default=500, help="records posted one by one")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    rng = random.Random(12)
+    path = os.path.join(workdir, "history.csv")
+    write_csv(path, records(rng, args))
+    print(f"{args.transactions} transactions, {os.path.getsize(path) / 1e6:.0f} MB CSV")
+
+    client = TestClient(app)
+    sample = list(records(random.Random(13), argparse.Namespace(**{**vars(args), "transactions": args.sample})))
+    started = time.perf_counter()
+    for record in sample:
+        client.post("/transaction/", json=record).raise_for_status()
+    elapsed = time.perf_counter() - started
+    print(f"before: POST /transaction/        {elapsed / len(sample) * 1000:8.2f} ms/record, "
+          f"~{elapsed / len(sample) * args.transactions:.0f} s for the file")
+
+    started = time.perf_counter()
+    response = client.post("/transaction/import", content=upload(path), headers={"content-type": "text/csv"})
+    elapsed = time.perf_counter() - started
+    response.raise_for_status()
+    report = response.json()
+    print(f"after:  POST /transaction/import  {elapsed:8.2f} s, {report['imported']} imported, "
+          f"{report['rejected']} rejected ({report['imported'] / elapsed:,.0f} rows/s)")
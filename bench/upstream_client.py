@@ -0,0 +1,78 @@
+# bench/upstream_client.py
+"""
+Load benchmark for the CoinGecko integration against the local fake upstream.
+
+"before": blocking requests.get per call (new connection each time) on a 40-thread pool,
+          which is what the sync route did inside Starlette's threadpool.
+"after":  the pooled asyncio MarketClient.
+
+    python -m bench.upstream_client --requests 2000 --concurrency 100 --latency 0.02
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from server import market_client
+from server.fake_upstream import start_fake_upstream
+
+COINS = [f"coin-{i}" for i in range(50)]
+
+
+def report(name: str, latencies: list, elapsed: float):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(
+        f"{name:>7}: {len(latencies) / elapsed:8.1f} req/s"
+        f"  p50 {statistics.median(latencies) * 1000:7.2f} ms"
+        f"  p99 {p99 * 1000:7.2f} ms"
+    )
+
+
+def run_before(base_url: str, total: int):
+    def call(i):
+        start = time.perf_counter()
+        response = requests.get(f"{base_url}/coins/{COINS[i % len(COINS)]}", timeout=5)
+        response.raise_for_status()
+        response.json()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=40) as pool:
+        latencies = list(pool.map(call, range(total)))
+    report("before", latencies, time.perf_counter() - start)
+
+
+async def run_after(base_url: str, total: int, concurrency: int):
+    client = market_client.MarketClient(base_url=base_url, max_connections=concurrency,
+                                        max_concurrency=concurrency)
+    latencies = []
+    queue = iter(range(total))
+
+    async def worker():
+        for i in queue:
+            start = time.perf_counter()
+            await client.get_json(f"/coins/{COINS[i % len(COINS)]}")
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    report("after", latencies, time.perf_counter() - start)
+    await client.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    server, _ = start_fake_upstream(latency=args.latency)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    run_before(base_url, args.requests)
+    asyncio.run(run_after(base_url, args.requests, args.concurrency))
+    server.shutdown()
@@ -0,0 +1,70 @@
+# bench/write_path.py
+"""
+Trade creation throughput: POST /transaction/ requests per second, serially through the app.
+
+Every request writes the ledger row, the lot snapshot, the portfolio row and a message. Runs on
+a fresh SQLite file (WAL or rollback journal) or on SQLALCHEMY_DATABASE_URL when it is set, e.g.
+a scratch Postgres database.
+
+    python -m bench.write_path --requests 2000 --journal wal
+    SQLALCHEMY_DATABASE_URL=postgresql+psycopg://localhost/bench python -m bench.write_path
+"""
+import argparse
+import logging
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+if not os.getenv("SQLALCHEMY_DATABASE_URL"):
+    workdir = tempfile.mkdtemp()
+    os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'write.db')}"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from server import models  # noqa: E402
+from server.database import engine  # noqa: E402
+from server.main import app  # noqa: E402
+
+START = datetime(2024, 1, 1)
+
+
+def trades(rng, args):
+    held = {}
+    for i in range(args.requests):
+        uid, cid = rng.randint(1, args.users), f"coin-{rng.randrange(args.coins)}"
+        holding = held.get((uid, cid), 0.0)
+        quantity = -holding * rng.uniform(0.1, 1) if holding and rng.random() < 0.4 else rng.uniform(0.1, 5)
+        held[(uid, cid)] = holding + quantity
+        yield {
+            "uid": uid, "wid": 1, "cid": cid, "cid_target": "usd",
+            "ex_rate": round(rng.uniform(1, 1000), 8), "position": round(quantity, 8), "network": "bench",
+            "success": True, "time_transaction": (START + timedelta(seconds=i)).isoformat(),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--coins", type=int, default=10)
+    parser.add_argument("--journal", default="wal", help="SQLite journal_mode (wal, delete)")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as conn:
+            mode = conn.exec_driver_sql(f"PRAGMA journal_mode={args.journal}").scalar()
+        print(f"sqlite, journal_mode={mode}")
+    else:
+        print(engine.dialect.name)
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    body = list(trades(random.Random(7), args))
+    with TestClient(app) as client:  # one event loop for the whole run
+        started = time.perf_counter()
+        for record in body:
+            client.post("/transaction/", json=record).raise_for_status()
+        elapsed = time.perf_counter() - started
+    print(f"POST /transaction/  {len(body) / elapsed:8,.0f} requests/s  ({elapsed / len(body) * 1000:.2f} ms/request)")
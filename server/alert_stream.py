@@ -0,0 +1,395 @@
+# server/alert_stream.py
+"""
+Incremental, tick-driven price alert triggering.
+
+Every active price alert is a closed band [threshold - x%, threshold + x%]. Per coin we keep
+the band edges in two sorted lists, so a tick moving the price from `prev` to `price` only
+has to bisect for the edges inside the crossed interval:
+
+    price going up:   lower edges in (prev, price] -> alert entered its band (fires)
+                      upper edges in [prev, price) -> alert left its band (re-armed)
+    price going down: mirror image on the other edge list
+
+The cost of a tick is proportional to the number of alerts it fires or re-arms, not to the
+number of subscriptions. The book is loaded from the database once and kept in sync by the
+crud create/deactivate hooks and a periodic `sync`.
+
+A coin's first tick (after a load, or after a failed write) is settled against every band of
+the coin instead: alerts containing the price fire unless already triggered, triggered ones
+outside their band are re-armed. Firing stamps time_triggered and re-arming clears it, in the
+commit of the batch's messages, so a reload sees the same triggered alerts.
+
+Replay a recorded tick file (CSV lines of `cid,price`) and measure ticks/sec:
+
+    python -m server.alert_stream record ticks.csv
+    python -m server.alert_stream replay ticks.csv --alerts 1000000
+"""
+import argparse
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timezone
+
+from sqlalchemy import select, update
+
+from . import models, notifications
+from .alerts import DEFAULT_BAND_PERCENT
+from .database import SessionLocal
+from .queries import CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+INF = float("inf")
+
+
+class AlertEntry:
+    __slots__ = ("asid", "uid", "cid", "threshold", "percent", "lower", "upper", "triggered")
+
+    def __init__(self, asid: int, uid: int, cid: str, threshold: float, percent: float = None, triggered: bool = False):
+        self.asid = asid
+        self.uid = uid
+        self.cid = cid
+        self.threshold = threshold
+        self.percent = percent or DEFAULT_BAND_PERCENT
+        width = abs(threshold) * self.percent / 100
+        self.lower = threshold - width
+        self.upper = threshold + width
+        self.triggered = triggered
+
+
+def _remove(edges: list, key: tuple):
+    i = bisect_left(edges, key)
+    if i < len(edges) and edges[i] == key:
+        del edges[i]
+
+
+class CoinBook:
+    """
+    Band edges of one coin's alerts, each list sorted by (edge, asid).
+    """
+
+    def __init__(self):
+        self.lowers = []
+        self.uppers = []
+        self.last_price = None
+
+    def add(self, entry: AlertEntry):
+        insort(self.lowers, (entry.lower, entry.asid))
+        insort(self.uppers, (entry.upper, entry.asid))
+
+    def remove(self, entry: AlertEntry):
+        _remove(self.lowers, (entry.lower, entry.asid))
+        _remove(self.uppers, (entry.upper, entry.asid))
+
+    def crossed(self, prev: float, price: float):
+        """
+        (entered, left) asids for a move from prev to price.
+        """
+        if price > prev:
+            entered = self.lowers[bisect_right(self.lowers, (prev, INF)):bisect_right(self.lowers, (price, INF))]
+            left = self.uppers[bisect_left(self.uppers, (prev, -INF)):bisect_left(self.uppers, (price, -INF))]
+        else:
+            entered = self.uppers[bisect_left(self.uppers, (price, -INF)):bisect_left(self.uppers, (prev, -INF))]
+            left = self.lowers[bisect_right(self.lowers, (price, INF)):bisect_right(self.lowers, (prev, INF))]
+        return [asid for _, asid in entered], [asid for _, asid in left]
+
+    def settle(self, price: float, alerts: dict):
+        """
+        (entered, left) asids for a first tick at price: alerts whose band contains it, and
+        triggered alerts whose band doesn't. Linear in the coin's alerts.
+        """
+        entered, left = [], []
+        for _, asid in self.lowers:
+            entry = alerts[asid]
+            if entry.lower <= price <= entry.upper:
+                entered.append(asid)
+            elif entry.triggered:
+                left.append(asid)
+        return entered, left
+
+
+class AlertPipeline:
+    """
+    Consumes (cid, price) ticks and hands fired alerts to `sink` once per batch.
+    """
+
+    def __init__(self, sink=None):
+        self.sink = sink
+        # Only the process that receives ticks loads the book; the crud hooks are no-ops elsewhere
+        self.active = False
+        self.books = {}
+        self.alerts = {}
+        self._lock = threading.Lock()
+        self.stats = {"ticks": 0, "fired": 0, "rearmed": 0}
+
+    def __len__(self):
+        return len(self.alerts)
+
+    def add(self, entry: AlertEntry):
+        with self._lock:
+            if entry.asid in self.alerts:
+                self._remove(entry.asid)
+            self.alerts[entry.asid] = entry
+            self.books.setdefault(entry.cid, CoinBook()).add(entry)
+
+    def remove(self, asid: int):
+        with self._lock:
+            self._remove(asid)
+
+    def _remove(self, asid: int):
+        entry = self.alerts.pop(asid, None)
+        if entry is not None:
+            self.books[entry.cid].remove(entry)
+
+    def on_tick(self, cid: str, price: float):
+        """
+        Apply one tick, returns the alerts it fired.
+        """
+        with self._lock:
+            return self._on_tick(cid, price, {})
+
+    def _on_tick(self, cid: str, price: float, changed: dict):
+        """
+        Apply one tick; records in `changed` the triggered flag each alert it touches had before.
+        """
+        self.stats["ticks"] += 1
+        book = self.books.get(cid)
+        if book is None:
+            book = self.books[cid] = CoinBook()
+        prev, book.last_price = book.last_price, price
+        if prev is None:
+            entered, left = book.settle(price, self.alerts)
+        elif price == prev:
+            return []
+        else:
+            entered, left = book.crossed(prev, price)
+
+        fired = []
+        for asid in entered:
+            entry = self.alerts[asid]
+            if not entry.triggered:
+                changed.setdefault(asid, False)
+                entry.triggered = True
+                fired.append(entry)
+        # Re-arm after firing: a tick that jumps clean over a band fires it and re-arms it
+        rearmed = 0
+        for asid in left:
+            entry = self.alerts[asid]
+            if entry.triggered:
+                changed.setdefault(asid, True)
+                entry.triggered = False
+                rearmed += 1
+        self.stats["fired"] += len(fired)
+        self.stats["rearmed"] += rearmed
+        return fired
+
+    def process(self, ticks):
+        """
+        Apply a batch of (cid, price) ticks and pass the alerts they fired and the asids they
+        re-armed to the sink in one call, returns both.
+
+        If the sink fails, the alerts it was given get back the triggered flags they had before
+        the batch (what the database still says) and their coins are settled again on their next
+        tick, so alerts still in their band fire then.
+        """
+        changed = {}
+        with self._lock:
+            fired = [entry for cid, price in ticks for entry in self._on_tick(cid, price, changed)]
+            fired_asids = {entry.asid for entry in fired}
+            # Armed now and stamped in the database, or stamped by this batch: fired and re-armed since
+            rearmed = [asid for asid, was in changed.items()
+                       if not self.alerts[asid].triggered and (was or asid in fired_asids)]
+        if (fired or rearmed) and self.sink is not None:
+            try:
+                self.sink(fired, rearmed)
+            except Exception:
+                self._undo(changed)
+                raise
+        return fired, rearmed
+
+    def _undo(self, changed: dict):
+        with self._lock:
+            for asid, was in changed.items():
+                entry = self.alerts.get(asid)
+                if entry is not None:
+                    entry.triggered = was
+                    self.books[entry.cid].last_price = None
+
+    def load(self, db):
+        """
+        (Re)build the book from all active price alerts.
+        """
+        with self._lock:
+            self.books = {}
+            self.alerts = {}
+        for entry in _active_alerts(db):
+            self.add(entry)
+        self.active = True
+        logger.info(f"Alert book loaded with {len(self.alerts)} alerts")
+
+    def sync(self, db):
+        """
+        Pick up alerts created and deactivated by other processes since the last load/sync.
+
+        The active asids in the database are diffed against the book rather than read past the
+        highest asid seen: the crud hooks add this process's alerts as they commit, and other
+        workers' commits (or a sequence's) don't arrive in asid order.
+        """
+        # Taken before the query: an alert the hooks add or remove meanwhile is left to them
+        known = set(self.alerts)
+        active = set(db.execute(
+            select(models.AlertSubscription.asid).join(
+                models.PriceAlertSubscription, models.PriceAlertSubscription.asid == models.AlertSubscription.asid
+            ).where(
+                models.AlertSubscription.subscription_active == True,
+                models.PriceAlertSubscription.threshold.isnot(None),
+            )
+        ).scalars())
+        missing = sorted(active - known)
+        for i in range(0, len(missing), CHUNK_SIZE):
+            for entry in _active_alerts(db, missing[i:i + CHUNK_SIZE]):
+                self.add(entry)
+        for asid in known - active:
+            self.remove(asid)
+
+
+def _active_alerts(db, asids: list = None):
+    query = (
+        select(
+            models.AlertSubscription.asid,
+            models.AlertSubscription.uid,
+            models.AlertSubscription.cid,
+            models.AlertSubscription.time_triggered,
+            models.PriceAlertSubscription.threshold,
+            models.PriceAlertSubscription.threshold_percentage,
+        ).join(
+            models.PriceAlertSubscription, models.PriceAlertSubscription.asid == models.AlertSubscription.asid
+        ).where(
+            models.AlertSubscription.subscription_active == True,
+        ).execution_options(yield_per=10000)
+    )
+    if asids is not None:
+        query = query.where(models.AlertSubscription.asid.in_(asids))
+    for row in db.execute(query):
+        if row.threshold is None:
+            continue
+        yield AlertEntry(
+            row.asid, row.uid, row.cid, row.threshold, row.threshold_percentage,
+            triggered=row.time_triggered is not None,
+        )
+
+
+def write_fired(fired: list, rearmed: list = ()):
+    """
+    Default sink: one multi-row Message insert and unread counter update, time_triggered stamps
+    of the fired alerts and cleared for the re-armed ones, one commit.
+    """
+    now = datetime.now(timezone.utc)
+    db = SessionLocal()
+    try:
+        notifications.write(db, [
+            notifications.message_row(
+                entry.uid, entry.asid, "Price Alert",
+                f"The price of {entry.cid} is within {entry.percent:g}% of your target price.", now,
+            )
+            for entry in fired
+        ])
+        asids = [entry.asid for entry in fired]
+        for i in range(0, len(asids), CHUNK_SIZE):
+            db.execute(
+                update(models.AlertSubscription)
+                .where(models.AlertSubscription.asid.in_(asids[i:i + CHUNK_SIZE]))
+                .values(time_triggered=now)
+            )
+        # After the stamps: an alert fired and re-armed within the batch ends up armed
+        for i in range(0, len(rearmed), CHUNK_SIZE):
+            db.execute(
+                update(models.AlertSubscription)
+                .where(models.AlertSubscription.asid.in_(rearmed[i:i + CHUNK_SIZE]))
+                .values(time_triggered=None)
+            )
+        db.commit()
+    finally:
+        db.close()
+
+
+pipeline = AlertPipeline(sink=write_fired)
+
+
+def read_ticks(path: str):
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            cid, price = line.split(",")[:2]
+            yield cid, float(price)
+
+
+def record(path: str):
+    """
+    Dump the Price table, oldest first, as a tick file.
+    """
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            select(models.Price.cid, models.Price.current_price)
+            .order_by(models.Price.time_stamp, models.Price.pid)
+            .execution_options(yield_per=10000)
+        )
+        count = 0
+        with open(path, "w") as f:
+            for cid, price in rows:
+                if price is not None:
+                    f.write(f"{cid},{price!r}\n")
+                    count += 1
+    finally:
+        db.close()
+    print(f"Recorded {count} ticks to {path}")
+
+
+def replay(path: str, alerts: int = 100_000, batch: int = 100, seed: int = 1):
+    """
+    Feed a tick file through a pipeline with `alerts` synthetic subscriptions spread around each coin's prices.
+    """
+    ticks = list(read_ticks(path))
+    first = {}
+    for cid, price in ticks:
+        first.setdefault(cid, price)
+    rng = random.Random(seed)
+    coins = list(first)
+    fired = [0]
+    replay_pipeline = AlertPipeline(sink=lambda entries, rearmed: fired.__setitem__(0, fired[0] + len(entries)))
+    replay_pipeline.active = True
+    for asid in range(1, alerts + 1):
+        cid = rng.choice(coins)
+        replay_pipeline.add(AlertEntry(asid, asid % 10_000, cid, first[cid] * rng.uniform(0.8, 1.2), rng.choice([1, 2, 5, 10])))
+
+    start = time.perf_counter()
+    for i in range(0, len(ticks), batch):
+        replay_pipeline.process(ticks[i:i + batch])
+    elapsed = time.perf_counter() - start
+    print(
+        f"{len(ticks)} ticks over {alerts} alerts in {elapsed:.3f}s: "
+        f"{len(ticks) / elapsed:,.0f} ticks/s, {elapsed / len(ticks) * 1e6:.1f} us/tick, "
+        f"{fired[0]} fired, {replay_pipeline.stats['rearmed']} re-armed"
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Alert stream tick recorder / replay harness")
+    sub = parser.add_subparsers(dest="command", required=True)
+    record_parser = sub.add_parser("record", help="write the Price table as a tick file")
+    record_parser.add_argument("path")
+    replay_parser = sub.add_parser("replay", help="replay a tick file and report ticks/sec")
+    replay_parser.add_argument("path")
+    replay_parser.add_argument("--alerts", type=int, default=100_000)
+    replay_parser.add_argument("--batch", type=int, default=100)
+    args = parser.parse_args()
+    if args.command == "record":
+        record(args.path)
+    else:
+        replay(args.path, args.alerts, args.batch)
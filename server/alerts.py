@@ -0,0 +1,204 @@
+# server/alerts.py
+"""
+Set-based price alert evaluation.
+
+Each run compares the active, not yet fired price alerts with the newest Price row of their
+coin in one query, writes all resulting Message rows with one multi-row insert (and the users'
+unread counters, see server/notifications.py) and marks the
+alerts as fired, all in a single commit. An alert fires when the price is within
+`threshold_percentage` percent of its threshold (DEFAULT_BAND_PERCENT when unset) and is
+re-armed once the price leaves that band again, so a coin parked near a target notifies once.
+
+The band test |price - threshold| <= threshold * x / 100 can't use an index, so the query
+first narrows each coin to the thresholds its price could be in band of at all,
+price / (1 + w) <= threshold <= price / (1 - w) for the widest band w of any alert: a range
+scan of idx_price_alert_cid_threshold instead of every alert of the coin.
+
+With the tick-driven alert stream disabled, the `alerts` job of server/scheduler.py runs
+`schedule` every ALERT_EVAL_INTERVAL seconds. It evaluates each coin on a cadence set by its
+volatility: coins whose latest 24h change is at least ALERT_VOLATILE_PERCENT (or unknown) are
+due every run, calm coins every ALERT_CALM_INTERVAL seconds.
+"""
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import and_, func, not_, select, update
+from sqlalchemy.orm import Session
+
+from . import models, notifications, queries
+from .queries import CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BAND_PERCENT = 10.0
+ALERT_EVAL_INTERVAL = float(os.getenv("ALERT_EVAL_INTERVAL", "15"))
+ALERT_CALM_INTERVAL = float(os.getenv("ALERT_CALM_INTERVAL", "120"))
+ALERT_VOLATILE_PERCENT = float(os.getenv("ALERT_VOLATILE_PERCENT", "5"))
+
+
+def band_percent():
+    """
+    SQL expression for an alert's band width in percent.
+    """
+    return func.coalesce(func.nullif(models.PriceAlertSubscription.threshold_percentage, 0), DEFAULT_BAND_PERCENT)
+
+
+def in_band():
+    return (
+        func.abs(models.Price.current_price - models.PriceAlertSubscription.threshold)
+        <= models.PriceAlertSubscription.threshold * band_percent() / 100
+    )
+
+
+def _alerts_at_latest_price(cids: list = None):
+    query = select(
+        models.AlertSubscription.asid,
+        models.AlertSubscription.uid,
+        models.AlertSubscription.cid,
+        band_percent().label("band_percent"),
+    ).join(
+        models.PriceAlertSubscription, models.PriceAlertSubscription.asid == models.AlertSubscription.asid
+    ).join(
+        models.Price, models.Price.cid == models.AlertSubscription.cid
+    ).where(
+        models.AlertSubscription.subscription_active == True,
+        queries.latest_price_filter(),
+    )
+    return query if cids is None else query.where(models.AlertSubscription.cid.in_(cids))
+
+
+def widest_band(db: Session) -> float:
+    """
+    Widest band of any alert in percent (an index lookup on idx_price_alert_threshold_percentage).
+    """
+    widest = db.execute(select(func.max(models.PriceAlertSubscription.threshold_percentage))).scalar()
+    return max(widest or 0, DEFAULT_BAND_PERCENT)
+
+
+def near_price(percent: float):
+    """
+    Price alerts of the Price row's coin with a threshold its price could be within `percent`
+    percent of: a range on (cid, threshold).
+    """
+    width = percent / 100
+    threshold = models.PriceAlertSubscription.threshold
+    near = and_(
+        models.PriceAlertSubscription.cid == models.Price.cid,
+        threshold >= models.Price.current_price / (1 + width),
+    )
+    if width >= 1:
+        return near  # a band this wide reaches down to zero, any higher threshold may contain the price
+    return and_(near, threshold <= models.Price.current_price / (1 - width))
+
+
+def find_triggered(db: Session, cids: list = None):
+    """
+    Active, armed alerts whose coin's latest price is inside their band, of the given coins or all.
+    """
+    # Latest prices first, then the alerts with a threshold near each
+    query = select(
+        models.AlertSubscription.asid,
+        models.AlertSubscription.uid,
+        models.AlertSubscription.cid,
+        band_percent().label("band_percent"),
+    ).select_from(models.Price).join(
+        models.PriceAlertSubscription, near_price(widest_band(db)),
+    ).join(
+        models.AlertSubscription, models.AlertSubscription.asid == models.PriceAlertSubscription.asid,
+    ).where(
+        queries.latest_price_filter(),
+        models.AlertSubscription.subscription_active == True,
+        models.AlertSubscription.time_triggered.is_(None),
+        in_band(),
+    )
+    if cids is not None:
+        query = query.where(models.Price.cid.in_(cids))
+    return db.execute(query).all()
+
+
+def _chunks(items: list):
+    for i in range(0, len(items), CHUNK_SIZE):
+        yield items[i:i + CHUNK_SIZE]
+
+
+def evaluate(db: Session, now: datetime = None, cids: list = None):
+    """
+    Fire triggered alerts and re-arm the ones whose price moved out of band, of the given coins
+    or all. Returns the number fired.
+    """
+    now = now or datetime.now(timezone.utc)
+    triggered = find_triggered(db, cids)
+    if triggered:
+        notifications.write(db, [
+            notifications.message_row(
+                alert.uid, alert.asid, "Price Alert",
+                f"The price of {alert.cid} is within {alert.band_percent:g}% of your target price.", now,
+            )
+            for alert in triggered
+        ])
+        for asids in _chunks([alert.asid for alert in triggered]):
+            db.execute(
+                update(models.AlertSubscription)
+                .where(models.AlertSubscription.asid.in_(asids))
+                .values(time_triggered=now)
+            )
+
+    out_of_band = _alerts_at_latest_price(cids).where(
+        models.AlertSubscription.time_triggered.isnot(None),
+        not_(in_band()),
+    )
+    rearm = [row.asid for row in db.execute(out_of_band)]
+    for asids in _chunks(rearm):
+        db.execute(
+            update(models.AlertSubscription)
+            .where(models.AlertSubscription.asid.in_(asids))
+            .values(time_triggered=None)
+        )
+
+    db.commit()
+    if triggered or rearm:
+        logger.info(f"Alert evaluation: {len(triggered)} fired, {len(rearm)} re-armed")
+    return len(triggered)
+
+
+def cadences(db: Session) -> dict:
+    """
+    Evaluation interval per coin with active alerts and a price, from its latest 24h change.
+    """
+    watched = select(models.AlertSubscription.cid).where(models.AlertSubscription.subscription_active == True).distinct()
+    rows = db.execute(
+        select(models.Price.cid, models.Price.price_change_percentage_24h)
+        .where(models.Price.cid.in_(watched), queries.latest_price_filter())
+    )
+    return {
+        cid: ALERT_CALM_INTERVAL if change is not None and abs(change) < ALERT_VOLATILE_PERCENT else ALERT_EVAL_INTERVAL
+        for cid, change in rows
+    }
+
+
+class CoinSchedule:
+    """
+    Per-coin evaluation cadence: each run evaluates the coins whose interval has elapsed.
+    """
+
+    def __init__(self):
+        self.next_due = {}  # cid -> time.monotonic() it is due again
+        self.stats = {"runs": 0, "evaluated": 0, "skipped": 0, "fired": 0}
+
+    def run(self, db: Session):
+        started = time.monotonic()
+        intervals = cadences(db)
+        due = [cid for cid, interval in intervals.items() if self.next_due.get(cid, 0) <= started]
+        fired = evaluate(db, cids=due) if due else 0
+        for cid in due:
+            self.next_due[cid] = started + intervals[cid]
+        self.stats["runs"] += 1
+        self.stats["evaluated"] += len(due)
+        self.stats["skipped"] += len(intervals) - len(due)
+        self.stats["fired"] += fired
+        return fired
+
+
+schedule = CoinSchedule()
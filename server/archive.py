@@ -0,0 +1,286 @@
+# server/archive.py
+"""
+Columnar, memory-mapped archive of raw price ticks.
+
+Cold Price rows are moved out of the database into one directory per coin and UTC day,
+holding one fixed-width NumPy array per column:
+
+    <PRICE_ARCHIVE_DIR>/<cid>/<YYYY-MM-DD>/time_stamp.npy      datetime64[us], sorted
+                                           current_price.npy   float64 (NaN for NULL)
+                                           total_volume.npy    float64 (NaN for NULL)
+
+`load` memory-maps the files, so reading a range costs a binary search per day plus one
+concatenation, no per-row Python objects. `compact` only moves rows that are older than
+ARCHIVE_AFTER_DAYS and already rolled up into 1m candles, and deletes them from the price
+table after their day files are on disk; re-running it after a crash merges and
+de-duplicates, so no tick is lost or counted twice.
+
+    python -m server.archive compact
+    python -m server.archive info bitcoin
+"""
+import argparse
+import logging
+import mmap
+import os
+import re
+import shutil
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import models, timeseries
+
+logger = logging.getLogger(__name__)
+
+# Empty disables archiving; retention then simply deletes old ticks
+ARCHIVE_DIR = os.getenv("PRICE_ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "price_archive"))
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "3"))
+
+COLUMNS = {
+    "time_stamp": np.dtype("datetime64[us]"),
+    "current_price": np.dtype("float64"),
+    "total_volume": np.dtype("float64"),
+}
+
+_SAFE_CID = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+
+def _coin_dir(cid: str):
+    if not _SAFE_CID.match(cid):
+        raise ValueError(f"Invalid coin id {cid!r}")
+    return os.path.join(ARCHIVE_DIR, cid)
+
+
+def _day_dir(cid: str, day: date):
+    return os.path.join(_coin_dir(cid), day.isoformat())
+
+
+def coins():
+    if not ARCHIVE_DIR or not os.path.isdir(ARCHIVE_DIR):
+        return []
+    return sorted(name for name in os.listdir(ARCHIVE_DIR) if _SAFE_CID.match(name))
+
+
+def days(cid: str):
+    """
+    Archived days of one coin, oldest first.
+    """
+    path = _coin_dir(cid)
+    if not os.path.isdir(path):
+        return []
+    result = []
+    for name in os.listdir(path):
+        try:
+            result.append(date.fromisoformat(name))
+        except ValueError:
+            continue  # leftovers of an interrupted write
+    return sorted(result)
+
+
+def _map(path: str, dtype: np.dtype):
+    """
+    Read-only zero-copy view of a 1-d .npy file written by `_save`.
+
+    np.load(mmap_mode="r") parses the header with ast and builds a np.memmap, which costs
+    more than the read itself for day-sized files; the dtype is known, so only the header
+    length is read.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return np.empty(0, dtype=dtype)
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:6] != b"\x93NUMPY":
+        raise ValueError(f"{path} is not a .npy file")
+    if mapped[6] == 1:
+        offset = 10 + int.from_bytes(mapped[8:10], "little")
+    else:
+        offset = 12 + int.from_bytes(mapped[8:12], "little")
+    return np.frombuffer(mapped, dtype=dtype, offset=offset)
+
+
+def load_day(cid: str, day: date, columns=None):
+    """
+    Memory-mapped (read-only) arrays of one archived day, None if it isn't archived.
+    """
+    path = _day_dir(cid, day)
+    if not os.path.isdir(path):
+        return None
+    return {name: _map(os.path.join(path, f"{name}.npy"), COLUMNS[name]) for name in columns or COLUMNS}
+
+
+def load(cid: str, start: datetime = None, end: datetime = None, columns=None):
+    """
+    Ticks of one coin with start <= time_stamp < end as {column: array}, ordered by time.
+
+    A range inside a single day returns views on the mapped files; longer ranges are
+    concatenated into one array per column.
+    """
+    columns = list(columns or COLUMNS)
+    wanted = columns if "time_stamp" in columns else ["time_stamp"] + columns
+    start = timeseries.naive_utc(start) if start else None
+    end = timeseries.naive_utc(end) if end else None
+    start64 = np.datetime64(start, "us") if start else None
+    end64 = np.datetime64(end, "us") if end else None
+
+    parts = {name: [] for name in columns}
+    for day in days(cid):
+        if start and day < start.date():
+            continue
+        if end and datetime.combine(day, datetime.min.time()) >= end:
+            break
+        arrays = load_day(cid, day, wanted)
+        times = arrays["time_stamp"]
+        lo = int(np.searchsorted(times, start64, "left")) if start64 is not None else 0
+        hi = int(np.searchsorted(times, end64, "left")) if end64 is not None else len(times)
+        if lo >= hi:
+            continue
+        for name in columns:
+            parts[name].append(arrays[name][lo:hi])
+
+    result = {}
+    for name in columns:
+        chunks = parts[name]
+        if not chunks:
+            result[name] = np.empty(0, dtype=COLUMNS[name])
+        elif len(chunks) == 1:
+            result[name] = chunks[0]
+        else:
+            result[name] = np.concatenate(chunks)
+    return result
+
+
+def _save(path: str, array: np.ndarray):
+    with open(path, "wb") as f:
+        np.save(f, array)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def write_day(cid: str, day: date, arrays: dict):
+    """
+    Merge `arrays` into the day's files: sorted by time, one tick per timestamp.
+
+    The new files are written next to the old ones and swapped in by directory rename, so
+    readers never see a day with columns of different lengths.
+    """
+    path = _day_dir(cid, day)
+    existing = load_day(cid, day)
+    if existing is not None:
+        arrays = {name: np.concatenate([existing[name], arrays[name]]) for name in COLUMNS}
+    order = np.argsort(arrays["time_stamp"], kind="stable")
+    times = arrays["time_stamp"][order]
+    # Re-running an interrupted compaction archives the same ticks again: keep the first
+    _, first = np.unique(times, return_index=True)
+    keep = order[first]
+
+    tmp = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name, dtype in COLUMNS.items():
+        _save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(arrays[name][keep], dtype=dtype))
+    if existing is not None:
+        old = f"{path}.old-{os.getpid()}"
+        os.rename(path, old)
+        os.rename(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+    else:
+        os.rename(tmp, path)
+    return len(keep)
+
+
+def _to_arrays(rows: list):
+    return {
+        "time_stamp": np.array([row.time_stamp for row in rows], dtype=COLUMNS["time_stamp"]),
+        "current_price": np.array(
+            [np.nan if row.current_price is None else row.current_price for row in rows], dtype=COLUMNS["current_price"]
+        ),
+        "total_volume": np.array(
+            [np.nan if row.total_volume is None else row.total_volume for row in rows], dtype=COLUMNS["total_volume"]
+        ),
+    }
+
+
+def archive_cutoff(db: Session, now: datetime = None):
+    """
+    Start of the first UTC day that stays in the database: older than ARCHIVE_AFTER_DAYS and
+    already covered by the 1m rollup.
+    """
+    now = timeseries.naive_utc(now or timeseries.utcnow())
+    rolled = db.get(models.RollupWatermark, "1m")
+    if rolled is None:
+        return None
+    cutoff = min(now - timedelta(days=ARCHIVE_AFTER_DAYS), rolled.rolled_up_to)
+    return timeseries.floor_time(cutoff, 86400)
+
+
+def compact(db: Session, now: datetime = None):
+    """
+    Move cold Price rows into the archive one UTC day at a time. Returns the number of rows moved.
+    """
+    if not ARCHIVE_DIR:
+        return 0
+    cutoff = archive_cutoff(db, now)
+    if cutoff is None:
+        return 0
+    first = db.execute(
+        select(models.Price.time_stamp).where(models.Price.time_stamp < cutoff)
+        .order_by(models.Price.time_stamp).limit(1)
+    ).scalar()
+    if first is None:
+        return 0
+
+    moved = 0
+    day_start = timeseries.floor_time(first, 86400)
+    while day_start < cutoff:
+        day_end = day_start + timedelta(days=1)
+        in_day = (models.Price.time_stamp >= day_start) & (models.Price.time_stamp < day_end)
+        rows = db.execute(
+            select(models.Price.cid, models.Price.time_stamp, models.Price.current_price, models.Price.total_volume)
+            .where(in_day).order_by(models.Price.cid, models.Price.time_stamp)
+        ).all()
+        by_coin = {}
+        for row in rows:
+            by_coin.setdefault(row.cid, []).append(row)
+        for cid, coin_rows in by_coin.items():
+            if not _SAFE_CID.match(cid):
+                logger.warning(f"Not archiving {len(coin_rows)} ticks of unsafe coin id {cid!r}")
+                continue
+            write_day(cid, day_start.date(), _to_arrays(coin_rows))
+        # Only after every file of the day is on disk
+        archived = [cid for cid in by_coin if _SAFE_CID.match(cid)]
+        if archived:
+            moved += timeseries.delete_in_batches(
+                db, models.Price, models.Price.pid, in_day & models.Price.cid.in_(archived)
+            )
+        day_start = day_end
+
+    if moved:
+        logger.info(f"Archived {moved} price rows older than {cutoff.isoformat()}")
+    return moved
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Columnar price archive")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("compact", help="move cold price rows into the archive")
+    info_parser = sub.add_parser("info", help="archived days and tick counts of a coin")
+    info_parser.add_argument("cid")
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        from .database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            compact(db)
+        finally:
+            db.close()
+    else:
+        archived = days(args.cid)
+        ticks = load(args.cid, columns=["time_stamp"])["time_stamp"]
+        print(f"{args.cid}: {len(archived)} days, {len(ticks)} ticks")
+        if archived:
+            print(f"  {archived[0].isoformat()} .. {archived[-1].isoformat()}")
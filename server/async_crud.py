@@ -0,0 +1,101 @@
+# server/async_crud.py
+"""
+Async versions of the crud functions behind the routes in server/async_routes.py, on an
+AsyncSession. Same contract as crud: nothing commits, get_async_db commits once per request.
+
+Simple reads and inserts are written natively. Functions whose logic is long and shared with
+the sync path (create_transaction: ledger row, lot snapshot, portfolio, alert pipeline) run the
+crud function itself with AsyncSession.run_sync, so there is one implementation while both
+data layers coexist.
+"""
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, models, queries, schemas
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate, hashed_password: str):
+    """
+    Add a user with an already hashed password.
+    """
+    db_user = models.User(
+        email=user.email,
+        hashed_password=hashed_password,
+        username=user.username,
+        role=user.role,
+        time_registered=datetime.now(timezone.utc)
+    )
+    db.add(db_user)
+    await db.flush()
+    return db_user
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    return await db.scalar(select(models.User).where(models.User.email == email).limit(1))
+
+# ---- Portfolio Management Functions ----
+
+async def create_portfolio_entry(db: AsyncSession, portfolio: schemas.PortfolioCreate):
+    """
+    Add a cryptocurrency to the user's portfolio.
+    """
+    db_portfolio = models.Portfolio(
+        uid=portfolio.uid,
+        cid=portfolio.cid,
+        quantity=portfolio.amount,
+        time_created=datetime.now(timezone.utc)
+    )
+    db.add(db_portfolio)
+    await db.flush()
+    return db_portfolio
+
+async def get_portfolio_by_uid_and_cid(db: AsyncSession, uid: int, cid: str):
+    """
+    Retrieve a specific portfolio entry by UID and CID.
+    """
+    return await db.get(models.Portfolio, (uid, cid))
+
+async def get_portfolio_value(db: AsyncSession, uid: int):
+    """
+    Market value of a user's portfolio, SUM(quantity * latest price) computed in the database.
+    """
+    return await db.scalar(
+        select(func.coalesce(func.sum(models.Portfolio.quantity * models.Price.current_price), 0))
+        .join(models.Price, models.Price.cid == models.Portfolio.cid)
+        .where(models.Portfolio.uid == uid, queries.latest_price_filter())
+    )
+
+# ---- Cryptocurrency Management Functions ----
+
+async def get_latest_price(db: AsyncSession, cid: str):
+    """
+    Most recent Price row for a coin (walks idx_price_cid_timestamp backwards).
+    """
+    return await db.scalar(
+        select(models.Price).where(models.Price.cid == cid).order_by(models.Price.time_stamp.desc()).limit(1)
+    )
+
+# ---- Transaction Management Functions ----
+
+async def create_transaction(db: AsyncSession, transaction: schemas.TransactionCreate):
+    """
+    crud.create_transaction on the AsyncSession's sync session.
+    """
+    return await db.run_sync(crud.create_transaction, transaction)
+
+# ---- Wallet Management Functions ----
+
+async def create_wallet(db: AsyncSession, wallet: schemas.WalletCreate):
+    """
+    Add a wallet to the user's profile.
+    """
+    db_wallet = models.Wallet(
+        uid=wallet.uid,
+        wname=wallet.wname,
+        address=wallet.address,
+        time_added=wallet.time_added,
+        time_accessed=wallet.time_accessed
+    )
+    db.add(db_wallet)
+    await db.flush()
+    return db_wallet
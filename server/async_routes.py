@@ -0,0 +1,170 @@
+# server/async_routes.py
+"""
+Async handlers for the hot routes, on AsyncSession (server/async_crud.py).
+
+The sync routes in main.py run in Starlette's threadpool, 40 threads per worker, and a request
+that waits on the database holds one of them. These handlers await the database on the event
+loop instead. With DB_ASYNC=true main.py calls install(app), which puts each of them in place
+of the sync route with the same path and methods; the other routes stay sync, on the sync
+engine, until they are ported here.
+"""
+from datetime import timedelta
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
+from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import async_crud, auth, hashing, listing, market_cache, prices, schemas, serialization
+from .database import get_async_db
+
+router = APIRouter()
+
+PAGE_LIMIT = Query(listing.PAGE_SIZE, ge=1, le=listing.MAX_PAGE_SIZE)
+LIST_FORMAT = Query(None, description="json or ndjson, default from Accept")
+
+
+def install(app):
+    """
+    Replace the app's routes that have an async version here, keeping their order.
+    """
+    replacements = {(route.path, frozenset(route.methods)): route for route in router.routes}
+    app.router.routes[:] = [
+        replacements.get((route.path, frozenset(route.methods)), route) if isinstance(route, APIRoute) else route
+        for route in app.router.routes
+    ]
+
+# ---- User Routes ----
+
+@router.post("/users/", response_model=schemas.UserOut)
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    """
+    Register a new user. The password is hashed in the hashing pool.
+    """
+    if await async_crud.get_user_by_email(db, user.email):
+        raise HTTPException(status_code=400, detail="Email already registered")
+    hashed_password = await hashing.hash_password(user.password)
+    return await async_crud.create_user(db, user, hashed_password)
+
+@router.post("/token", response_model=schemas.Token)
+async def login_for_access_token(db: AsyncSession = Depends(get_async_db), form_data: OAuth2PasswordRequestForm = Depends()):
+    """
+    Authenticate the user and return an access token. The password is verified in the hashing pool.
+    """
+    user = await auth.authenticate_user_async(db, form_data.username, form_data.password)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect email or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    access_token = auth.create_access_token(
+        data={"sub": user.email, "uid": user.uid, "role": user.role},
+        expires_delta=timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES),
+    )
+    return {"access_token": access_token, "token_type": "bearer"}
+
+@router.get("/users/me", response_model=schemas.UserOut)
+async def read_users_me(current_user: schemas.UserOut = Depends(auth.get_current_user_async)):
+    """
+    Retrieve the current authenticated user's information.
+    """
+    return current_user
+
+# ---- Price Routes ----
+
+@router.get("/crypto/{coin_id}")
+async def get_crypto_price(coin_id: str, db: AsyncSession = Depends(get_async_db)):
+    """
+    Latest price of a coin from the database when fresh, otherwise through market_cache from upstream.
+    """
+    price = await async_crud.get_latest_price(db, coin_id)
+    if price is not None and prices.is_fresh(price):
+        return prices.price_info_from_db(price)
+    return await market_cache.cache.get(coin_id, lambda: prices.fetch_price_info(coin_id))
+
+# ---- Listings ----
+
+async def list_for_user(request: Request, db: AsyncSession, name: str, uid: int,
+                        after: Optional[str], limit: int, format: Optional[str], not_found: str):
+    """
+    main.list_for_user on an AsyncSession. format=ndjson streams from its own sync session as before.
+    """
+    fmt = format or listing.format_for(request.headers.get("accept"))
+    if fmt not in listing.FORMATS:
+        raise HTTPException(status_code=400, detail="format must be json or ndjson")
+    if after is None and not await db.run_sync(listing.exists, name, uid):
+        raise HTTPException(status_code=404, detail=not_found)
+    try:
+        if fmt == "ndjson":
+            return StreamingResponse(listing.stream(name, uid, after), media_type=listing.NDJSON)
+        rows, next_after = await db.run_sync(listing.page, name, uid, after, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = None
+    if next_after is not None:
+        headers = {"Link": f'<{request.url.include_query_params(after=next_after)}>; rel="next"'}
+    _, _, schema = listing.LISTINGS[name]
+    return serialization.response(name, rows, schema, headers=headers)
+
+# ---- Portfolio Routes ----
+
+@router.post("/portfolio/", response_model=schemas.PortfolioOut)
+async def add_to_portfolio(portfolio: schemas.PortfolioCreate, db: AsyncSession = Depends(get_async_db)):
+    """
+    Add a cryptocurrency to the user's portfolio.
+    """
+    if await async_crud.get_portfolio_by_uid_and_cid(db, uid=portfolio.uid, cid=portfolio.cid):
+        raise HTTPException(status_code=400, detail="Cryptocurrency already in portfolio")
+    return await async_crud.create_portfolio_entry(db, portfolio=portfolio)
+
+@router.get("/portfolio/{uid}", response_model=List[schemas.PortfolioOut])
+async def get_user_portfolio(uid: int, request: Request, after: Optional[str] = None,
+                             limit: int = PAGE_LIMIT, format: Optional[str] = LIST_FORMAT, db: AsyncSession = Depends(get_async_db)):
+    """
+    Retrieve the portfolio for a user, by coin, a page at a time.
+    """
+    return await list_for_user(request, db, "portfolio", uid, after, limit, format, "Portfolio not found")
+
+@router.get("/portfolio/{uid}/value")
+async def get_user_portfolio_value(uid: int, db: AsyncSession = Depends(get_async_db)):
+    """
+    Market value of a user's portfolio at the latest stored prices.
+    """
+    return {"uid": uid, "value": await async_crud.get_portfolio_value(db, uid=uid)}
+
+# ---- Wallet Routes ----
+
+@router.post("/wallet/", response_model=schemas.WalletCreate)
+async def add_wallet(wallet: schemas.WalletCreate, db: AsyncSession = Depends(get_async_db)):
+    """
+    Add a new wallet to the user's account.
+    """
+    return await async_crud.create_wallet(db, wallet=wallet)
+
+@router.get("/wallet/{uid}", response_model=List[schemas.WalletOut])
+async def get_user_wallets(uid: int, request: Request, after: Optional[str] = None,
+                           limit: int = PAGE_LIMIT, format: Optional[str] = LIST_FORMAT, db: AsyncSession = Depends(get_async_db)):
+    """
+    Retrieve the wallets of a user, a page at a time.
+    """
+    return await list_for_user(request, db, "wallet", uid, after, limit, format, "No wallets found for this user")
+
+# ---- Transaction Routes ----
+
+@router.post("/transaction/", response_model=schemas.TransactionCreate)
+async def create_transaction(transaction: schemas.TransactionCreate, db: AsyncSession = Depends(get_async_db)):
+    """
+    Log a new transaction for the user, updating the portfolio and wallet balances accordingly.
+    """
+    return await async_crud.create_transaction(db, transaction=transaction)
+
+@router.get("/transaction/{uid}", response_model=List[schemas.TransactionOut])
+async def get_user_transactions(uid: int, request: Request, after: Optional[str] = None,
+                                limit: int = PAGE_LIMIT, format: Optional[str] = LIST_FORMAT, db: AsyncSession = Depends(get_async_db)):
+    """
+    Retrieve the transactions of a user, oldest first, a page at a time; format=ndjson streams the full history.
+    """
+    return await list_for_user(request, db, "transaction", uid, after, limit, format, "No transactions found for this user")
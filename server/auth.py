@@ -1,23 +1,37 @@
 import os
+import time
 from datetime import datetime, timedelta, timezone
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from . import schemas, models, utils
-from .database import get_db
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
+from . import hashing, schemas, models, utils
+from .database import after_commit, get_async_db, get_db
 
 # Secret key to encode and decode JWT tokens
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key")  # Use a fallback if environment variable is not set
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Verified token -> claims, each entry dropped at the token's exp
+TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+# uid -> user. Role changes and deactivation are dropped from this worker's cache on commit;
+# other workers see them after at most USER_CACHE_TTL seconds.
+USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "30"))
+
+token_cache = utils.LRUCache(TOKEN_CACHE_SIZE)
+user_cache = utils.LRUCache(USER_CACHE_SIZE)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
     """
-    Generate a JWT token for authentication.
+    Generate a JWT token for authentication. Besides `sub` (the email), tokens carry `uid` and
+    `role` claims so the current user can be found by primary key.
     """
     to_encode = data.copy()
     if expires_delta:
@@ -47,29 +61,108 @@ def authenticate_user(db: Session, email: str, password: str):
     return user
 
 
+async def authenticate_user_async(db, email: str, password: str):
+    """
+    authenticate_user with the Argon2 verification in the hashing pool. A hash made with old
+    cost parameters is replaced, committed with the request. Raises hashing.Overloaded.
+    db is a Session or, on the async routes, an AsyncSession.
+    """
+    if isinstance(db, AsyncSession):
+        user = await db.run_sync(get_user, email)
+    else:
+        user = await run_in_threadpool(get_user, db, email)
+    if not user:
+        return False
+    matches, new_hash = await hashing.verify_password(user.hashed_password, password)
+    if not matches:
+        return False
+    if new_hash is not None:
+        user.hashed_password = new_hash
+    return user
+
+
+def forget_user(uid: int):
+    """
+    Drop a user from the cache, e.g. after a role change or deactivation.
+    """
+    user_cache.pop(uid)
+
+
+@event.listens_for(models.User, "after_update")
+def _forget_updated_user(mapper, connection, target):
+    # Any flushed change to a user (crud.update_user, deactivate_user, a rehash) drops it on commit
+    uid = target.uid
+    after_commit(object_session(target), lambda: forget_user(uid))
+
+
+def _claims(token: str):
+    """
+    Verified claims of a token, decoded once per token and cached until it expires. None if invalid.
+    """
+    claims = token_cache.get(token)
+    if claims is None:
+        try:
+            claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            return None
+        if claims.get("sub") is None:
+            return None
+        token_cache.set(token, claims, expires_at=claims.get("exp"))
+    return claims
+
+
+def _cached_user(db: Session, claims: dict):
+    uid = claims.get("uid")
+    user = user_cache.get(uid) if uid is not None else None
+    if user is None:
+        if uid is not None:
+            db_user = db.get(models.User, uid)
+        else:
+            # Token issued before tokens carried a uid
+            db_user = get_user(db, email=claims["sub"])
+        if db_user is None:
+            return None
+        user = schemas.CurrentUser.model_validate(db_user)
+        user_cache.set(user.uid, user, expires_at=time.time() + USER_CACHE_TTL)
+        claims["uid"] = user.uid
+    # The token's subject must still be the user's email
+    return user if user.email == claims["sub"] else None
+
+
 def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
     """
     Get the currently authenticated user based on the JWT token.
+    Served from the token and user caches; the database is only read on a cache miss.
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        token_data = schemas.TokenData(email=email)
-    except JWTError:
+    claims = _claims(token)
+    if claims is None:
         raise credentials_exception
-    user = get_user(db, email=token_data.email)
+    user = _cached_user(db, claims)
     if user is None:
         raise credentials_exception
     return user
 
 
+async def get_current_user_async(db: AsyncSession = Depends(get_async_db), token: str = Depends(oauth2_scheme)):
+    """
+    get_current_user for the async routes; a cache miss reads the user on the AsyncSession.
+    """
+    claims = _claims(token)
+    user = await db.run_sync(_cached_user, claims) if claims is not None else None
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
+
+
 def get_current_active_user(current_user: schemas.UserOut = Depends(get_current_user)):
     """
     Ensure the current user is active.
@@ -79,9 +172,9 @@ def get_current_active_user(current_user: schemas.UserOut = Depends(get_current_
     return current_user
 
 
-def get_current_admin_user(current_user: schemas.UserOut = Depends(get_current_user)):
+def get_current_admin_user(current_user: schemas.UserOut = Depends(get_current_active_user)):
     """
-    Ensure the current user has admin privileges.
+    Ensure the current user is active and has admin privileges.
     """
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Not enough permissions")
@@ -1,9 +1,14 @@
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
-from . import models, schemas, utils
+from . import alert_stream, alerts, database, lots, models, notifications, queries, schemas, utils
 from datetime import datetime, timezone
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = utils.get_password_hash(user.password)
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str = None):
+    """
+    Add a user. The API hashes the password in the hashing pool and passes hashed_password.
+    """
+    if hashed_password is None:
+        hashed_password = utils.get_password_hash(user.password)
     db_user = models.User(
         email=user.email,
         hashed_password=hashed_password,
@@ -12,15 +17,34 @@ def create_user(db: Session, user: schemas.UserCreate):
         time_registered=datetime.now(timezone.utc)
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    db.flush()
     return db_user
 
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
-def get_alerts_by_uid(db: Session, uid: int):
-    return db.query(models.AlertSubscription).filter(models.AlertSubscription.uid == uid).all()
+def update_user(db: Session, uid: int, user: schemas.UserUpdate):
+    """
+    Change a user's email, username or role. Cached copies are dropped once this commits (auth).
+    """
+    db_user = db.get(models.User, uid)
+    if db_user is None:
+        return None
+    for name, value in user.model_dump(exclude_unset=True).items():
+        setattr(db_user, name, value)
+    db.flush()
+    return db_user
+
+def deactivate_user(db: Session, uid: int):
+    """
+    Deactivate a user. Cached copies are dropped once this commits (auth).
+    """
+    db_user = db.get(models.User, uid)
+    if db_user is None:
+        return None
+    db_user.deactivated = True
+    db.flush()
+    return db_user
 
 # ---- Portfolio Management Functions ----
 
@@ -35,8 +59,7 @@ def create_portfolio_entry(db: Session, portfolio: schemas.PortfolioCreate):
         time_created=datetime.now(timezone.utc)
     )
     db.add(db_portfolio)
-    db.commit()
-    db.refresh(db_portfolio)
+    db.flush()
     return db_portfolio
 
 def get_portfolio_by_uid(db: Session, uid: int):
@@ -45,6 +68,19 @@ def get_portfolio_by_uid(db: Session, uid: int):
     """
     return db.query(models.Portfolio).filter(models.Portfolio.uid == uid).all()
 
+def get_portfolio_value(db: Session, uid: int):
+    """
+    Market value of a user's portfolio, SUM(quantity * latest price) computed in the database.
+    """
+    return db.query(
+        func.coalesce(func.sum(models.Portfolio.quantity * models.Price.current_price), 0)
+    ).join(
+        models.Price, models.Price.cid == models.Portfolio.cid
+    ).filter(
+        models.Portfolio.uid == uid,
+        queries.latest_price_filter(),
+    ).scalar()
+
 def get_portfolio_by_uid_and_cid(db: Session, uid: int, cid: str):
     """
     Retrieve a specific portfolio entry by UID and CID.
@@ -55,31 +91,30 @@ def get_portfolio_by_uid_and_cid(db: Session, uid: int, cid: str):
     ).first()
 
 def update_portfolio(db: Session, uid: int, cid: str, quantity_change: float):
-    portfolio_entry = db.query(models.Portfolio).filter(models.Portfolio.uid == uid, models.Portfolio.cid == cid).first()
+    """
+    Apply a quantity change to the user's position. Written with the caller's next flush/commit.
+    """
+    portfolio_entry = get_portfolio_by_uid_and_cid(db, uid, cid)
     
     if portfolio_entry:
         # Update existing portfolio quantity
-        portfolio_entry.amount += quantity_change
+        portfolio_entry.quantity += quantity_change
         
         # If the resulting quantity is zero or negative, consider removing the entry (optional)
-        if portfolio_entry.amount <= 0:
-            delete_portfolio_entry(db, uid, cid)
-        else:
-            db.commit()
+        if portfolio_entry.quantity <= 0:
+            db.delete(portfolio_entry)
     else:
         # If no entry exists, create a new one (only for positive quantities)
         if quantity_change > 0:
-            new_portfolio = models.Portfolio(uid=uid, cid=cid, amount=quantity_change, time_added=datetime.now(timezone.utc))
+            new_portfolio = models.Portfolio(uid=uid, cid=cid, quantity=quantity_change, time_created=datetime.now(timezone.utc))
             db.add(new_portfolio)
-            db.commit()
-            db.refresh(new_portfolio)
             return new_portfolio
 
 def delete_portfolio_entry(db: Session, uid: int, cid: str):
-    portfolio_entry = db.query(models.Portfolio).filter(models.Portfolio.uid == uid, models.Portfolio.cid == cid).first()
+    portfolio_entry = get_portfolio_by_uid_and_cid(db, uid, cid)
     if portfolio_entry:
         db.delete(portfolio_entry)
-        db.commit()
+        db.flush()
         return True
     return False
 # ---- Price Alert Management Functions ----
@@ -93,24 +128,51 @@ def create_alert_subscription(db: Session, alert: schemas.AlertCreate):
         subscription_active=True
     )
     db.add(db_alert)
-    db.commit()
-    db.refresh(db_alert)
+    db.flush()  # assigns asid
 
     db_price_alert = models.PriceAlertSubscription(
         asid=db_alert.asid,
+        cid=alert.cid,
         threshold=alert.price_target,
         threshold_percentage=alert.threshold_percentage
     )
     db.add(db_price_alert)
-    db.commit()
-    db.refresh(db_price_alert)
+    db.flush()
+
+    # Keep the tick-driven alert book in sync, once the subscription is committed
+    pipeline = alert_stream.pipeline
+    if pipeline.active and alert.price_target is not None:
+        entry = alert_stream.AlertEntry(db_alert.asid, alert.uid, alert.cid, alert.price_target, alert.threshold_percentage)
+        database.after_commit(db, lambda: pipeline.add(entry))
     return db_alert
 
+def alert_columns():
+    return (
+        models.AlertSubscription.asid, models.AlertSubscription.uid, models.AlertSubscription.cid,
+        models.AlertSubscription.alert_type, models.AlertSubscription.subscription_active,
+        models.AlertSubscription.time_subscribed, models.AlertSubscription.time_triggered,
+        models.PriceAlertSubscription.threshold.label("price_target"), models.PriceAlertSubscription.threshold_percentage,
+    )
+
+def get_alert(db: Session, asid: int):
+    """
+    One alert subscription with its price target.
+    """
+    return db.execute(
+        select(*alert_columns()).outerjoin(
+            models.PriceAlertSubscription, models.PriceAlertSubscription.asid == models.AlertSubscription.asid
+        ).where(models.AlertSubscription.asid == asid)
+    ).mappings().first()
+
 def get_alerts_by_uid(db: Session, uid: int):
     """
-    Retrieve all active alerts for a specific user by UID.
+    Retrieve all alerts of a user with their price targets, active ones and deactivated ones.
     """
-    return db.query(models.AlertSubscription).filter(models.AlertSubscription.uid == uid).all()
+    return db.execute(
+        select(*alert_columns()).outerjoin(
+            models.PriceAlertSubscription, models.PriceAlertSubscription.asid == models.AlertSubscription.asid
+        ).where(models.AlertSubscription.uid == uid).order_by(models.AlertSubscription.asid)
+    ).mappings().all()
 
 def deactivate_alert(db: Session, asid: int):
     """
@@ -119,54 +181,27 @@ def deactivate_alert(db: Session, asid: int):
     db_alert = db.query(models.AlertSubscription).filter(models.AlertSubscription.asid == asid).first()
     if db_alert:
         db_alert.subscription_active = False
-        db.commit()
-        db.refresh(db_alert)
+        db.flush()
+
+        pipeline = alert_stream.pipeline
+        if pipeline.active:
+            database.after_commit(db, lambda: pipeline.remove(asid))
         return db_alert
     return None
 
-def check_price_targets(db: Session):
+def check_price_targets(db: Session, cids: list = None):
     """
-    Check if any cryptocurrency price is within 10% of the user's alert threshold.
-    If so, create a notification message for the user.
+    Check if any cryptocurrency's latest price (of cids, or all) is within the alert band of the user's threshold.
+    If so, create a notification message for the user. See alerts.evaluate; the scheduler's alerts job runs it.
     """
-    alerts = db.query(models.PriceAlertSubscription, models.AlertSubscription, models.Price).join(
-        models.AlertSubscription, models.PriceAlertSubscription.asid == models.AlertSubscription.asid
-    ).join(
-        models.Price, models.AlertSubscription.cid == models.Price.cid
-    ).filter(models.AlertSubscription.subscription_active == True).all()
+    return alerts.evaluate(db, cids=cids)
 
-    for alert in alerts:
-        threshold = float(alert.PriceAlertSubscription.threshold)
-        current_price = float(alert.Price.current_price)
-        
-        # Check if price is within 10% of the target threshold
-        if abs(current_price - threshold) / threshold <= 0.1:
-            # Create a message to notify the user
-            create_message(
-                db=db,
-                uid=alert.AlertSubscription.uid,
-                asid=alert.AlertSubscription.asid,
-                message_type="Price Alert",
-                body=f"The price of {alert.AlertSubscription.cid} is within 10% of your target price.",
-            )
-
-#TODO: Implement message
 def create_message(db: Session, uid: int, asid: int, message_type: str, body: str):
     """
-    Create a new message for the user.
+    Send the user a message. It is queued once the request commits and written in a batch by
+    the notification outbox, see server/notifications.py.
     """
-    db_message = models.Message(
-        uid=uid,
-        asid=asid,
-        message_type=message_type,
-        body=body,
-        time_sent=datetime.now(timezone.utc),
-        read=False
-    )
-    db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
-    return db_message
+    return notifications.notify(db, uid, asid, message_type, body)
 
 # ---- Cryptocurrency Management Functions ----
 
@@ -182,6 +217,12 @@ def get_price_by_cid(db: Session, cid: str):
     """
     return db.query(models.Price).filter(models.Price.cid == cid).first()
 
+def get_latest_price(db: Session, cid: str):
+    """
+    Most recent Price row for a coin (walks idx_price_cid_timestamp backwards).
+    """
+    return db.query(models.Price).filter(models.Price.cid == cid).order_by(models.Price.time_stamp.desc()).first()
+
 # ---- Transaction Management Functions ----
 
 def create_transaction(db: Session, transaction: schemas.TransactionCreate):
@@ -192,7 +233,7 @@ def create_transaction(db: Session, transaction: schemas.TransactionCreate):
     quantity_change = transaction.position if transaction.success else 0
 
     # Create the transaction record
-    db_transaction = schemas.TransactionCreate(
+    db_transaction = models.Transaction(
         uid=transaction.uid,
         wid=transaction.wid,
         cid=transaction.cid,
@@ -200,13 +241,13 @@ def create_transaction(db: Session, transaction: schemas.TransactionCreate):
         ex_rate=transaction.ex_rate,
         position=transaction.position,
         network=transaction.network,
-        gas_fee=transaction.gas_fee,
         success=transaction.success,
-        time_transaction=datetime.now(timezone.utc)
+        time_transaction=transaction.time_transaction
     )
     db.add(db_transaction)
-    db.commit()
-    db.refresh(db_transaction)
+    db.flush()  # assigns tid
+    # Lot snapshot of the position, in the same commit as the ledger row
+    lots.record_transaction(db, db_transaction)
 
     # Update the portfolio and wallet balances if the transaction was successful
     if transaction.success:
@@ -221,6 +262,7 @@ def create_transaction(db: Session, transaction: schemas.TransactionCreate):
             body=f"Transaction for {transaction.cid} has been processed successfully."
         )
 
+    # Portfolio rows go out with the request's commit, the message right after it
     return db_transaction
 
 def get_transactions_by_uid(db: Session, uid: int):
@@ -264,8 +306,7 @@ def create_wallet(db: Session, wallet: schemas.WalletCreate):
         time_accessed=wallet.time_accessed
     )
     db.add(db_wallet)
-    db.commit()
-    db.refresh(db_wallet)
+    db.flush()
     return db_wallet
 
 def update_wallet(db: Session, wid: int, wallet: schemas.WalletUpdate):
@@ -276,8 +317,7 @@ def update_wallet(db: Session, wid: int, wallet: schemas.WalletUpdate):
     if db_wallet:
         db_wallet.wname = wallet.wname
         db_wallet.time_accessed = wallet.time_accessed
-        db.commit()
-        db.refresh(db_wallet)
+        db.flush()
         return db_wallet
     return None
 
@@ -294,6 +334,6 @@ def delete_wallet(db: Session, wid: int):
     db_wallet = db.query(models.Wallet).filter(models.Wallet.wid == wid).first()
     if db_wallet:
         db.delete(db_wallet)
-        db.commit()
+        db.flush()
         return True
     return False
\ No newline at end of file
@@ -1,15 +1,252 @@
 # server/database.py
+"""
+Engine, sessions and the unit of work.
+
+The engine is built from a per-backend profile:
+
+  sqlite      QueuePool, and on every new connection journal_mode=WAL (readers no longer block
+              the writer, nor it them), synchronous=NORMAL (no fsync per commit in WAL, still
+              crash safe), a memory-mapped read path of SQLITE_MMAP_SIZE bytes and a busy timeout
+              of SQLITE_BUSY_TIMEOUT_MS, so writers from other gunicorn workers wait for the
+              lock instead of failing with "database is locked".
+  postgresql  QueuePool of DB_POOL_SIZE + DB_MAX_OVERFLOW, pre-ping, recycled after
+              DB_POOL_RECYCLE seconds and a server-side statement_timeout of DB_STATEMENT_TIMEOUT_MS.
+
+Pool sizes and timeouts apply to every pooled backend. pool_stats() reports the pool of this
+process, served at /db/stats; metrics of every engine are served at /metrics (server/metrics.py),
+its slow statements at /debug/slow-queries (server/profiling.py).
+
+With DB_ASYNC=true a second, async engine is built from the same URL and profile with the
+backend's async driver (aiosqlite, asyncpg), and server/async_routes.py replaces the hot routes
+with async handlers on AsyncSessionLocal sessions. Both engines share the database, so routes
+can move over one at a time.
+"""
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
 
-engine = create_engine(os.getenv("SQLALCHEMY_DATABASE_URL"))
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from . import metrics, profiling
+
+SQLALCHEMY_DATABASE_URL = os.getenv("SQLALCHEMY_DATABASE_URL")
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() == "true"
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "10000"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "20000"))
+
+
+def _sqlite_profile(url) -> dict:
+    if url.database in (None, "", ":memory:"):
+        # In-memory databases keep SQLAlchemy's single-connection defaults
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        # aiosqlite would default to a new connection (and thread) per checkout
+        **({"poolclass": AsyncAdaptedQueuePool} if url.get_driver_name() == "aiosqlite" else {}),
+    }
+
+
+def _postgresql_profile(url) -> dict:
+    connect_args = {}
+    if url.get_driver_name() in ("psycopg2", "psycopg"):
+        connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    elif url.get_driver_name() == "asyncpg":
+        connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+        "connect_args": connect_args,
+    }
+
+
+PROFILES = {
+    "sqlite": _sqlite_profile,
+    "postgresql": _postgresql_profile,
+}
+
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+}
+
+
+def pool_counters() -> dict:
+    return {"connects": 0, "checkouts": 0, "checkins": 0, "invalidated": 0, "max_checked_out": 0}
+
+
+def _configure(new_engine, parsed, counters: dict, name: str):
+    if new_engine.dialect.name == "sqlite" and parsed.database not in (None, "", ":memory:"):
+        event.listen(new_engine, "connect", _sqlite_pragmas)
+    _track_pool(new_engine, counters)
+    metrics.instrument_engine(new_engine, name)
+    profiling.instrument_engine(new_engine, name)
+    return new_engine
+
+
+def create_engine_for(url: str, counters: dict = None, name: str = "primary"):
+    """
+    An engine for url with its backend's profile applied. Pool events are counted into counters,
+    the primary's by default; its metrics are labelled engine=name.
+    """
+    parsed = make_url(url)
+    profile = PROFILES.get(parsed.get_backend_name())
+    return _configure(create_engine(parsed, **(profile(parsed) if profile else {})), parsed,
+                      _pool_events if counters is None else counters, name)
+
+
+def create_async_engine_for(url: str):
+    """
+    An AsyncEngine for url on its backend's async driver, with the same profile.
+    """
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"DB_ASYNC: no async driver for {backend}")
+    parsed = parsed.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+    async_engine = create_async_engine(parsed, **PROFILES[backend](parsed))
+    # Events go to the sync engine the AsyncEngine proxies
+    _configure(async_engine.sync_engine, parsed, _async_pool_events, "async")
+    return async_engine
+
 
-SessionLocal = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.close()
 
-def get_db():
+
+_pool_events = pool_counters()
+_async_pool_events = pool_counters()
+
+
+def _track_pool(tracked, counters: dict):
+    def on_connect(dbapi_connection, connection_record):
+        counters["connects"] += 1
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        counters["checkouts"] += 1
+        checked_out = counters["checkouts"] - counters["checkins"]
+        if checked_out > counters["max_checked_out"]:
+            counters["max_checked_out"] = checked_out
+
+    def on_checkin(dbapi_connection, connection_record):
+        counters["checkins"] += 1
+
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        counters["invalidated"] += 1
+
+    event.listen(tracked, "connect", on_connect)
+    event.listen(tracked, "checkout", on_checkout)
+    event.listen(tracked, "checkin", on_checkin)
+    event.listen(tracked, "invalidate", on_invalidate)
+
+
+def engine_stats(stats_engine, counters: dict) -> dict:
+    pool = stats_engine.pool
+    stats = {"backend": stats_engine.dialect.name, "pool": type(pool).__name__, **counters}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, name):
+            stats[name] = getattr(pool, name)()
+    return stats
+
+
+def pool_stats() -> dict:
+    """
+    Pool size and usage counters of this process's engine, and of the async engine under "async".
+    """
+    stats = engine_stats(engine, _pool_events)
+    if async_engine is not None:
+        stats["async"] = engine_stats(async_engine.sync_engine, _async_pool_events)
+    return stats
+
+
+class UnitOfWorkSession(Session):
+    """
+    Session running after_commit() callbacks; the sync session behind every AsyncSession too.
+    """
+
+
+engine = create_engine_for(SQLALCHEMY_DATABASE_URL)
+
+# A plain factory: every caller gets its own session and closes it
+SessionLocal = sessionmaker(class_=UnitOfWorkSession, autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+async_engine = create_async_engine_for(SQLALCHEMY_DATABASE_URL) if DB_ASYNC else None
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, sync_session_class=UnitOfWorkSession, autoflush=False, expire_on_commit=False,
+) if DB_ASYNC else None
+
+def get_db(request: Request):
+    """
+    Unit of work per request: CRUD functions only flush, the request commits once when the
+    handler returns and rolls back if it raises. A request that wrote is marked in
+    request.state.db_wrote, for read-your-writes on the replicas (server/replicas.py).
+    """
     db = SessionLocal()
     try:
         yield db
+        db.commit()
+        if db.info.pop("wrote", False):
+            request.state.db_wrote = True
+    except Exception:
+        db.rollback()
+        raise
     finally:
         db.close()
+
+async def get_async_db(request: Request):
+    """
+    get_db for the async routes: an AsyncSession per request, committed once the handler returns.
+    """
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+            await db.commit()
+            if db.info.pop("wrote", False):
+                request.state.db_wrote = True
+        except Exception:
+            await db.rollback()
+            raise
+
+def after_commit(db, callback):
+    """
+    Run callback once the session's current transaction commits; dropped if it rolls back.
+    Works for AsyncSessions as well, their info is the sync session's.
+    """
+    db.info.setdefault("after_commit", []).append(callback)
+
+@event.listens_for(UnitOfWorkSession, "after_commit")
+def _run_after_commit(db):
+    for callback in db.info.pop("after_commit", ()):
+        callback()
+
+@event.listens_for(UnitOfWorkSession, "after_rollback")
+def _drop_after_commit(db):
+    db.info.pop("after_commit", None)
+    db.info.pop("wrote", None)
+
+@event.listens_for(UnitOfWorkSession, "after_flush")
+def _mark_written(db, flush_context):
+    db.info["wrote"] = True
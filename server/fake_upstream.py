@@ -0,0 +1,137 @@
+# server/fake_upstream.py
+"""
+Local stand-in for the CoinGecko API, for tests and benchmarks.
+
+Serves /coins/{id} and /coins/markets with deterministic random-walk prices.
+Point the app at it with COINGECKO_API_URL=http://127.0.0.1:<port>.
+
+    python -m server.fake_upstream --port 8001 --latency 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeMarket:
+    """
+    Random-walk price source keyed by coin id.
+    """
+
+    def __init__(self, seed: int = 42):
+        self._rng = random.Random(seed)
+        self._prices = {}
+        self._changes = {}  # coin id -> its fixed 24h change in percent
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def quote(self, coin_id: str):
+        with self._lock:
+            price = self._prices.get(coin_id)
+            if price is None:
+                price = self._rng.uniform(0.1, 50000)
+            price *= 1 + self._rng.gauss(0, 0.002)
+            self._prices[coin_id] = price
+            change = self._changes.setdefault(coin_id, self._rng.uniform(-15, 15))
+        return {
+            "id": coin_id,
+            "symbol": coin_id[:4],
+            "name": coin_id.title(),
+            "current_price": price,
+            "market_cap": int(price * 1_000_000),
+            "market_cap_rank": abs(hash(coin_id)) % 5000 + 1,
+            "total_volume": int(price * 50_000),
+            "high_24h": price * 1.03,
+            "low_24h": price * 0.97,
+            "price_change_24h": price * change / 100,
+            "price_change_percentage_24h": change,
+            "market_cap_change_24h": int(price * 10_000),
+            "last_updated": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+        }
+
+    def coin_document(self, coin_id: str):
+        quote = self.quote(coin_id)
+        usd = lambda key: {"usd": quote[key]}
+        return {
+            "id": coin_id,
+            "symbol": quote["symbol"],
+            "name": quote["name"],
+            "market_cap_rank": quote["market_cap_rank"],
+            "market_data": {
+                "current_price": usd("current_price"),
+                "market_cap": usd("market_cap"),
+                "total_volume": usd("total_volume"),
+                "high_24h": usd("high_24h"),
+                "low_24h": usd("low_24h"),
+                "price_change_24h": quote["price_change_24h"],
+                "price_change_percentage_24h": quote["price_change_percentage_24h"],
+            },
+            # Pad the document roughly to the size of the real one
+            "description": {"en": "x" * 200_000},
+        }
+
+
+def make_handler(market: FakeMarket, latency: float = 0.0, fail_rate: float = 0.0):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            market.requests += 1
+            if latency:
+                time.sleep(latency)
+            if fail_rate and random.random() < fail_rate:
+                return self._send(503, {"error": "unavailable"})
+            url = urlparse(self.path)
+            parts = [p for p in url.path.split("/") if p]
+            if parts == ["coins", "markets"]:
+                query = parse_qs(url.query)
+                ids = [i for i in query.get("ids", [""])[0].split(",") if i]
+                per_page = int(query.get("per_page", ["100"])[0])
+                page = int(query.get("page", ["1"])[0])
+                ids = ids[(page - 1) * per_page:page * per_page]
+                return self._send(200, [market.quote(coin_id) for coin_id in ids])
+            if len(parts) == 2 and parts[0] == "coins":
+                return self._send(200, market.coin_document(parts[1]))
+            if parts == ["ping"]:
+                return self._send(200, {"gecko_says": "(V3) To the Moon!"})
+            self._send(404, {"error": "not found"})
+
+    return Handler
+
+
+def start_fake_upstream(host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, fail_rate: float = 0.0):
+    """
+    Start the stub server on a background thread. Returns (server, market); stop with server.shutdown().
+    """
+    market = FakeMarket()
+    server = ThreadingHTTPServer((host, port), make_handler(market, latency, fail_rate))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, market
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake CoinGecko upstream")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    args = parser.parse_args()
+    market = FakeMarket()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(market, args.latency, args.fail_rate))
+    print(f"Fake CoinGecko listening on http://{args.host}:{args.port}")
+    server.serve_forever()
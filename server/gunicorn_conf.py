@@ -0,0 +1,29 @@
+# server/gunicorn_conf.py
+"""
+gunicorn hooks of the API (compose.yaml: gunicorn -c server/gunicorn_conf.py ...).
+
+With PROMETHEUS_MULTIPROC_DIR set, the workers keep their metrics in files of that directory
+(server/metrics.py). The files of a previous run are removed when gunicorn starts, and the
+gauges of a worker that exits are dropped, its counters kept.
+"""
+import glob
+import os
+
+try:
+    from prometheus_client import multiprocess
+except ImportError:
+    multiprocess = None
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+
+def on_starting(server):
+    if PROMETHEUS_MULTIPROC_DIR:
+        os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+        for path in glob.glob(os.path.join(PROMETHEUS_MULTIPROC_DIR, "*.db")):
+            os.remove(path)
+
+
+def child_exit(server, worker):
+    if PROMETHEUS_MULTIPROC_DIR and multiprocess is not None:
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,126 @@
+# server/hashing.py
+"""
+Argon2 password hashing off the request path.
+
+Each Argon2 hash is deliberately expensive: tens of milliseconds of CPU and ARGON2_MEMORY_COST KiB
+of memory. Done inline in the /token and /users/ handlers, a login storm fills the threadpool
+and the worker's CPU, and every other route waits behind it. Instead:
+
+  * hashes run in a process pool of HASH_WORKERS processes per API worker. The default shares
+    the cores among the WEB_CONCURRENCY API workers (gunicorn's worker count), at least one
+    each, so the host runs about one Argon2 process per core, each needing ARGON2_MEMORY_COST
+    KiB. The pool processes run at `nice` HASH_NICE, so request handling keeps priority on
+    the CPU. With HASH_WORKERS=0, hashes run in the threadpool instead (development, tests).
+  * admission control: at most HASH_MAX_PENDING hashes are queued or running per API worker.
+    Beyond that, hash_password/verify_password raise Overloaded at once and the routes answer
+    503 with Retry-After. Shedding logins this way keeps price endpoints responsive.
+  * cost parameters come from ARGON2_TIME_COST, ARGON2_MEMORY_COST and ARGON2_PARALLELISM
+    (utils.ph). A successful login whose stored hash was made with other parameters gets a
+    fresh hash from verify_password, which the caller stores.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from argon2.exceptions import InvalidHashError, VerificationError
+from fastapi.concurrency import run_in_threadpool
+
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(max(1, (os.cpu_count() or 1) // max(WEB_CONCURRENCY, 1)))))
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", str(4 * max(HASH_WORKERS, 1))))
+HASH_NICE = int(os.getenv("HASH_NICE", "10"))
+HASH_RETRY_AFTER = 1
+
+stats = {"hashed": 0, "verified": 0, "rehashed": 0, "shed": 0, "pending": 0}
+
+_executor = None
+_pending = 0
+
+
+class Overloaded(Exception):
+    """
+    More than HASH_MAX_PENDING hashes in flight; the caller should answer 503.
+    """
+
+
+def _init_worker():
+    if HASH_NICE and hasattr(os, "nice"):
+        os.nice(HASH_NICE)
+
+
+def _hash(password: str) -> str:
+    return utils.ph.hash(password)
+
+
+def _verify(hashed: str, password: str):
+    """
+    (matches, new hash if the stored one was made with other parameters).
+    """
+    try:
+        utils.ph.verify(hashed, password)
+    except (VerificationError, InvalidHashError):
+        return False, None
+    return True, utils.ph.hash(password) if utils.ph.check_needs_rehash(hashed) else None
+
+
+def start():
+    """
+    The process pool, started on first use. Its processes are spawned, so like any
+    multiprocessing program the entry script needs an `if __name__ == "__main__":` guard.
+    """
+    global _executor
+    if _executor is None and HASH_WORKERS > 0:
+        # spawn: forking a process that already runs an event loop and threads isn't safe
+        _executor = ProcessPoolExecutor(
+            HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker,
+        )
+        for _ in range(HASH_WORKERS):
+            _executor.submit(int)
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+async def _run(fn, *args):
+    global _pending
+    if _pending >= HASH_MAX_PENDING:
+        stats["shed"] += 1
+        raise Overloaded()
+    _pending += 1
+    stats["pending"] = _pending
+    try:
+        executor = start()
+        if executor is None:
+            return await run_in_threadpool(fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+    finally:
+        _pending -= 1
+        stats["pending"] = _pending
+
+
+async def hash_password(password: str) -> str:
+    hashed = await _run(_hash, password)
+    stats["hashed"] += 1
+    return hashed
+
+
+async def verify_password(hashed: str, password: str):
+    """
+    (matches, new hash or None). Raises Overloaded when too many hashes are in flight.
+    """
+    matches, new_hash = await _run(_verify, hashed, password)
+    stats["verified"] += 1
+    if new_hash is not None:
+        stats["rehashed"] += 1
+    return matches, new_hash
@@ -0,0 +1,150 @@
+# server/ingest.py
+"""
+Background price ingestion.
+
+Polls the configured coin universe through /coins/markets every INGEST_INTERVAL seconds and
+bulk-inserts one Price row per coin per poll. The poll is the `ingest` job of server/scheduler.py,
+which runs it in one process per host: its own (`python -m server.scheduler`, or equally
+`python -m server.ingest`) or one of the API workers (INGEST_IN_APP=true).
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import insert
+
+from . import alert_stream, market_cache, market_client, models, price_stream
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+INGEST_COINS = [c.strip() for c in os.getenv("INGEST_COINS", "bitcoin,ethereum,tether,solana,ripple").split(",") if c.strip()]
+INGEST_INTERVAL = float(os.getenv("INGEST_INTERVAL", "60"))
+INGEST_IN_APP = os.getenv("INGEST_IN_APP", "false").lower() == "true"
+# Feed every ingested price through the incremental alert pipeline
+ALERT_STREAM_ENABLED = os.getenv("ALERT_STREAM_ENABLED", "true").lower() == "true"
+ALERT_STREAM_SYNC_INTERVAL = float(os.getenv("ALERT_STREAM_SYNC_INTERVAL", "60"))
+# OHLCV rollups, archiving of cold ticks and price retention, another scheduler job
+ROLLUP_INTERVAL = float(os.getenv("ROLLUP_INTERVAL", "60"))
+
+stats = {
+    "runs": 0,
+    "failures": 0,
+    "rows_total": 0,
+    "last_rows": 0,
+    "last_rows_per_sec": None,
+    "last_duration": None,
+    "last_run_at": None,
+    # seconds between the upstream's last_updated and our commit, worst coin of the last run
+    "last_lag": None,
+}
+
+
+def _parse_upstream_time(value):
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _to_int(value):
+    return int(value) if value is not None else None
+
+
+def _to_float(value):
+    return float(value) if value is not None else None
+
+
+def price_row(row: dict, time_stamp: datetime):
+    """
+    Map a /coins/markets row to Price column values.
+    """
+    return {
+        "cid": row["id"],
+        "current_price": _to_float(row.get("current_price")),
+        "market_cap": _to_int(row.get("market_cap")),
+        "market_cap_rank": row.get("market_cap_rank"),
+        "total_volume": _to_int(row.get("total_volume")),
+        "high_24h": _to_float(row.get("high_24h")),
+        "low_24h": _to_float(row.get("low_24h")),
+        "price_change_24h": _to_float(row.get("price_change_24h")),
+        "price_change_percentage_24h": _to_float(row.get("price_change_percentage_24h")),
+        "market_cap_change_24h": _to_int(row.get("market_cap_change_24h")),
+        "time_stamp": time_stamp,
+    }
+
+
+def write_prices(rows: list):
+    """
+    Bulk insert Price rows in one statement and one commit.
+    """
+    db = SessionLocal()
+    try:
+        db.execute(insert(models.Price), rows)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def ingest_once(coin_ids: list = None):
+    coin_ids = coin_ids or INGEST_COINS
+    started = time.perf_counter()
+    markets = await market_client.client.get_markets(coin_ids)
+    now = datetime.now(timezone.utc)
+    rows = [price_row(row, now) for row in markets]
+    if rows:
+        await asyncio.to_thread(write_prices, rows)
+        if alert_stream.pipeline.active:
+            ticks = [(row["cid"], row["current_price"]) for row in rows if row["current_price"] is not None]
+            await asyncio.to_thread(alert_stream.pipeline.process, ticks)
+
+    # Fresh rows double as cache entries for /crypto lookups, and go to the price subscribers of every worker
+    prices = {row["id"]: market_client.extract_market_price_info(row) for row in markets}
+    await market_cache.cache.set_many(prices)
+    await price_stream.publish(prices)
+
+    duration = time.perf_counter() - started
+    committed = datetime.now(timezone.utc)
+    updated = [t for t in (_parse_upstream_time(row.get("last_updated")) for row in markets) if t]
+    stats["runs"] += 1
+    stats["rows_total"] += len(rows)
+    stats["last_rows"] = len(rows)
+    stats["last_duration"] = duration
+    stats["last_rows_per_sec"] = len(rows) / duration if duration else None
+    stats["last_run_at"] = committed.isoformat()
+    stats["last_lag"] = (committed - min(updated)).total_seconds() if updated else None
+    logger.info(
+        f"Ingested {len(rows)} prices in {duration:.3f}s "
+        f"({stats['last_rows_per_sec'] or 0:.1f} rows/s, lag {stats['last_lag']}s)"
+    )
+    return len(rows)
+
+
+def _with_session(fn):
+    db = SessionLocal()
+    try:
+        return fn(db)
+    finally:
+        db.close()
+
+
+async def ingest_job():
+    """
+    Scheduler job: loads the alert book on the leader's first run, then ingests once.
+    """
+    if ALERT_STREAM_ENABLED and not alert_stream.pipeline.active:
+        await asyncio.to_thread(_with_session, alert_stream.pipeline.load)
+    try:
+        await ingest_once()
+    except Exception:
+        stats["failures"] += 1
+        raise
+
+
+if __name__ == "__main__":
+    # Ingestion runs with the other periodic jobs, see server/scheduler.py
+    from .scheduler import run
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run())
@@ -1,7 +1,13 @@
 # server/init_db.py
+"""
+Create the tables (OVERWRITE_TABLES=true drops them first).
+
+    python -m server.init_db
+"""
 import os
-from database import engine
-from models import Base
+
+from .database import engine
+from .models import Base
 
 # Check if the environment variable DROP_ALL_TABLES is set to "true"
 overwrite_tables = os.getenv("OVERWRITE_TABLES", "false").lower() == "true"
@@ -15,4 +21,4 @@ if overwrite_tables:
 print("Creating all tables...")
 Base.metadata.create_all(bind=engine)
 
-print("Database initialization complete.")
\ No newline at end of file
+print("Database initialization complete.")
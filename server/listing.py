@@ -0,0 +1,134 @@
+# server/listing.py
+"""
+Keyset pagination and NDJSON streaming for the per-user listings:
+
+    GET /transaction/{uid}   ordered by (time_transaction, tid), idx_transaction_uid_time_tid
+    GET /wallet/{uid}        ordered by wid, ix_wallet_uid
+    GET /portfolio/{uid}     ordered by cid, the (uid, cid) primary key
+    GET /messages            newest first by mid, idx_message_uid_mid (server/notifications.py)
+
+A page is `WHERE uid = ? AND key > after ORDER BY key LIMIT n`: one index range scan however
+deep into the history it is, where OFFSET would read and throw away every earlier row. `after`
+is an opaque cursor holding the sort key of the previous page's last row; the next page's URL
+comes back in a `Link: <...>; rel="next"` header, and there is none on the last page.
+
+format=ndjson (or `Accept: application/x-ndjson`) streams the whole listing, one JSON object
+per line, fetched STREAM_BATCH_ROWS at a time with yield_per (a server-side cursor on
+PostgreSQL), so memory stays flat however long the history is. Rows are read as Core tuples
+and encoded by server/serialization.py.
+"""
+import base64
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import Session
+
+from . import models, schemas, serialization
+from .database import SessionLocal
+
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "1000"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "10000"))
+STREAM_BATCH_ROWS = int(os.getenv("STREAM_BATCH_ROWS", "2000"))
+
+FORMATS = ("json", "ndjson")
+NDJSON = "application/x-ndjson"
+
+# Listing name -> (table, sort key, row schema)
+LISTINGS = {
+    "transaction": (models.Transaction.__table__, ("time_transaction", "tid"), schemas.TransactionOut),
+    "wallet": (models.Wallet.__table__, ("wid",), schemas.WalletOut),
+    "portfolio": (models.Portfolio.__table__, ("cid",), schemas.PortfolioOut),
+    # Newest first, paged by notifications.inbox
+    "message": (models.Message.__table__, ("mid",), schemas.MessageOut),
+}
+
+
+def format_for(accept: str):
+    """
+    Listing format from an Accept header: ndjson if asked for, json otherwise.
+    """
+    return "ndjson" if NDJSON in (accept or "") else "json"
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def encode_cursor(name: str, row) -> str:
+    _, key, _ = LISTINGS[name]
+    values = [row[column] for column in key]
+    return base64.urlsafe_b64encode(json.dumps(values, default=_json_default, separators=(",", ":")).encode()).decode()
+
+
+def decode_cursor(name: str, after: str) -> tuple:
+    """
+    Sort key from a cursor. Raises ValueError for anything encode_cursor didn't produce.
+    """
+    table, key, _ = LISTINGS[name]
+    try:
+        values = json.loads(base64.urlsafe_b64decode(after.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(key):
+        raise ValueError("Invalid cursor")
+    decoded = []
+    for column, value in zip(key, values):
+        python_type = table.c[column].type.python_type
+        try:
+            decoded.append(datetime.fromisoformat(value) if python_type is datetime else python_type(value))
+        except (TypeError, ValueError):
+            raise ValueError("Invalid cursor")
+    return tuple(decoded)
+
+
+def query(name: str, uid: int, after: str = None, limit: int = None):
+    """
+    SELECT of one user's rows in sort key order, starting after the cursor.
+    """
+    table, key, _ = LISTINGS[name]
+    columns = [table.c[column] for column in key]
+    statement = select(table).where(table.c.uid == uid).order_by(*columns)
+    if after is not None:
+        statement = statement.where(tuple_(*columns) > tuple_(*decode_cursor(name, after)))
+    if limit is not None:
+        statement = statement.limit(limit)
+    return statement
+
+
+def page(db: Session, name: str, uid: int, after: str = None, limit: int = PAGE_SIZE):
+    """
+    Up to limit rows after the cursor, and the cursor of the next page (None on the last one).
+    """
+    rows = serialization.rows(db.execute(query(name, uid, after, limit + 1)))
+    next_after = encode_cursor(name, rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_after
+
+
+def exists(db: Session, name: str, uid: int) -> bool:
+    table, _, _ = LISTINGS[name]
+    return db.execute(select(table.c.uid).where(table.c.uid == uid).limit(1)).first() is not None
+
+
+def stream(name: str, uid: int, after: str = None, bind=None):
+    """
+    The listing as NDJSON chunks of STREAM_BATCH_ROWS lines. Runs after the request's session
+    is gone, so it reads on a session of its own, on bind (a replica) if given. The cursor is
+    decoded before the first chunk.
+    """
+    statement = query(name, uid, after).execution_options(yield_per=STREAM_BATCH_ROWS)
+    return _ndjson(statement, bind)
+
+
+def _ndjson(statement, bind=None):
+    db = SessionLocal(bind=bind) if bind is not None else SessionLocal()
+    try:
+        result = db.execute(statement)
+        keys = list(result.keys())
+        for rows in result.partitions():
+            yield serialization.ndjson(keys, rows)
+    finally:
+        db.close()
@@ -0,0 +1,59 @@
+# server/locks.py
+"""
+Host-local leader election between gunicorn workers.
+
+Whoever holds the OS-level lock on the file is the leader; the lock is released by the
+kernel when the holder exits, so a crashed leader is replaced on the next acquire attempt.
+"""
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+    import msvcrt
+
+LOCK_DIR = os.getenv("LEADER_LOCK_DIR", os.path.dirname(__file__))
+
+
+class FileLock:
+    def __init__(self, name: str, lock_dir: str = LOCK_DIR):
+        self.path = os.path.join(lock_dir, f"{name}.lock")
+        self._fd = None
+
+    @property
+    def held(self):
+        return self._fd is not None
+
+    def acquire(self):
+        """
+        Non-blocking. Returns True if this process now holds the lock.
+        """
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,417 @@
+# server/lots.py
+"""
+Cost-basis lot accounting over the transaction ledger.
+
+Every (uid, cid) position keeps its open lots under one of three methods:
+
+    fifo      sells consume the oldest lots first
+    lifo      sells consume the newest lots first
+    average   a single lot at the average cost of everything still held
+
+The state of a position is persisted in LotSnapshot together with the (time_transaction, tid)
+of the last trade applied, so:
+
+  * `record_transaction` applies a new trade to its position's snapshot directly; a trade
+    dated before the snapshot (backfill, import) replays that one position from the ledger;
+  * `catch_up` reads only trades past the method's ledger watermark (LotWatermark, a tid),
+    applying them to their snapshots; positions without a snapshot, or marked stale by
+    `invalidate` after a bulk back-dated insert, are replayed in full along
+    idx_transaction_uid_cid_time;
+  * `rebuild` drops a method's snapshots and streams the whole ledger, users in batches of
+    USERS_PER_BATCH, committing per batch so an interrupted run resumes where it stopped.
+
+Conventions match server/portfolio.py: position > 0 buys, position < 0 sells, ex_rate is the
+unit price; sells beyond the open quantity only close what is held.
+
+    python -m server.lots rebuild --method fifo
+    python -m server.lots catch-up
+"""
+import argparse
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from sqlalchemy import and_, delete, func, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from . import models, queries, schemas, serialization
+from .queries import CHUNK_SIZE
+from .timeseries import naive_utc
+
+logger = logging.getLogger(__name__)
+
+METHODS = ("fifo", "lifo", "average")
+# Method maintained on every new transaction
+LOT_METHOD = os.getenv("LOT_METHOD", "fifo")
+USERS_PER_BATCH = int(os.getenv("LOT_USERS_PER_BATCH", "1000"))
+TIDS_PER_BATCH = 100_000
+# Lots smaller than this are treated as fully consumed (float residue of partial sells)
+EPSILON = 1e-12
+
+
+def _check_method(method: str):
+    if method not in METHODS:
+        raise ValueError(f"Unknown lot method {method!r}, expected one of {', '.join(METHODS)}")
+    return method
+
+
+class LotBook:
+    """
+    Open lots of one position, each [quantity, unit cost, time acquired].
+    """
+
+    __slots__ = ("method", "lots", "realized", "last_time", "last_tid")
+
+    def __init__(self, method: str, lots=None, realized: float = 0.0, last_time: datetime = None, last_tid: int = 0):
+        self.method = method
+        self.lots = deque(lots or ())
+        self.realized = realized
+        self.last_time = last_time
+        self.last_tid = last_tid
+
+    @property
+    def quantity(self):
+        return sum(lot[0] for lot in self.lots)
+
+    @property
+    def cost_basis(self):
+        return sum(lot[0] * lot[1] for lot in self.lots)
+
+    def apply(self, quantity: float, price: float, time_transaction: datetime, tid: int):
+        if quantity > 0:
+            if self.method == "average" and self.lots:
+                lot = self.lots[0]
+                held = lot[0] + quantity
+                lot[1] = (lot[0] * lot[1] + quantity * price) / held
+                lot[0] = held
+            else:
+                self.lots.append([quantity, price, time_transaction])
+        elif quantity < 0:
+            remaining = -quantity
+            newest_first = self.method == "lifo"
+            while remaining > EPSILON and self.lots:
+                lot = self.lots[-1] if newest_first else self.lots[0]
+                taken = min(lot[0], remaining)
+                self.realized += taken * (price - lot[1])
+                lot[0] -= taken
+                remaining -= taken
+                if lot[0] <= EPSILON:
+                    if newest_first:
+                        self.lots.pop()
+                    else:
+                        self.lots.popleft()
+        self.last_time = time_transaction
+        self.last_tid = tid
+
+    def as_row(self, uid: int, cid: str, now: datetime):
+        return {
+            "uid": uid,
+            "cid": cid,
+            "method": self.method,
+            "quantity": self.quantity,
+            "cost_basis": self.cost_basis,
+            "realized_pnl": self.realized,
+            "lots": [[q, cost, acquired.isoformat() if acquired else None] for q, cost, acquired in self.lots],
+            "last_tid": self.last_tid,
+            "last_time": self.last_time,
+            "stale": False,
+            "time_updated": now,
+        }
+
+
+def _from_snapshot(snapshot):
+    lots = [[q, cost, datetime.fromisoformat(acquired) if acquired else None] for q, cost, acquired in snapshot.lots or ()]
+    return LotBook(snapshot.method, lots, snapshot.realized_pnl or 0.0, naive_utc(snapshot.last_time), snapshot.last_tid)
+
+
+def _trade_columns():
+    trade = models.Transaction
+    return trade.tid, trade.uid, trade.cid, trade.position, trade.ex_rate, trade.time_transaction
+
+
+def _pending_trades(method: str, uid_from: int, uid_to: int, cid: str = None, max_tid: int = None):
+    """
+    Successful trades of users in [uid_from, uid_to) that their position's snapshot hasn't
+    applied yet, in replay order, flagged with whether that snapshot exists.
+    """
+    trade = models.Transaction
+    snapshot = models.LotSnapshot
+    query = select(
+        *_trade_columns(), snapshot.uid.isnot(None).label("has_snapshot"),
+    ).outerjoin(
+        snapshot, and_(snapshot.uid == trade.uid, snapshot.cid == trade.cid, snapshot.method == method)
+    ).where(
+        trade.success == True,
+        trade.uid >= uid_from,
+        trade.uid < uid_to,
+        or_(
+            snapshot.uid.is_(None),
+            trade.time_transaction > snapshot.last_time,
+            and_(trade.time_transaction == snapshot.last_time, trade.tid > snapshot.last_tid),
+        ),
+    ).order_by(trade.uid, trade.cid, trade.time_transaction, trade.tid)
+    if cid is not None:
+        query = query.where(trade.cid == cid)
+    if max_tid is not None:
+        query = query.where(trade.tid <= max_tid)
+    return query
+
+
+def _load_books(db: Session, method: str, keys: list):
+    books = {}
+    for i in range(0, len(keys), CHUNK_SIZE):
+        rows = db.execute(
+            select(models.LotSnapshot).where(
+                models.LotSnapshot.method == method,
+                queries.uid_cid_in(models.LotSnapshot.uid, models.LotSnapshot.cid, keys[i:i + CHUNK_SIZE]),
+            )
+        ).scalars()
+        for snapshot in rows:
+            books[(snapshot.uid, snapshot.cid)] = _from_snapshot(snapshot)
+    return books
+
+
+def _write(db: Session, created: dict, updated: dict):
+    now = datetime.now(timezone.utc)
+    if created:
+        db.connection().execute(
+            insert(models.LotSnapshot.__table__), [book.as_row(uid, cid, now) for (uid, cid), book in created.items()]
+        )
+    if updated:
+        # ORM bulk UPDATE by primary key (uid, cid, method)
+        db.execute(update(models.LotSnapshot), [book.as_row(uid, cid, now) for (uid, cid), book in updated.items()])
+
+
+def _replay_range(db: Session, method: str, uid_from: int, uid_to: int, cid: str = None, max_tid: int = None):
+    """
+    Bring the snapshots of users in [uid_from, uid_to) up to date. Returns the number of trades applied.
+    """
+    # Core rows on the session's connection, which doesn't autoflush: snapshots record_transaction
+    # changed in this session must be written first, or their trades are applied twice
+    db.flush()
+    # TIMESTAMP values come back naive already
+    rows = db.connection().execute(_pending_trades(method, uid_from, uid_to, cid, max_tid)).all()
+    if not rows:
+        return 0
+    existing = list(dict.fromkeys((uid, cid) for _, uid, cid, _, _, _, has_snapshot in rows if has_snapshot))
+    books = _load_books(db, method, existing)
+    created = {}
+    for tid, uid, cid, position, ex_rate, time_transaction, _ in rows:
+        book = books.get((uid, cid))
+        if book is None:
+            book = books[(uid, cid)] = created[(uid, cid)] = LotBook(method)
+        book.apply(position or 0.0, ex_rate or 0.0, time_transaction, tid)
+    _write(db, created, {key: book for key, book in books.items() if key not in created})
+    return len(rows)
+
+
+def _replay_positions(db: Session, method: str, keys: list):
+    """
+    Fresh snapshots for positions from their whole history, replacing stale ones.
+    """
+    trade = models.Transaction
+    books = {}
+    replayed = 0
+    for i in range(0, len(keys), CHUNK_SIZE):
+        db.execute(delete(models.LotSnapshot).where(
+            models.LotSnapshot.method == method,
+            queries.uid_cid_in(models.LotSnapshot.uid, models.LotSnapshot.cid, keys[i:i + CHUNK_SIZE]),
+        ))
+        rows = db.connection().execute(
+            select(*_trade_columns()).where(
+                trade.success == True,
+                queries.uid_cid_in(trade.uid, trade.cid, keys[i:i + CHUNK_SIZE]),
+            ).order_by(trade.uid, trade.cid, trade.time_transaction, trade.tid)
+        )
+        for tid, uid, cid, position, ex_rate, time_transaction in rows:
+            book = books.get((uid, cid))
+            if book is None:
+                book = books[(uid, cid)] = LotBook(method)
+            book.apply(position or 0.0, ex_rate or 0.0, time_transaction, tid)
+            replayed += 1
+    _write(db, books, {})
+    return books, replayed
+
+
+def _apply_new(db: Session, method: str, rows: list):
+    """
+    Apply trades past the ledger watermark, sorted by position and time.
+    """
+    keys = list(dict.fromkeys((uid, cid) for _, uid, cid, _, _, _ in rows))
+    books = _load_books(db, method, keys)
+    # Never snapshotted, invalidated, or dropped by a back-dated trade: replayed in full instead
+    _, replayed = _replay_positions(db, method, [key for key in keys if key not in books])
+    touched = {}
+    applied = 0
+    for tid, uid, cid, position, ex_rate, time_transaction in rows:
+        book = books.get((uid, cid))
+        # Trades already applied by record_transaction sort at or before the snapshot
+        if book is None or (time_transaction, tid) <= (book.last_time, book.last_tid):
+            continue
+        book.apply(position or 0.0, ex_rate or 0.0, time_transaction, tid)
+        touched[(uid, cid)] = book
+        applied += 1
+    _write(db, {}, touched)
+    return applied + replayed
+
+
+def _replay_stale(db: Session, method: str, uid: int = None):
+    query = select(models.LotSnapshot.uid, models.LotSnapshot.cid).where(
+        models.LotSnapshot.method == method, models.LotSnapshot.stale == True
+    )
+    if uid is not None:
+        query = query.where(models.LotSnapshot.uid == uid)
+    keys = [tuple(row) for row in db.execute(query)]
+    return _replay_positions(db, method, keys)[1] if keys else 0
+
+
+def _stream_users(db: Session, method: str, max_tid: int):
+    """
+    Replay the ledger up to max_tid, USERS_PER_BATCH users per query and commit.
+    """
+    trade = models.Transaction
+    replayed = 0
+    uid_from = db.execute(select(func.min(trade.uid))).scalar()
+    while uid_from is not None:
+        uid_to = uid_from + USERS_PER_BATCH
+        replayed += _replay_range(db, method, uid_from, uid_to, max_tid=max_tid)
+        db.commit()
+        uid_from = db.execute(select(func.min(trade.uid)).where(trade.uid >= uid_to)).scalar()
+    return replayed
+
+
+def catch_up(db: Session, method: str = LOT_METHOD, uid: int = None):
+    """
+    Apply every trade not yet reflected in the method's snapshots. Returns the number of trades replayed.
+
+    Without a ledger watermark (first build, rebuild) the whole ledger is streamed user batch
+    by user batch; an interrupted run resumes from the snapshots it already wrote. Afterwards
+    only trades past the watermark are read, TIDS_PER_BATCH per commit.
+    """
+    _check_method(method)
+    replayed = _replay_stale(db, method, uid)
+    if uid is not None:
+        replayed += _replay_range(db, method, uid, uid + 1)
+        db.commit()
+        return replayed
+
+    trade = models.Transaction
+    started = time.perf_counter()
+    high = db.execute(select(func.max(trade.tid))).scalar()
+    if high is None:
+        db.commit()
+        return replayed
+    watermark = db.get(models.LotWatermark, method)
+    if watermark is None:
+        replayed += _stream_users(db, method, high)
+        db.add(models.LotWatermark(method=method, last_tid=high))
+        db.commit()
+    else:
+        db.commit()
+        while watermark.last_tid < high:
+            upto = min(high, watermark.last_tid + TIDS_PER_BATCH)
+            rows = db.connection().execute(
+                select(*_trade_columns()).where(
+                    trade.success == True, trade.tid > watermark.last_tid, trade.tid <= upto
+                ).order_by(trade.uid, trade.cid, trade.time_transaction, trade.tid)
+            ).all()
+            replayed += _apply_new(db, method, rows)
+            watermark.last_tid = upto
+            db.commit()
+    if replayed:
+        elapsed = time.perf_counter() - started
+        logger.info(f"Lot snapshots ({method}): replayed {replayed} trades in {elapsed:.1f}s ({replayed / elapsed:,.0f}/s)")
+    return replayed
+
+
+def rebuild(db: Session, method: str = LOT_METHOD):
+    """
+    Drop the method's snapshots and replay the whole ledger.
+    """
+    _check_method(method)
+    db.execute(delete(models.LotSnapshot).where(models.LotSnapshot.method == method))
+    db.execute(delete(models.LotWatermark).where(models.LotWatermark.method == method))
+    db.commit()
+    return catch_up(db, method)
+
+
+def invalidate(db: Session, keys, method: str = None):
+    """
+    Mark the snapshots of (uid, cid) positions stale after inserting back-dated trades for them;
+    the next catch_up replays them from the ledger. Does not commit.
+    """
+    keys = list(keys)
+    for i in range(0, len(keys), CHUNK_SIZE):
+        query = update(models.LotSnapshot).where(
+            queries.uid_cid_in(models.LotSnapshot.uid, models.LotSnapshot.cid, keys[i:i + CHUNK_SIZE])
+        ).values(stale=True)
+        if method is not None:
+            query = query.where(models.LotSnapshot.method == method)
+        db.execute(query)
+
+
+def record_transaction(db: Session, transaction: models.Transaction, method: str = LOT_METHOD):
+    """
+    Apply one new, flushed transaction to its position's snapshot. Does not commit.
+
+    A back-dated trade can't be applied on top of a snapshot that covers later trades: the
+    maintained method replays the position from the ledger, other methods' snapshots are
+    marked stale for their next catch_up.
+    """
+    if not transaction.success:
+        return
+    time_transaction = naive_utc(transaction.time_transaction)
+    snapshots = db.execute(
+        select(models.LotSnapshot).where(
+            models.LotSnapshot.uid == transaction.uid, models.LotSnapshot.cid == transaction.cid
+        )
+    ).scalars().all()
+    current = None
+    for snapshot in snapshots:
+        if snapshot.stale or (naive_utc(snapshot.last_time), snapshot.last_tid) > (time_transaction, transaction.tid):
+            snapshot.stale = True
+        elif snapshot.method == method:
+            current = snapshot
+    if current is None:
+        # First trade of the position, or back-dated
+        db.flush()
+        _replay_positions(db, method, [(transaction.uid, transaction.cid)])
+        return
+    book = _from_snapshot(current)
+    book.apply(transaction.position or 0.0, transaction.ex_rate or 0.0, time_transaction, transaction.tid)
+    for name, value in book.as_row(transaction.uid, transaction.cid, datetime.now(timezone.utc)).items():
+        setattr(current, name, value)
+
+
+def positions(db: Session, uid: int, method: str = LOT_METHOD):
+    """
+    Up to date lot snapshots of one user, as row dicts of the LotPositionOut columns.
+    """
+    catch_up(db, _check_method(method), uid=uid)
+    table = models.LotSnapshot.__table__
+    return serialization.rows(db.execute(
+        select(*(table.c[name] for name in schemas.LotPositionOut.model_fields))
+        .where(table.c.uid == uid, table.c.method == method)
+        .order_by(table.c.cid)
+    ))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Lot snapshots over the transaction ledger")
+    parser.add_argument("command", choices=["rebuild", "catch-up"])
+    parser.add_argument("--method", choices=METHODS, default=LOT_METHOD)
+    args = parser.parse_args()
+
+    from .database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        if args.command == "rebuild":
+            rebuild(db, args.method)
+        else:
+            catch_up(db, args.method)
+    finally:
+        db.close()
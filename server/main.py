@@ -1,34 +1,92 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, WebSocket, status
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from sqlalchemy.orm import Session
-from server import crud, schemas, auth, database
+from fastapi.concurrency import run_in_threadpool
+from server import crud, schemas, auth, database, hashing, ingest, listing, lots, market_cache, market_client, metrics, notifications, portfolio, price_stream, prices, profiling, replicas, scheduler, serialization, timeseries, transaction_import
 from fastapi.security import OAuth2PasswordRequestForm
 from .database import get_db
-import requests
-from datetime import timedelta
-from tenacity import retry, stop_after_attempt, wait_exponential
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    scheduler_task = None
+    if scheduler.SCHEDULER_IN_APP:
+        # 每个 worker 都启动调度器，每个任务只在拿到其文件锁的 worker 上运行
+        scheduler_task = asyncio.create_task(scheduler.run())
+    # 接收其他进程广播的价格 tick
+    await price_stream.bus.start()
+    # 只读副本的心跳与延迟检测
+    replica_task = asyncio.create_task(replicas.monitor()) if replicas.replicas else None
+    yield
+    price_stream.bus.close()
+    # 写出队列中尚未落库的消息
+    await asyncio.to_thread(notifications.outbox.close)
+    hashing.shutdown()
+    if scheduler_task is not None:
+        scheduler_task.cancel()
+        await asyncio.gather(scheduler_task, return_exceptions=True)
+    if replica_task is not None:
+        replica_task.cancel()
+        replicas.dispose()
+    # 关闭上游连接池
+    await market_client.client.aclose()
+    if database.async_engine is not None:
+        await database.async_engine.dispose()
 
 # Instantiate FastAPI
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+if replicas.replicas:
+    @app.middleware("http")
+    async def read_your_writes(request: Request, call_next):
+        # 写过数据库的客户端在一段时间内从主库读取
+        response = await call_next(request)
+        replicas.stick(request, response)
+        return response
+
+# 抽样或管理员请求的性能剖析，见 /debug/profiles
+profiling.install(app)
+# 每个请求的耗时与数据库语句数，见 /metrics
+metrics.install(app)
+
+
+@app.exception_handler(hashing.Overloaded)
+async def hashing_overloaded(request: Request, exc: hashing.Overloaded):
+    # 登录/注册过多时直接拒绝，避免拖慢其他接口
+    return JSONResponse(status_code=503, content={"detail": "Too many logins, retry shortly"},
+                        headers={"Retry-After": str(hashing.HASH_RETRY_AFTER)})
+
+@app.exception_handler(price_stream.Overloaded)
+async def price_stream_overloaded(request: Request, exc: price_stream.Overloaded):
+    # 推送连接数已达上限
+    return JSONResponse(status_code=503, content={"detail": "Too many price subscribers, retry later"},
+                        headers={"Retry-After": "5"})
 
 # User Registration Route
 @app.post("/users/", response_model=schemas.UserOut)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     """
-    Register a new user.
+    Register a new user. The password is hashed in the hashing pool.
     """
     # Check if user is already registered
-    db_user = crud.get_user_by_email(db, email=user.email)
+    db_user = await run_in_threadpool(crud.get_user_by_email, db, user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     # Create new user if not already registered
-    return crud.create_user(db=db, user=user)
+    hashed_password = await hashing.hash_password(user.password)
+    return await run_in_threadpool(crud.create_user, db, user, hashed_password)
 
 @app.post("/token", response_model=schemas.Token)
-def login_for_access_token(db: Session = Depends(database.get_db), form_data: OAuth2PasswordRequestForm = Depends()):
+async def login_for_access_token(db: Session = Depends(database.get_db), form_data: OAuth2PasswordRequestForm = Depends()):
     """
-    Authenticate the user and return an access token.
+    Authenticate the user and return an access token. The password is verified in the hashing pool.
     """
-    user = auth.authenticate_user(db, form_data.username, form_data.password)
+    user = await auth.authenticate_user_async(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -37,7 +95,7 @@ def login_for_access_token(db: Session = Depends(database.get_db), form_data: OA
         )
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data={"sub": user.email, "uid": user.uid, "role": user.role}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -55,6 +113,28 @@ def read_admin_data(current_user: schemas.UserOut = Depends(auth.get_current_adm
     """
     return current_user
 
+@app.patch("/users/{uid}", response_model=schemas.UserOut)
+def update_user(uid: int, user: schemas.UserUpdate, db: Session = Depends(get_db),
+                current_user: schemas.UserOut = Depends(auth.get_current_admin_user)):
+    """
+    Change a user's email, username or role (admin only).
+    """
+    db_user = crud.update_user(db, uid=uid, user=user)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return db_user
+
+@app.post("/users/{uid}/deactivate", response_model=schemas.UserOut)
+def deactivate_user(uid: int, db: Session = Depends(get_db),
+                    current_user: schemas.UserOut = Depends(auth.get_current_admin_user)):
+    """
+    Deactivate a user (admin only).
+    """
+    db_user = crud.deactivate_user(db, uid=uid)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return db_user
+
 # @app.get("/crypto/{coin_id}")
 # def get_crypto_price(coin_id: str, db: Session = Depends(get_db)):
 #     """
@@ -72,61 +152,206 @@ def read_admin_data(current_user: schemas.UserOut = Depends(auth.get_current_adm
 
 
 
-from requests.exceptions import Timeout, RequestException
+import logging
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
-def fetch_crypto_data(coin_id: str):
-    """
-    从 CoinGecko API 获取加密货币数据，带有重试机制和错误处理。
-    """
-    url = f"https://api.coingecko.com/api/v3/coins/{coin_id}"
-    try:
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()  # 如果返回错误的 HTTP 状态码则抛出异常
-        return response.json()
-    except Timeout:
-        raise HTTPException(
-            status_code=504,
-            detail=f"Request to CoinGecko timed out for coin_id: {coin_id}",
-        )
-    except RequestException as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to fetch data from CoinGecko for coin_id {coin_id}: {str(e)}",
-        )
+# 初始化日志器；逐请求的日志为 debug 级别，LOG_LEVEL=DEBUG 时输出
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
 
+async def get_crypto_prices(coin_ids: list):
+    # 去重并保持请求顺序
+    coin_ids = list(dict.fromkeys(c.strip() for c in coin_ids if c.strip()))
+    if not coin_ids:
+        raise HTTPException(status_code=400, detail="No coin ids given")
+    found = await market_cache.cache.get_many(coin_ids, prices.fetch_price_infos)
+    return [found[coin_id] for coin_id in coin_ids if coin_id in found]
 
-import logging
+@app.get("/crypto")
+async def get_crypto_price_batch(ids: str = Query(..., description="Comma-separated coin ids")):
+    """
+    批量获取多个加密货币的价格信息，上游只调用一次 /coins/markets（按页大小分块并发）。
+    """
+    return await get_crypto_prices(ids.split(","))
 
-# 初始化日志器
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+@app.post("/crypto")
+async def post_crypto_price_batch(request: schemas.CryptoBatchRequest):
+    """
+    与 GET /crypto 相同，用请求体传递较长的 id 列表。
+    """
+    return await get_crypto_prices(request.ids)
 
 @app.get("/crypto/{coin_id}")
-def get_crypto_price(coin_id: str, db: Session = Depends(get_db)):
+async def get_crypto_price(coin_id: str, db: Session = Depends(replicas.get_read_db)):
     """
     获取指定加密货币的详细价格信息，包括当前价格、市值、市值排名、24小时交易量等。
+    优先返回后台采集写入数据库的最新价格；没有足够新的记录时经 market_cache 访问上游。
     """
-    logger.info(f"Fetching data for coin_id: {coin_id}")
+    price = await run_in_threadpool(crud.get_latest_price, db, coin_id)
+    if price is not None and prices.is_fresh(price):
+        return prices.price_info_from_db(price)
+    return await market_cache.cache.get(coin_id, lambda: prices.fetch_price_info(coin_id))
+
+@app.websocket("/ws/prices")
+async def ws_prices(websocket: WebSocket, ids: Optional[str] = None):
+    """
+    实时价格推送：订阅 ids 中的币种，之后只推送价格有变化的币种。
+    Send {"subscribe": [...]} / {"unsubscribe": [...]} to change the coins. See server/price_stream.py.
+    """
+    await price_stream.serve_websocket(websocket, ids)
+
+@app.get("/sse/prices")
+async def sse_prices(ids: str = Query(..., description="Comma-separated coin ids")):
+    """
+    The /ws/prices stream as Server-Sent Events, for clients without WebSockets.
+    """
+    coins = price_stream.parse_ids(ids)
     try:
-        data = fetch_crypto_data(coin_id)
-        logger.info(f"Successfully fetched data for coin_id: {coin_id}")
-    except HTTPException as e:
-        logger.error(f"Error fetching data for coin_id {coin_id}: {e.detail}")
-        raise
-    market_data = data.get("market_data", {})
-    price_info = {
+        price_stream.admit(coins)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(price_stream.sse(coins), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/crypto/{coin_id}/history")
+def get_crypto_history(coin_id: str, interval: str = "1h", start: Optional[datetime] = None,
+                       end: Optional[datetime] = None, db: Session = Depends(replicas.get_read_db)):
+    """
+    OHLCV 历史K线。自动选择能整除 interval 的最粗粒度汇总表（1m/5m/1h/1d），默认最近 24 小时。
+    """
+    try:
+        seconds = timeseries.parse_interval(interval)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Naive UTC throughout, as stored; bounds given without an offset are taken as UTC
+    end = timeseries.naive_utc(end or datetime.now(timezone.utc))
+    start = timeseries.naive_utc(start) if start else end - timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    return serialization.response("history", {
         "coin_id": coin_id,
-        "current_price": market_data.get("current_price", {}).get("usd"),
-        "market_cap": market_data.get("market_cap", {}).get("usd"),
-        "market_cap_rank": data.get("market_cap_rank"),
-        "total_volume": market_data.get("total_volume", {}).get("usd"),
-        "high_24h": market_data.get("high_24h", {}).get("usd"),
-        "low_24h": market_data.get("low_24h", {}).get("usd"),
+        "interval": interval,
+        "source": timeseries.pick_level(seconds),
+        "candles": timeseries.history(db, coin_id, seconds, start, end),
+    })
+
+@app.get("/ingest/stats")
+def get_ingest_stats():
+    """
+    Rows/sec and ingest lag of the background price ingestion in this worker.
+    """
+    return ingest.stats
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    """
+    Hit/miss/coalesce counters of the market-data cache and upstream client for this worker.
+    """
+    return {
+        "cache": market_cache.cache.stats(),
+        "upstream": dict(market_client.client.stats, breaker=market_client.client.breaker.state),
     }
-    return price_info
 
+@app.get("/stream/stats")
+def get_stream_stats():
+    """
+    Subscribers, ticks and drop-to-latest counters of the price push channel in this worker.
+    """
+    return dict(price_stream.stats, coins=len(price_stream.broker.subscriptions))
+
+@app.get("/scheduler/stats")
+def get_scheduler_stats():
+    """
+    Runs, failures, coalesced runs, run time and lag histograms of the periodic jobs; `leader` marks the ones running in this worker.
+    """
+    return scheduler.status()
+
+@app.get("/notifications/stats")
+def get_notification_stats():
+    """
+    Queued, written and dropped counters of the message outbox in this worker.
+    """
+    return notifications.stats
 
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """
+    Prometheus metrics, of all workers with PROMETHEUS_MULTIPROC_DIR set. See server/metrics.py.
+    """
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
+
+@app.get("/debug/profiles")
+def list_profiles(current_user: schemas.UserOut = Depends(auth.get_current_admin_user)):
+    """
+    The last profiled requests of this worker, newest first (admin only). See server/profiling.py.
+    """
+    return {
+        "pid": os.getpid(),
+        "sample_rate": profiling.PROFILE_SAMPLE_RATE,
+        "stats": profiling.stats,
+        "profiles": [profile.summary() for profile in reversed(profiling.profiles)],
+    }
+
+@app.get("/debug/profiles/{profile_id}")
+def get_profile(profile_id: str, format: str = Query("json", description="json or collapsed"),
+                current_user: schemas.UserOut = Depends(auth.get_current_admin_user)):
+    """
+    Stack samples and SQL statements of a profiled request (admin only); format=collapsed for flame graph tools.
+    """
+    profile = profiling.get(profile_id)
+    if profile is None:
+        pid = profile_id.split("-", 1)[0]
+        detail = "Profile not found" if pid == str(os.getpid()) else f"Profile not found, it was taken by worker {pid}"
+        raise HTTPException(status_code=404, detail=detail)
+    if format == "collapsed":
+        return Response(profile.collapsed(), media_type="text/plain")
+    return profile.report()
+
+@app.get("/debug/slow-queries")
+def list_slow_queries(current_user: schemas.UserOut = Depends(auth.get_current_admin_user)):
+    """
+    Statements over SLOW_QUERY_MS in this worker, newest first, with their plans (admin only).
+    """
+    return {"pid": os.getpid(), "threshold_ms": profiling.SLOW_QUERY_MS, "queries": list(reversed(profiling.slow_queries))}
+
+@app.get("/db/stats")
+def get_db_stats():
+    """
+    Connection pool size and checkout counters of this worker.
+    """
+    stats = database.pool_stats()
+    if replicas.replicas:
+        stats["replicas"] = replicas.status()
+    return stats
+
+
+def list_for_user(request: Request, db: Session, name: str, uid: int,
+                  after: Optional[str], limit: int, format: Optional[str], not_found: str):
+    """
+    One keyset page of a per-user listing with the next page in the Link header,
+    or with format=ndjson the whole listing streamed. See server/listing.py.
+    """
+    fmt = format or listing.format_for(request.headers.get("accept"))
+    if fmt not in listing.FORMATS:
+        raise HTTPException(status_code=400, detail="format must be json or ndjson")
+    if after is None and not listing.exists(db, name, uid):
+        raise HTTPException(status_code=404, detail=not_found)
+    try:
+        if fmt == "ndjson":
+            return StreamingResponse(listing.stream(name, uid, after, bind=db.get_bind()), media_type=listing.NDJSON)
+        rows, next_after = listing.page(db, name, uid, after, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = None
+    if next_after is not None:
+        headers = {"Link": f'<{request.url.include_query_params(after=next_after)}>; rel="next"'}
+    _, _, schema = listing.LISTINGS[name]
+    return serialization.response(name, rows, schema, headers=headers)
+
+PAGE_LIMIT = Query(listing.PAGE_SIZE, ge=1, le=listing.MAX_PAGE_SIZE)
+LIST_FORMAT = Query(None, description="json or ndjson, default from Accept")
 
 # ---- Portfolio Routes ----
 
@@ -140,36 +365,69 @@ def add_to_portfolio(portfolio: schemas.PortfolioCreate, db: Session = Depends(g
         raise HTTPException(status_code=400, detail="Cryptocurrency already in portfolio")
     return crud.create_portfolio_entry(db=db, portfolio=portfolio)
 
-@app.get("/portfolio/{uid}")
-def get_user_portfolio(uid: int, db: Session = Depends(get_db)):
+@app.get("/portfolio/{uid}", response_model=List[schemas.PortfolioOut])
+def get_user_portfolio(uid: int, request: Request, after: Optional[str] = None,
+                       limit: int = PAGE_LIMIT, format: Optional[str] = LIST_FORMAT, db: Session = Depends(replicas.get_read_db)):
+    """
+    Retrieve the portfolio for a user, by coin, a page at a time.
+    """
+    return list_for_user(request, db, "portfolio", uid, after, limit, format, "Portfolio not found")
+
+@app.get("/portfolio/{uid}/value")
+def get_user_portfolio_value(uid: int, db: Session = Depends(replicas.get_read_db)):
+    """
+    Market value of a user's portfolio at the latest stored prices.
+    """
+    return {"uid": uid, "value": crud.get_portfolio_value(db, uid=uid)}
+
+@app.get("/portfolio/{uid}/summary", response_model=schemas.PortfolioSummary)
+def get_user_portfolio_summary(uid: int, db: Session = Depends(replicas.get_read_db)):
     """
-    Retrieve the portfolio for a user.
+    Market value, cost basis, realized/unrealized P&L, allocation weights and 24h change of a user's portfolio.
     """
-    portfolio = crud.get_portfolio_by_uid(db, uid=uid)
-    if not portfolio:
+    summary = portfolio.summarize(db, uid=uid)
+    if summary is None:
         raise HTTPException(status_code=404, detail="Portfolio not found")
-    return portfolio
+    return summary
+
+@app.get("/portfolio/{uid}/lots", response_model=List[schemas.LotPositionOut])
+def get_user_lots(uid: int, method: str = Query(lots.LOT_METHOD, description="fifo, lifo or average"), db: Session = Depends(get_db)):
+    """
+    Open lots, cost basis and realized P&L per coin, replaying only trades newer than the stored snapshots.
+    """
+    if method not in lots.METHODS:
+        raise HTTPException(status_code=400, detail=f"Unknown lot method {method}")
+    return serialization.response("lots", lots.positions(db, uid=uid, method=method), schemas.LotPositionOut)
 
 # ---- Price Alert Routes ----
 
-#TODO: Fix the following routes
+@app.post("/alerts/", response_model=schemas.AlertOut)
+def create_price_alert(alert: schemas.AlertCreate, db: Session = Depends(get_db)):
+    """
+    Create a new price alert for a user. It fires when the price gets within threshold_percentage
+    (default 10%) of price_target, evaluated by the scheduler's alert jobs.
+    """
+    db_alert = crud.create_alert_subscription(db=db, alert=alert)
+    return crud.get_alert(db, db_alert.asid)
 
-# @app.post("/alerts/", response_model=schemas.AlertOut)
-# def create_price_alert(alert: schemas.AlertCreate, db: Session = Depends(get_db)):
-#     """
-#     Create a new price alert for a user.
-#     """
-#     return crud.create_alert_subscription(db=db, alert=alert)
+@app.get("/alerts/{uid}", response_model=List[schemas.AlertOut])
+def get_user_alerts(uid: int, db: Session = Depends(replicas.get_read_db)):
+    """
+    Retrieve all alerts for a specific user.
+    """
+    alerts = crud.get_alerts_by_uid(db, uid=uid)
+    if not alerts:
+        raise HTTPException(status_code=404, detail="No alerts found for this user")
+    return alerts
 
-# @app.get("/alerts/{uid}")
-# def get_user_alerts(uid: int, db: Session = Depends(get_db)):
-#     """
-#     Retrieve all alerts for a specific user.
-#     """
-#     alerts = crud.get_alerts_by_uid(db, uid=uid)
-#     if not alerts:
-#         raise HTTPException(status_code=404, detail="No alerts found for this user")
-#     return alerts
+@app.delete("/alerts/{asid}", response_model=schemas.AlertOut)
+def deactivate_price_alert(asid: int, db: Session = Depends(get_db)):
+    """
+    Deactivate a price alert; it stays listed, inactive.
+    """
+    if crud.deactivate_alert(db, asid=asid) is None:
+        raise HTTPException(status_code=404, detail="Alert not found")
+    return crud.get_alert(db, asid)
 
 # ---- Wallet Routes ----
 
@@ -180,15 +438,13 @@ def add_wallet(wallet: schemas.WalletCreate, db: Session = Depends(get_db)):
     """
     return crud.create_wallet(db=db, wallet=wallet)
 
-@app.get("/wallet/{uid}")
-def get_user_wallets(uid: int, db: Session = Depends(get_db)):
+@app.get("/wallet/{uid}", response_model=List[schemas.WalletOut])
+def get_user_wallets(uid: int, request: Request, after: Optional[str] = None,
+                     limit: int = PAGE_LIMIT, format: Optional[str] = LIST_FORMAT, db: Session = Depends(replicas.get_read_db)):
     """
-    Retrieve all wallets for a specific user.
+    Retrieve the wallets of a user, a page at a time.
     """
-    wallets = crud.get_wallets_by_uid(db, uid=uid)
-    if not wallets:
-        raise HTTPException(status_code=404, detail="No wallets found for this user")
-    return wallets
+    return list_for_user(request, db, "wallet", uid, after, limit, format, "No wallets found for this user")
 
 # ---- Transaction Routes ----
 
@@ -200,12 +456,86 @@ def create_transaction(transaction: schemas.TransactionCreate, db: Session = Dep
     """
     return crud.create_transaction(db=db, transaction=transaction)
 
-@app.get("/transaction/{uid}")
-def get_user_transactions(uid: int, db: Session = Depends(get_db)):
+@app.post("/transaction/import")
+async def import_transactions(request: Request, format: Optional[str] = Query(None, description="csv or ndjson, default from Content-Type"),
+                              import_id: Optional[str] = None, skip: int = 0, db: Session = Depends(get_db)):
+    """
+    Bulk-import transactions from a streamed CSV (header row of TransactionCreate fields) or NDJSON body.
+    Rows are validated, inserted and committed chunk by chunk; portfolio balances are updated once per coin and user and chunk.
+    Returns the import report, GET /transaction/import/{import_id} shows it while the upload is running.
+    """
+    fmt = format or transaction_import.format_for(request.headers.get("content-type"))
+    if fmt not in transaction_import.FORMATS:
+        raise HTTPException(status_code=415, detail="Send text/csv or application/x-ndjson, or pass format=csv|ndjson")
+    running = transaction_import.imports.get(import_id)
+    if running and running["status"] == "running":
+        raise HTTPException(status_code=409, detail=f"Import {import_id} is already running")
+    # Commit every chunk: no transaction stays open while waiting on the upload
+    job = transaction_import.TransactionImport(db, fmt, import_id, skip, commit_rows=1)
+    try:
+        async for lines in transaction_import.line_chunks(request.stream()):
+            await run_in_threadpool(job.feed, lines)
+        return await run_in_threadpool(job.finish)
+    except ValueError as e:
+        await run_in_threadpool(job.fail, e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        await run_in_threadpool(job.fail, e)
+        raise
+
+@app.get("/transaction/import/{import_id}")
+def get_import_progress(import_id: str):
+    """
+    Progress of a running or recent import on this worker.
+    """
+    progress = transaction_import.imports.get(import_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return progress
+
+@app.get("/transaction/{uid}", response_model=List[schemas.TransactionOut])
+def get_user_transactions(uid: int, request: Request, after: Optional[str] = None,
+                          limit: int = PAGE_LIMIT, format: Optional[str] = LIST_FORMAT, db: Session = Depends(replicas.get_read_db)):
+    """
+    Retrieve the transactions of a user, oldest first, a page at a time; format=ndjson streams the full history.
+    """
+    return list_for_user(request, db, "transaction", uid, after, limit, format, "No transactions found for this user")
+
+# ---- Message Routes ----
+
+@app.get("/messages", response_model=List[schemas.MessageOut])
+def get_messages(request: Request, after: Optional[str] = None,
+                 limit: int = Query(notifications.INBOX_PAGE_SIZE, ge=1, le=listing.MAX_PAGE_SIZE), unread: bool = False,
+                 db: Session = Depends(replicas.get_read_db), current_user: schemas.UserOut = Depends(auth.get_current_user)):
+    """
+    The current user's messages, newest first, a page at a time; unread=true for the unread ones only.
+    """
+    try:
+        rows, next_after = notifications.inbox(db, current_user.uid, after, limit, unread)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = None
+    if next_after is not None:
+        headers = {"Link": f'<{request.url.include_query_params(after=next_after)}>; rel="next"'}
+    return serialization.response("message", rows, schemas.MessageOut, headers=headers)
+
+@app.get("/messages/unread")
+def get_unread_count(db: Session = Depends(replicas.get_read_db), current_user: schemas.UserOut = Depends(auth.get_current_user)):
     """
-    Retrieve all transactions for a user.
+    Number of unread messages of the current user, from its counter.
     """
-    transactions = crud.get_transactions_by_uid(db, uid=uid)
-    if not transactions:
-        raise HTTPException(status_code=404, detail="No transactions found for this user")
-    return transactions
+    return {"uid": current_user.uid, "unread": notifications.unread_count(db, current_user.uid)}
+
+@app.post("/messages/read")
+def mark_messages_read(request: schemas.MessagesRead, db: Session = Depends(get_db),
+                       current_user: schemas.UserOut = Depends(auth.get_current_user)):
+    """
+    Mark the current user's messages read: the given mids, every message up to up_to, or the whole inbox.
+    """
+    marked = notifications.mark_read(db, current_user.uid, mids=request.mids, up_to=request.up_to)
+    return {"marked": marked, "unread": notifications.unread_count(db, current_user.uid)}
+
+if database.DB_ASYNC:
+    # 热点路由换成 AsyncSession 上的异步版本，其余路由仍走同步引擎
+    from . import async_routes
+    async_routes.install(app)
@@ -0,0 +1,384 @@
+# server/market_cache.py
+"""
+Market-data cache in front of the CoinGecko integration.
+
+Two tiers: a per-process LRU and a SQLite file shared by every gunicorn worker on the host.
+An entry is fresh for its coin's TTL, then served stale (while a background refresh runs)
+until MARKET_CACHE_STALE_TTL. Concurrent misses for a coin are coalesced into a single
+upstream fetch: in-process through a shared asyncio future, across workers through a
+lease row in the shared file.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from . import metrics
+from .utils import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Empty path disables the shared tier (per-process cache only)
+CACHE_PATH = os.getenv("MARKET_CACHE_PATH", os.path.join(os.path.dirname(__file__), "market_cache.db"))
+DEFAULT_TTL = float(os.getenv("MARKET_CACHE_TTL", "30"))
+STALE_TTL = float(os.getenv("MARKET_CACHE_STALE_TTL", "300"))
+MAX_ENTRIES = int(os.getenv("MARKET_CACHE_MAX_ENTRIES", "1000"))
+LEASE_SECONDS = float(os.getenv("MARKET_CACHE_LEASE_SECONDS", "10"))
+
+
+def parse_coin_ttls(spec: str):
+    """
+    Parse per-coin TTL overrides, e.g. "bitcoin=10,ethereum=15".
+    """
+    ttls = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        coin_id, _, ttl = item.partition("=")
+        ttls[coin_id.strip()] = float(ttl)
+    return ttls
+
+
+COIN_TTLS = parse_coin_ttls(os.getenv("MARKET_CACHE_COIN_TTLS", ""))
+
+
+class SharedStore:
+    """
+    SQLite-backed tier shared across worker processes, LRU-evicted by last access.
+    """
+
+    def __init__(self, path: str, max_entries: int = MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS market_cache ("
+            " key TEXT PRIMARY KEY,"
+            " payload TEXT,"
+            " fetched_at REAL,"
+            " last_access REAL,"
+            " lease_until REAL DEFAULT 0)"
+        )
+        self._conn().execute(
+            "CREATE INDEX IF NOT EXISTS idx_market_cache_last_access ON market_cache (last_access)"
+        )
+
+    def _conn(self):
+        # sqlite3 connections are not shareable across threads, keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str):
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT payload, fetched_at FROM market_cache WHERE key = ? AND payload IS NOT NULL",
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE market_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0]), row[1]
+
+    def get_many(self, keys: list):
+        if not keys:
+            return {}
+        conn = self._conn()
+        placeholders = ",".join("?" * len(keys))
+        rows = conn.execute(
+            f"SELECT key, payload, fetched_at FROM market_cache"
+            f" WHERE key IN ({placeholders}) AND payload IS NOT NULL",
+            keys,
+        ).fetchall()
+        if rows:
+            conn.execute(
+                f"UPDATE market_cache SET last_access = ? WHERE key IN ({placeholders})",
+                [time.time(), *keys],
+            )
+        return {key: (json.loads(payload), fetched_at) for key, payload, fetched_at in rows}
+
+    def put(self, key: str, value, fetched_at: float):
+        self.put_many({key: value}, fetched_at)
+
+    def put_many(self, values: dict, fetched_at: float):
+        conn = self._conn()
+        conn.executemany(
+            "INSERT INTO market_cache (key, payload, fetched_at, last_access, lease_until)"
+            " VALUES (?, ?, ?, ?, 0)"
+            " ON CONFLICT(key) DO UPDATE SET payload = excluded.payload,"
+            " fetched_at = excluded.fetched_at, last_access = excluded.last_access, lease_until = 0",
+            [(key, json.dumps(value), fetched_at, fetched_at) for key, value in values.items()],
+        )
+        overflow = conn.execute("SELECT COUNT(*) FROM market_cache").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM market_cache WHERE key IN"
+                " (SELECT key FROM market_cache ORDER BY last_access LIMIT ?)",
+                (overflow,),
+            )
+
+    def acquire_lease(self, key: str, seconds: float):
+        """
+        Try to become the single worker fetching `key`. Returns False if another worker holds the lease.
+        """
+        now = time.time()
+        cursor = self._conn().execute(
+            "INSERT INTO market_cache (key, last_access, lease_until) VALUES (?, ?, ?)"
+            " ON CONFLICT(key) DO UPDATE SET lease_until = excluded.lease_until"
+            " WHERE market_cache.lease_until < ?",
+            (key, now, now + seconds, now),
+        )
+        return cursor.rowcount > 0
+
+    def release_lease(self, key: str):
+        self._conn().execute("UPDATE market_cache SET lease_until = 0 WHERE key = ?", (key,))
+
+
+class MarketDataCache:
+    """
+    TTL + stale-while-revalidate cache with request coalescing.
+    `await get(key, fetch)` returns the cached value or awaits `fetch()` at most once per key at a time.
+    """
+
+    def __init__(self, shared: SharedStore = None, maxsize: int = MAX_ENTRIES,
+                 default_ttl: float = DEFAULT_TTL, stale_ttl: float = STALE_TTL,
+                 coin_ttls: dict = None, lease_seconds: float = LEASE_SECONDS):
+        self.memory = LRUCache(maxsize)
+        self.shared = shared
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self.coin_ttls = coin_ttls or {}
+        self.lease_seconds = lease_seconds
+        self._inflight = {}
+        self._background = set()
+        self.counters = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "refreshes": 0,
+            "upstream_fetches": 0,
+            "errors": 0,
+        }
+
+    def _count(self, name: str, n: int = 1):
+        self.counters[name] += n
+        metrics.cache_events.labels(name).inc(n)
+
+    def ttl(self, key: str):
+        return self.coin_ttls.get(key, self.default_ttl)
+
+    async def _lookup(self, key: str):
+        entry = self.memory.get(key)
+        if entry is None and self.shared is not None:
+            # SQLite may wait on a writer's lock, keep it off the event loop
+            entry = await asyncio.to_thread(self.shared.get, key)
+            if entry is not None:
+                self.memory.set(key, entry)
+        return entry
+
+    async def get(self, key: str, fetch):
+        entry = await self._lookup(key)
+        if entry is not None:
+            value, fetched_at = entry
+            age = time.time() - fetched_at
+            if age < self.ttl(key):
+                self._count("hits")
+                return value
+            if age < self.stale_ttl:
+                self._count("stale_hits")
+                self._refresh_in_background(key, fetch)
+                return value
+        self._count("misses")
+        return await self._fetch_coalesced(key, fetch)
+
+    async def _fetch_coalesced(self, key: str, fetch):
+        future = self._inflight.get(key)
+        if future is not None:
+            self._count("coalesced")
+            # shield: a cancelled waiter must not cancel the fetch other callers are waiting on
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await self._fetch_shared(key, fetch)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure doesn't log "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _fetch_shared(self, key: str, fetch):
+        if self.shared is None or await asyncio.to_thread(self.shared.acquire_lease, key, self.lease_seconds):
+            try:
+                return await self._fetch_and_store(key, fetch)
+            finally:
+                if self.shared is not None:
+                    await asyncio.to_thread(self.shared.release_lease, key)
+
+        # Another worker is fetching this coin, wait for its result to land in the shared tier
+        deadline = time.time() + self.lease_seconds
+        while time.time() < deadline:
+            await asyncio.sleep(0.05)
+            entry = await asyncio.to_thread(self.shared.get, key)
+            if entry is not None and time.time() - entry[1] < self.ttl(key):
+                self.memory.set(key, entry)
+                self._count("coalesced")
+                return entry[0]
+        return await self._fetch_and_store(key, fetch)
+
+    async def _fetch_and_store(self, key: str, fetch):
+        self._count("upstream_fetches")
+        try:
+            value = await fetch()
+        except Exception:
+            self._count("errors")
+            raise
+        await self.set(key, value)
+        return value
+
+    async def set(self, key: str, value, fetched_at: float = None):
+        await self.set_many({key: value}, fetched_at)
+
+    async def set_many(self, values: dict, fetched_at: float = None):
+        fetched_at = fetched_at or time.time()
+        for key, value in values.items():
+            self.memory.set(key, (value, fetched_at))
+        if self.shared is not None and values:
+            await asyncio.to_thread(self.shared.put_many, values, fetched_at)
+
+    async def get_many(self, keys: list, fetch_many):
+        """
+        Batch variant of `get`. `fetch_many(keys)` returns {key: value} for the keys it could resolve;
+        keys it omits are absent from the result. Misses are fetched with a single `fetch_many` call;
+        misses another batch was already fetching are awaited, and fetched again here if that batch failed.
+        """
+        results = {}
+        entries = {key: self.memory.get(key) for key in keys}
+        cold = [key for key, entry in entries.items() if entry is None]
+        if cold and self.shared is not None:
+            shared_entries = await asyncio.to_thread(self.shared.get_many, cold)
+            for key, entry in shared_entries.items():
+                self.memory.set(key, entry)
+            entries.update(shared_entries)
+
+        now = time.time()
+        missing, stale = [], []
+        for key, entry in entries.items():
+            if entry is None:
+                missing.append(key)
+                continue
+            age = now - entry[1]
+            if age < self.ttl(key):
+                self._count("hits")
+                results[key] = entry[0]
+            elif age < self.stale_ttl:
+                self._count("stale_hits")
+                results[key] = entry[0]
+                stale.append(key)
+            else:
+                missing.append(key)
+        self._count("misses", len(missing))
+        if stale:
+            self._refresh_many_in_background(stale, fetch_many)
+
+        waiting = {key: self._inflight[key] for key in missing if key in self._inflight}
+        self._count("coalesced", len(waiting))
+        to_fetch = [key for key in missing if key not in waiting]
+        if to_fetch:
+            results.update(await self._fetch_batch(to_fetch, fetch_many))
+        failed = []
+        for key, future in waiting.items():
+            try:
+                value = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Our own cancellation propagates; the other batch's doesn't
+                if not future.cancelled():
+                    raise
+                failed.append(key)
+                continue
+            except Exception:
+                failed.append(key)
+                continue
+            if value is not None:
+                results[key] = value
+        if failed:
+            results.update(await self._fetch_batch(failed, fetch_many))
+        return results
+
+    async def _fetch_batch(self, keys: list, fetch_many):
+        loop = asyncio.get_running_loop()
+        futures = {key: loop.create_future() for key in keys}
+        self._inflight.update(futures)
+        self._count("upstream_fetches")
+        try:
+            values = await fetch_many(keys)
+            await self.set_many(values)
+            for key, future in futures.items():
+                future.set_result(values.get(key))
+            return values
+        except BaseException as e:
+            self._count("errors")
+            for future in futures.values():
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(e)
+                    future.exception()
+            raise
+        finally:
+            for key in keys:
+                self._inflight.pop(key, None)
+
+    def _refresh_many_in_background(self, keys: list, fetch_many):
+        keys = [key for key in keys if key not in self._inflight]
+        if not keys:
+            return
+        self._count("refreshes")
+        task = asyncio.get_running_loop().create_task(self._refresh_many(keys, fetch_many))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _refresh_many(self, keys: list, fetch_many):
+        try:
+            await self._fetch_batch(keys, fetch_many)
+        except Exception as e:
+            logger.warning(f"Background refresh failed for {len(keys)} keys: {e}")
+
+    def _refresh_in_background(self, key: str, fetch):
+        if key in self._inflight:
+            return
+        self._count("refreshes")
+        task = asyncio.get_running_loop().create_task(self._refresh(key, fetch))
+        # Hold a reference until done, the loop only keeps weak ones
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _refresh(self, key: str, fetch):
+        try:
+            await self._fetch_coalesced(key, fetch)
+        except Exception as e:
+            logger.warning(f"Background refresh failed for {key}: {e}")
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats["size"] = len(self.memory)
+        return stats
+
+
+cache = MarketDataCache(
+    shared=SharedStore(CACHE_PATH) if CACHE_PATH else None,
+    coin_ttls=COIN_TTLS,
+)
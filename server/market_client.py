@@ -0,0 +1,259 @@
+# server/market_client.py
+"""
+asyncio-native CoinGecko client.
+
+One pooled httpx.AsyncClient per process (keep-alive, HTTP/2 when the `h2` package is
+installed), a semaphore bounding in-flight upstream requests, a per-call deadline that
+covers every retry, and a circuit breaker that fails fast while the upstream is down.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+
+import httpx
+from fastapi import HTTPException
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+COINGECKO_API_URL = os.getenv("COINGECKO_API_URL", "https://api.coingecko.com/api/v3")
+MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "20"))
+MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "10"))
+DEADLINE_SECONDS = float(os.getenv("UPSTREAM_DEADLINE_SECONDS", "8"))
+ATTEMPT_TIMEOUT = float(os.getenv("UPSTREAM_ATTEMPT_TIMEOUT", "5"))
+MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "3"))
+BREAKER_THRESHOLD = int(os.getenv("UPSTREAM_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("UPSTREAM_BREAKER_COOLDOWN", "30"))
+# CoinGecko's /coins/markets returns at most 250 rows per page
+MARKETS_PAGE_SIZE = int(os.getenv("UPSTREAM_MARKETS_PAGE_SIZE", "250"))
+
+try:
+    import h2  # noqa: F401
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures; after `cooldown` seconds a single probe is let through.
+    """
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        """
+        Admit a call: "closed" for a normal call, "half-open" for the probe, None if rejected.
+        Pass the result to release() when the call ends.
+        """
+        state = self.state
+        if state == "closed":
+            return state
+        if state == "half-open" and not self._probing:
+            self._probing = True
+            return state
+        return None
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+    def release(self, admitted: str):
+        """
+        End a call let through by allow(). A probe that ended without an outcome (cancelled, or
+        an unexpected error) frees the slot, so the next call probes instead of being rejected;
+        calls admitted while closed leave a probe in flight alone.
+        """
+        if admitted == "half-open":
+            self._probing = False
+
+
+class MarketClient:
+    def __init__(self, base_url: str = COINGECKO_API_URL, max_connections: int = MAX_CONNECTIONS,
+                 max_concurrency: int = MAX_CONCURRENCY, deadline: float = DEADLINE_SECONDS,
+                 attempt_timeout: float = ATTEMPT_TIMEOUT, max_attempts: int = MAX_ATTEMPTS):
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.max_attempts = max_attempts
+        self.breaker = CircuitBreaker()
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "short_circuited": 0}
+        self._client = None
+        self._semaphore = None
+
+    def _get_client(self):
+        # Created lazily so the pool and semaphore bind to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                http2=HTTP2,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                headers={"Accept": "application/json"},
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get_json(self, path: str, params: dict = None, label: str = None):
+        """
+        GET `path` and decode the JSON body, retrying transient failures within the deadline budget.
+        """
+        label = label or path
+        admitted = self.breaker.allow()
+        if not admitted:
+            self.stats["short_circuited"] += 1
+            metrics.upstream_calls.labels("short_circuited").inc()
+            raise HTTPException(status_code=503, detail=f"CoinGecko circuit open, not fetching {label}")
+        try:
+            return await self._get_json(path, params, label)
+        finally:
+            self.breaker.release(admitted)
+
+    async def _get_json(self, path: str, params: dict, label: str):
+        client = self._get_client()
+        deadline = time.monotonic() + self.deadline
+        last_error = None
+        for attempt in range(self.max_attempts):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if attempt:
+                self.stats["retries"] += 1
+                metrics.upstream_retries.inc()
+                # Full-jitter exponential backoff, never sleeping past the deadline
+                await asyncio.sleep(min(random.uniform(0, 0.25 * 2 ** attempt), remaining / 2))
+                remaining = deadline - time.monotonic()
+            try:
+                async with self._semaphore:
+                    self.stats["requests"] += 1
+                    started = time.perf_counter()
+                    response = await client.get(path, params=params, timeout=min(self.attempt_timeout, remaining))
+            except httpx.TimeoutException as e:
+                metrics.upstream_attempts.labels("timeout").observe(time.perf_counter() - started)
+                last_error = e
+                continue
+            except httpx.TransportError as e:
+                metrics.upstream_attempts.labels("transport_error").observe(time.perf_counter() - started)
+                last_error = e
+                continue
+            metrics.upstream_attempts.labels(str(response.status_code)).observe(time.perf_counter() - started)
+            if response.status_code in RETRYABLE_STATUS:
+                last_error = httpx.HTTPStatusError(
+                    f"upstream returned {response.status_code}", request=response.request, response=response
+                )
+                continue
+            if response.status_code == 404:
+                self.breaker.record_success()
+                metrics.upstream_calls.labels("not_found").inc()
+                raise HTTPException(status_code=404, detail=f"Coin not found: {label}")
+            if response.status_code >= 400:
+                self.breaker.record_failure()
+                self.stats["failures"] += 1
+                metrics.upstream_calls.labels("failed").inc()
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Failed to fetch data from CoinGecko for {label}: HTTP {response.status_code}",
+                )
+            try:
+                data = response.json()
+            except ValueError:
+                self.breaker.record_failure()
+                self.stats["failures"] += 1
+                metrics.upstream_calls.labels("failed").inc()
+                raise HTTPException(status_code=500, detail=f"CoinGecko sent invalid JSON for {label}")
+            self.breaker.record_success()
+            metrics.upstream_calls.labels("ok").inc()
+            return data
+
+        self.breaker.record_failure()
+        self.stats["failures"] += 1
+        metrics.upstream_calls.labels("failed").inc()
+        if last_error is None or isinstance(last_error, httpx.TimeoutException):
+            raise HTTPException(status_code=504, detail=f"Request to CoinGecko timed out for {label}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to fetch data from CoinGecko for {label}: {last_error}",
+        )
+
+    async def get_markets(self, coin_ids: list, vs_currency: str = "usd"):
+        """
+        Resolve many coins through /coins/markets, one page-sized chunk per request, chunks fetched concurrently.
+        """
+        chunks = [coin_ids[i:i + MARKETS_PAGE_SIZE] for i in range(0, len(coin_ids), MARKETS_PAGE_SIZE)]
+        pages = await asyncio.gather(*(
+            self.get_json(
+                "/coins/markets",
+                params={"vs_currency": vs_currency, "ids": ",".join(chunk), "per_page": len(chunk), "page": 1},
+                label=f"{len(chunk)} coins",
+            )
+            for chunk in chunks
+        ))
+        return [row for page in pages for row in page]
+
+
+def extract_price_info(coin_id: str, data: dict):
+    """
+    从 CoinGecko 的 /coins/{id} 文档中提取价格信息。
+    """
+    market_data = data.get("market_data", {})
+    return {
+        "coin_id": coin_id,
+        "current_price": market_data.get("current_price", {}).get("usd"),
+        "market_cap": market_data.get("market_cap", {}).get("usd"),
+        "market_cap_rank": data.get("market_cap_rank"),
+        "total_volume": market_data.get("total_volume", {}).get("usd"),
+        "high_24h": market_data.get("high_24h", {}).get("usd"),
+        "low_24h": market_data.get("low_24h", {}).get("usd"),
+    }
+
+
+def extract_market_price_info(row: dict):
+    """
+    从 /coins/markets 的一行数据中提取与 extract_price_info 相同结构的价格信息。
+    """
+    return {
+        "coin_id": row["id"],
+        "current_price": row.get("current_price"),
+        "market_cap": row.get("market_cap"),
+        "market_cap_rank": row.get("market_cap_rank"),
+        "total_volume": row.get("total_volume"),
+        "high_24h": row.get("high_24h"),
+        "low_24h": row.get("low_24h"),
+    }
+
+
+client = MarketClient()
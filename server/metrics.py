@@ -0,0 +1,203 @@
+# server/metrics.py
+"""
+Prometheus metrics of the API, served at GET /metrics.
+
+  http       http_request_duration_seconds{method,route,status} per route template
+             ("/crypto/{coin_id}"; "unmatched" for paths outside the routes) and
+             http_requests_in_progress. WebSockets are not counted.
+  database   db_query_duration_seconds{engine,operation} of every statement, from cursor events
+             on each engine (primary, async, replica), and per request the number of statements
+             and their total time, http_request_db_queries{route} and http_request_db_seconds{route}.
+             Pool usage: db_pool_checked_out{engine}, db_pool_connections_total{engine}.
+  upstream   upstream_attempt_duration_seconds{outcome} of every request market_client makes to
+             CoinGecko (outcome: the HTTP status, timeout or transport_error),
+             upstream_retries_total and upstream_calls_total{result} of the calls, retries included.
+  cache      market_cache_events_total{event} (hits, stale_hits, misses, coalesced, ...);
+             the hit rate is hits / (hits + stale_hits + misses).
+  scheduler  scheduler_job_duration_seconds{job} and scheduler_job_failures_total{job}.
+
+Across workers. Each gunicorn worker counts in its own memory, and a scrape reaches one of
+them. With PROMETHEUS_MULTIPROC_DIR set in the environment of the server, prometheus_client
+keeps every process's values in files of that directory instead, and /metrics of any worker
+sums them all: counters and histograms of all processes, dead ones included, gauges of the live
+ones. server/gunicorn_conf.py empties the directory when gunicorn starts and drops the gauges
+of workers that exit; other process managers must start on an empty directory.
+
+METRICS_ENABLED=false, or prometheus_client not installed, makes every metric a no-op: no
+middleware, no engine listeners, and /metrics answers 404.
+"""
+import contextvars
+import os
+import time
+
+from sqlalchemy import event
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if PROMETHEUS_MULTIPROC_DIR:
+    # prometheus_client creates its files there as soon as a metric is defined
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true" and prometheus_client is not None
+
+# Seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+OPERATIONS = ("SELECT", "INSERT", "UPDATE", "DELETE")
+
+
+class _Disabled:
+    """
+    Stands in for every metric when metrics are off.
+    """
+
+    def labels(self, *values):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+def _metric(kind, name: str, documentation: str, labels=(), **kwargs):
+    if not METRICS_ENABLED:
+        return _Disabled()
+    return getattr(prometheus_client, kind)(name, documentation, labels, **kwargs)
+
+
+request_duration = _metric("Histogram", "http_request_duration_seconds", "Time to serve a request",
+                           ("method", "route", "status"), buckets=LATENCY_BUCKETS)
+requests_in_progress = _metric("Gauge", "http_requests_in_progress", "Requests being served",
+                               multiprocess_mode="livesum")
+request_queries = _metric("Histogram", "http_request_db_queries", "Database statements per request",
+                          ("route",), buckets=QUERY_COUNT_BUCKETS)
+request_db_seconds = _metric("Histogram", "http_request_db_seconds", "Database time per request",
+                             ("route",), buckets=LATENCY_BUCKETS)
+query_duration = _metric("Histogram", "db_query_duration_seconds", "Time to execute a statement",
+                         ("engine", "operation"), buckets=QUERY_BUCKETS)
+pool_checked_out = _metric("Gauge", "db_pool_checked_out", "Connections checked out of the pool",
+                           ("engine",), multiprocess_mode="livesum")
+pool_connections = _metric("Counter", "db_pool_connections", "Connections opened by the pool", ("engine",))
+upstream_attempts = _metric("Histogram", "upstream_attempt_duration_seconds", "Time of one request to CoinGecko",
+                            ("outcome",), buckets=LATENCY_BUCKETS)
+upstream_retries = _metric("Counter", "upstream_retries", "Requests to CoinGecko retried")
+upstream_calls = _metric("Counter", "upstream_calls", "Calls to CoinGecko, retries included, by result", ("result",))
+cache_events = _metric("Counter", "market_cache_events", "Market-data cache lookups and fetches", ("event",))
+job_duration = _metric("Histogram", "scheduler_job_duration_seconds", "Run time of a periodic job",
+                       ("job",), buckets=LATENCY_BUCKETS + (30, 60, 300))
+job_failures = _metric("Counter", "scheduler_job_failures", "Failed runs of a periodic job", ("job",))
+
+# [statements, seconds] of the request being served; threads running its handler share the list
+_request_queries = contextvars.ContextVar("request_queries", default=None)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request and its database statements.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._children = {}
+
+    def _observers(self, method: str, route: str, status: int):
+        key = (method, route, status)
+        observers = self._children.get(key)
+        if observers is None:
+            observers = self._children[key] = (
+                request_duration.labels(method, route, str(status)),
+                request_queries.labels(route),
+                request_db_seconds.labels(route),
+            )
+        return observers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        queries = [0, 0.0]
+        token = _request_queries.set(queries)
+        requests_in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            requests_in_progress.dec()
+            _request_queries.reset(token)
+            # Set by the router on a match: the template, so coin ids don't become label values
+            route = scope.get("route")
+            duration, count, db_seconds = self._observers(scope["method"], getattr(route, "path", "unmatched"), status)
+            duration.observe(elapsed)
+            count.observe(queries[0])
+            db_seconds.observe(queries[1])
+
+
+def instrument_engine(engine, name: str):
+    """
+    Time every statement of a (sync) engine and count its pool usage under engine=name.
+    """
+    if not METRICS_ENABLED:
+        return
+    durations = {operation: query_duration.labels(name, operation) for operation in OPERATIONS + ("OTHER",)}
+    checked_out = pool_checked_out.labels(name)
+    connections = pool_connections.labels(name)
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_started = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_metrics_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        durations.get(statement[:6].upper(), durations["OTHER"]).observe(elapsed)
+        queries = _request_queries.get()
+        if queries is not None:
+            queries[0] += 1
+            queries[1] += elapsed
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "connect", lambda dbapi_connection, connection_record: connections.inc())
+    event.listen(engine, "checkout", lambda dbapi_connection, connection_record, proxy: checked_out.inc())
+    event.listen(engine, "checkin", lambda dbapi_connection, connection_record: checked_out.dec())
+
+
+def install(app):
+    if METRICS_ENABLED:
+        app.add_middleware(MetricsMiddleware)
+
+
+def render():
+    """
+    The exposition text and its content type: every process's metrics with
+    PROMETHEUS_MULTIPROC_DIR, this process's otherwise.
+    """
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
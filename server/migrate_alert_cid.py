@@ -0,0 +1,109 @@
+# server/migrate_alert_cid.py
+"""
+Bring an existing database up to the current models.
+
+`create_all` (server/init_db.py) only creates missing tables; it never adds columns or indexes
+to tables that already exist. This
+
+  1. creates the tables that don't exist yet, and fills message_unread from the message table
+     if it was one of them
+  2. adds the columns in ADDED_COLUMNS that are missing: price_alert_subscription.cid and
+     alert_subscription.time_triggered, which alert evaluation (server/alerts.py) and the
+     alert book (server/alert_stream.py) select
+  3. copies alert_subscription.cid into the price alerts where it is still NULL, in primary-key
+     order, `--batch-size` rows per transaction; alert evaluation searches the thresholds near
+     each coin's price on a (cid, threshold) index
+  4. creates every index of the models that doesn't exist yet, among them
+     idx_alert_subscription_cid_active, idx_transaction_uid_time_tid (transaction listing) and
+     idx_message_uid_mid / idx_message_uid_read_mid (inbox)
+
+Every step skips what is already done, so an interrupted run can simply be started again.
+String price and quantity columns are converted separately, by server/migrate_numeric.py.
+
+    python -m server.migrate_alert_cid --batch-size 10000
+"""
+import argparse
+import logging
+import time
+
+from sqlalchemy import inspect, select, text, update
+
+from . import models, notifications
+from .database import SessionLocal, engine
+
+logger = logging.getLogger(__name__)
+
+# Columns added to tables that predate them
+ADDED_COLUMNS = [
+    models.PriceAlertSubscription.__table__.c.cid,
+    models.AlertSubscription.__table__.c.time_triggered,
+]
+
+
+def add_columns():
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for column in ADDED_COLUMNS:
+            if column.name in {c["name"] for c in inspector.get_columns(column.table.name)}:
+                continue
+            conn.execute(text(
+                f"ALTER TABLE {quote(column.table.name)} ADD COLUMN {quote(column.name)} {column.type.compile(engine.dialect)}"
+            ))
+            logger.info(f"{column.table.name}.{column.name}: added")
+
+
+def fill_alert_cid(batch_size: int):
+    table = models.PriceAlertSubscription.__table__
+    subscription = models.AlertSubscription.__table__
+    filled = 0
+    last = 0
+    while True:
+        with engine.begin() as conn:
+            pasids = conn.execute(
+                select(table.c.pasid).where(table.c.cid.is_(None), table.c.pasid > last)
+                .order_by(table.c.pasid).limit(batch_size)
+            ).scalars().all()
+            if not pasids:
+                break
+            conn.execute(
+                update(table).where(
+                    table.c.cid.is_(None), table.c.pasid > last, table.c.pasid <= pasids[-1],
+                ).values(cid=select(subscription.c.cid).where(subscription.c.asid == table.c.asid).scalar_subquery())
+            )
+        filled += len(pasids)
+        last = pasids[-1]
+        logger.info(f"{table.name}.cid: {filled} rows filled")
+    return filled
+
+
+def migrate(batch_size: int = 10000):
+    started = time.perf_counter()
+    missing = set(models.Base.metadata.tables) - set(inspect(engine).get_table_names())
+    models.Base.metadata.create_all(engine)
+    if missing:
+        logger.info(f"Created tables: {', '.join(sorted(missing))}")
+    if models.MessageUnread.__tablename__ in missing:
+        db = SessionLocal()
+        try:
+            notifications.recount(db)
+        finally:
+            db.close()
+
+    add_columns()
+    filled = fill_alert_cid(batch_size)
+
+    with engine.begin() as conn:
+        for table in models.Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+    logger.info(f"Migration done in {time.perf_counter() - started:.1f}s, {filled} alert cids filled")
+    return filled
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Add the missing tables, columns and indexes to an existing database")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+    migrate(args.batch_size)
@@ -0,0 +1,145 @@
+# server/migrate_numeric.py
+"""
+Convert the String price/quantity columns to NUMERIC in an existing database.
+
+For every column still stored as text:
+  1. add a NUMERIC shadow column `<column>__num`
+  2. backfill it in primary-key order, `--batch-size` rows per transaction
+     (values that don't parse as numbers become NULL and are counted)
+  3. drop the text column and rename the shadow column into its place
+
+The backfill only touches rows whose shadow value is still NULL, so an interrupted run
+can simply be started again.
+
+    python -m server.migrate_numeric --batch-size 10000
+"""
+import argparse
+import logging
+import time
+
+from sqlalchemy import String, inspect, literal_column, select, text, tuple_
+
+from . import models
+from .database import engine
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = [
+    (models.Price, ["current_price", "high_24h", "low_24h", "price_change_24h", "price_change_percentage_24h"]),
+    (models.Portfolio, ["quantity"]),
+    (models.PriceAlertSubscription, ["threshold", "threshold_percentage"]),
+    (models.Transaction, ["ex_rate", "position"]),
+]
+
+SHADOW_SUFFIX = "__num"
+
+
+def parse_number(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    value = str(value).strip()
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def pending_columns(conn):
+    """
+    (model, column) pairs whose database type is still textual.
+    """
+    inspector = inspect(conn)
+    pending = []
+    for model, columns in COLUMNS:
+        table = model.__tablename__
+        if not inspector.has_table(table):
+            continue
+        types = {c["name"]: c["type"] for c in inspector.get_columns(table)}
+        for column in columns:
+            if column + SHADOW_SUFFIX in types:
+                pending.append((model, column))  # resume an interrupted run
+            elif column in types and isinstance(types[column], String):
+                pending.append((model, column))
+    return pending
+
+
+def migrate_column(model, column: str, batch_size: int = 10000):
+    table = model.__table__
+    preparer = engine.dialect.identifier_preparer
+    quoted_table = preparer.quote(table.name)
+    shadow = column + SHADOW_SUFFIX
+    quoted_column = preparer.quote(column)
+    quoted_shadow = preparer.quote(shadow)
+    pk = list(table.primary_key.columns)
+
+    with engine.begin() as conn:
+        existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+        if column not in existing and shadow in existing:
+            # Interrupted between the drop and the rename
+            conn.execute(text(f"ALTER TABLE {quoted_table} RENAME COLUMN {quoted_shadow} TO {quoted_column}"))
+            return 0, 0
+        if shadow not in existing:
+            conn.execute(text(f"ALTER TABLE {quoted_table} ADD COLUMN {quoted_shadow} NUMERIC(38, 18)"))
+
+    # Untyped references: the model already declares these columns NUMERIC, the database doesn't yet
+    raw_column = literal_column(quoted_column)
+    raw_shadow = literal_column(quoted_shadow)
+    converted = unparseable = 0
+    last = None
+    started = time.perf_counter()
+    while True:
+        query = select(*pk, raw_column).select_from(table).where(
+            raw_column.isnot(None), raw_shadow.is_(None)
+        ).order_by(*pk).limit(batch_size)
+        if last is not None:
+            query = query.where(tuple_(*pk) > tuple_(*last))
+        with engine.begin() as conn:
+            rows = conn.execute(query).all()
+            if not rows:
+                break
+            params = []
+            for row in rows:
+                value = parse_number(row[-1])
+                if value is None:
+                    unparseable += 1
+                    continue
+                params.append({**{f"pk_{i}": row[i] for i in range(len(pk))}, "value": value})
+            if params:
+                where = " AND ".join(f"{preparer.quote(c.name)} = :pk_{i}" for i, c in enumerate(pk))
+                conn.execute(text(f"UPDATE {quoted_table} SET {quoted_shadow} = :value WHERE {where}"), params)
+            converted += len(params)
+        last = tuple(rows[-1][:len(pk)])
+        logger.info(f"{table.name}.{column}: {converted} rows converted")
+
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {quoted_table} DROP COLUMN {quoted_column}"))
+        conn.execute(text(f"ALTER TABLE {quoted_table} RENAME COLUMN {quoted_shadow} TO {quoted_column}"))
+
+    logger.info(
+        f"{table.name}.{column}: done in {time.perf_counter() - started:.1f}s, "
+        f"{converted} converted, {unparseable} unparseable values set to NULL"
+    )
+    return converted, unparseable
+
+
+def migrate(batch_size: int = 10000, dry_run: bool = False):
+    with engine.connect() as conn:
+        pending = pending_columns(conn)
+    for model, column in pending:
+        logger.info(f"{'Would convert' if dry_run else 'Converting'} {model.__tablename__}.{column}")
+        if not dry_run:
+            migrate_column(model, column, batch_size)
+    return pending
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Convert String price/quantity columns to NUMERIC")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    migrate(args.batch_size, args.dry_run)
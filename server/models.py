@@ -1,11 +1,23 @@
 # server/models.py
-from sqlalchemy import Column, Index, Integer, String, Boolean, TIMESTAMP
+from sqlalchemy import Column, Float, Index, Integer, JSON, Numeric, String, Boolean, TIMESTAMP
 from sqlalchemy import Index
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.types import TypeDecorator
 
 Base = declarative_base()
 
 
+# Exact NUMERIC in the database, plain float in Python.
+# Columns that used to be String are converted by server/migrate_numeric.py
+class Amount(TypeDecorator):
+    impl = Numeric(38, 18, asdecimal=False)
+    cache_ok = True
+
+    def process_result_value(self, value, dialect):
+        # SQLite hands back whole amounts as int; the raw serialization mode would emit 3, not 3.0
+        return None if value is None else float(value)
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -29,6 +41,8 @@ class AlertSubscription(Base):
     alert_type = Column(String)
     time_subscribed = Column(TIMESTAMP)
     subscription_active = Column(Boolean, default=False)
+    # Set when the alert fires, cleared when re-armed; server/migrate_alert_cid.py adds it to existing databases
+    time_triggered = Column(TIMESTAMP, nullable=True)
 
 class Cryptocurrency(Base):
     __tablename__ = "cryptocurrency"
@@ -58,6 +72,12 @@ class Message(Base):
     read = Column(Boolean, default=False)
     time_read = Column(TIMESTAMP, nullable=True)
 
+class MessageUnread(Base):
+    __tablename__ = "message_unread"
+
+    uid = Column(Integer, primary_key=True)
+    unread = Column(Integer)  # kept up to date by server/notifications.py with every insert and mark_read
+
 class Portfolio(Base):
     __tablename__ = "portfolio"
     
@@ -65,31 +85,54 @@ class Portfolio(Base):
     cid = Column(String, primary_key=True, index=True)
     asid = Column(Integer, index=True)
     time_created = Column(TIMESTAMP, nullable=True)
-    quantity = Column(String, nullable=True)
+    quantity = Column(Amount, nullable=True)
 
 class Price(Base):
     __tablename__ = "price"
     
     pid = Column(Integer, primary_key=True, index=True)
     cid = Column(String, index=True)
-    current_price = Column(String)
+    current_price = Column(Amount)
     market_cap = Column(Integer, nullable=True)
     market_cap_rank = Column(Integer, nullable=True)
     total_volume = Column(Integer, nullable=True)
-    high_24h = Column(String, nullable=True)
-    low_24h = Column(String, nullable=True)
-    price_change_24h = Column(String, nullable=True)
-    price_change_percentage_24h = Column(String, nullable=True)
+    high_24h = Column(Amount, nullable=True)
+    low_24h = Column(Amount, nullable=True)
+    price_change_24h = Column(Amount, nullable=True)
+    price_change_percentage_24h = Column(Amount, nullable=True)
     market_cap_change_24h = Column(Integer, nullable=True)
     time_stamp = Column(TIMESTAMP)
 
+class PriceRollup(Base):
+    __tablename__ = "price_rollup"
+
+    rid = Column(Integer, primary_key=True, index=True)
+    cid = Column(String)
+    granularity = Column(String)  # "1m", "5m", "1h", "1d"
+    bucket_start = Column(TIMESTAMP)
+    open = Column(Amount)
+    high = Column(Amount)
+    low = Column(Amount)
+    close = Column(Amount)
+    volume = Column(Integer, nullable=True)  # last observed 24h volume in the bucket
+    samples = Column(Integer)
+
+class RollupWatermark(Base):
+    __tablename__ = "rollup_watermark"
+
+    granularity = Column(String, primary_key=True)
+    rolled_up_to = Column(TIMESTAMP)  # buckets before this instant are complete
+
 class PriceAlertSubscription(Base):
     __tablename__ = "price_alert_subscription"
     
     pasid = Column(Integer, primary_key=True, index=True)
     asid = Column(Integer, index=True)
-    threshold = Column(String)  # existing absolute price threshold
-    threshold_percentage = Column(String)  # New field for percentage threshold
+    threshold = Column(Amount)  # existing absolute price threshold
+    threshold_percentage = Column(Amount)  # New field for percentage threshold
+    # Copy of AlertSubscription.cid, for the (cid, threshold) index alert evaluation searches;
+    # server/migrate_alert_cid.py fills it in for alerts created before it existed
+    cid = Column(String)
 
 class Transaction(Base):
     __tablename__ = "transaction"
@@ -99,12 +142,39 @@ class Transaction(Base):
     wid = Column(Integer, index=True)
     cid = Column(String, index=True)
     cid_target = Column(String, index=True)
-    ex_rate = Column(String)
-    position = Column(String)
+    ex_rate = Column(Amount)
+    position = Column(Amount)
     network = Column(String)
     success = Column(Boolean)
     time_transaction = Column(TIMESTAMP)
 
+class LotSnapshot(Base):
+    __tablename__ = "lot_snapshot"
+
+    uid = Column(Integer, primary_key=True)
+    cid = Column(String, primary_key=True)
+    method = Column(String, primary_key=True)  # "fifo", "lifo", "average"
+    quantity = Column(Amount)
+    cost_basis = Column(Amount)
+    realized_pnl = Column(Amount)
+    lots = Column(JSON)  # open lots, [[quantity, unit_cost, time_acquired], ...]
+    last_tid = Column(Integer)
+    last_time = Column(TIMESTAMP)  # replay resumes after (last_time, last_tid)
+    stale = Column(Boolean, default=False)  # back-dated trades arrived, replay in full
+    time_updated = Column(TIMESTAMP)
+
+class LotWatermark(Base):
+    __tablename__ = "lot_watermark"
+
+    method = Column(String, primary_key=True)
+    last_tid = Column(Integer)  # ledger rows up to this tid are reflected in the method's snapshots
+
+class ReplicaHeartbeat(Base):
+    __tablename__ = "replica_heartbeat"
+
+    id = Column(Integer, primary_key=True)
+    stamped_at = Column(Float)  # epoch seconds, written on the primary and read back from each replica
+
 class Wallet(Base):
     __tablename__ = "wallet"
     
@@ -116,8 +186,18 @@ class Wallet(Base):
     time_accessed = Column(TIMESTAMP, nullable=True)
 
 Index('idx_alert_subscription_uid', AlertSubscription.uid, AlertSubscription.cid, AlertSubscription.alert_type)
+Index('idx_alert_subscription_cid_active', AlertSubscription.cid, AlertSubscription.subscription_active)
+Index('idx_lot_snapshot_stale_method', LotSnapshot.stale, LotSnapshot.method)
+Index('idx_message_uid_mid', Message.uid, Message.mid)
+Index('idx_message_uid_read_mid', Message.uid, Message.read, Message.mid)
+Index('idx_message_read_time_read', Message.read, Message.time_read)
 Index('idx_portfolio_uid_cid', Portfolio.uid, Portfolio.cid)
 Index('idx_price_alert_asid', PriceAlertSubscription.asid)
+Index('idx_price_alert_cid_threshold', PriceAlertSubscription.cid, PriceAlertSubscription.threshold)
+Index('idx_price_alert_threshold_percentage', PriceAlertSubscription.threshold_percentage)
 Index('idx_price_cid_timestamp', Price.cid, Price.time_stamp)
+Index('idx_price_time_stamp', Price.time_stamp)
+Index('idx_price_rollup_cid_granularity_bucket', PriceRollup.cid, PriceRollup.granularity, PriceRollup.bucket_start, unique=True)
 Index('idx_transaction_uid_cid_time', Transaction.uid, Transaction.cid, Transaction.time_transaction)
+Index('idx_transaction_uid_time_tid', Transaction.uid, Transaction.time_transaction, Transaction.tid)
 Index('idx_wallet_uid_address', Wallet.uid, Wallet.address)
\ No newline at end of file
@@ -0,0 +1,300 @@
+# server/notifications.py
+"""
+The user's message inbox: delivery, unread counters, listing and retention.
+
+Delivery. Code that notifies users in bulk writes the Message rows with write() inside its own
+transaction: price alerts (alerts.evaluate, alert_stream.write_fired) in the commit that stamps
+the alerts as fired, imports in their last batch. Per-request messages, one per successful
+transaction, go through notify() instead: the row is queued on this process's outbox once the
+request commits (dropped if it rolls back), and a writer thread inserts the queue
+NOTIFY_BATCH_SIZE rows at a time, waiting up to NOTIFY_FLUSH_INTERVAL seconds for a batch to
+fill. Many requests then share one insert and one commit, off the request path. The queue
+lives in memory: messages queued in a process that dies before the next flush are lost, and a
+clean shutdown flushes them (outbox.close()).
+
+Unread counters. message_unread holds one row per user. write() adds each batch to it in the
+same transaction, with one upsert per user. mark_read() subtracts the number of rows it actually
+flipped. The unread badge is then a primary-key lookup, not a COUNT(*) over the user's
+messages. Counters only cover rows written through this module; after upgrading a database
+that already has messages, build them once:
+
+    python -m server.notifications recount
+
+Listing. GET /messages pages the current user's inbox newest first by mid, with a keyset
+cursor (server/listing.py) on idx_message_uid_mid, or idx_message_uid_read_mid with unread=true.
+
+Retention. prune() is the message_retention job of server/scheduler.py, every
+MESSAGE_PRUNE_INTERVAL seconds. It deletes
+read messages that were read more than MESSAGE_RETENTION_DAYS ago, then compacts inboxes that
+hold more than MESSAGE_KEEP_READ read messages down to the newest ones. Unread messages are
+never deleted.
+
+    python -m server.notifications prune
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from . import database, listing, models, serialization
+from .queries import CHUNK_SIZE
+from .timeseries import delete_in_batches
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "500"))
+NOTIFY_FLUSH_INTERVAL = float(os.getenv("NOTIFY_FLUSH_INTERVAL", "0.05"))
+# Queued rows beyond this are dropped (and logged) rather than growing without bound while the database is down
+NOTIFY_MAX_PENDING = int(os.getenv("NOTIFY_MAX_PENDING", "100000"))
+NOTIFY_RETRY_DELAY = 1.0
+INBOX_PAGE_SIZE = int(os.getenv("INBOX_PAGE_SIZE", "50"))
+MESSAGE_RETENTION_DAYS = float(os.getenv("MESSAGE_RETENTION_DAYS", "90"))
+MESSAGE_KEEP_READ = int(os.getenv("MESSAGE_KEEP_READ", "1000"))
+MESSAGE_PRUNE_INTERVAL = float(os.getenv("MESSAGE_PRUNE_INTERVAL", "3600"))
+
+stats = {"queued": 0, "written": 0, "batches": 0, "pending": 0, "failed": 0, "dropped": 0}
+
+# INSERT ... ON CONFLICT for the unread counters
+UPSERTS = {
+    "sqlite": sqlite.insert,
+    "postgresql": postgresql.insert,
+}
+
+messages = models.Message.__table__
+unread_counters = models.MessageUnread.__table__
+
+
+def _add_unread(db: Session, counts: dict):
+    # Sorted, so concurrent writers lock counter rows in the same order
+    values = [{"uid": uid, "unread": n} for uid, n in sorted(counts.items())]
+    upsert = UPSERTS.get(db.get_bind().dialect.name)
+    if upsert is not None:
+        statement = upsert(unread_counters)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[unread_counters.c.uid],
+            set_={"unread": unread_counters.c.unread + statement.excluded.unread},
+        ), values)
+        return
+    for value in values:
+        if not db.execute(update(unread_counters).where(unread_counters.c.uid == value["uid"])
+                          .values(unread=unread_counters.c.unread + value["unread"])).rowcount:
+            db.execute(insert(unread_counters).values(**value))
+
+
+def write(db: Session, rows: list):
+    """
+    Insert unread Message rows and add them to their users' unread counters, in db's
+    transaction; the caller commits.
+    """
+    if not rows:
+        return
+    db.execute(insert(messages), rows)
+    _add_unread(db, Counter(row["uid"] for row in rows))
+
+
+def message_row(uid: int, asid, message_type: str, body: str, now: datetime = None) -> dict:
+    return {
+        "uid": uid,
+        "asid": asid,
+        "message_type": message_type,
+        "body": body,
+        "time_sent": now or datetime.now(timezone.utc),
+        "read": False,
+    }
+
+
+class Outbox:
+    """
+    Message rows waiting to be written, inserted in batches by a writer thread started on first use.
+    """
+
+    def __init__(self):
+        self.rows = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closing = False
+
+    def put(self, rows: list):
+        with self._cond:
+            if len(self.rows) + len(rows) > NOTIFY_MAX_PENDING:
+                stats["dropped"] += len(rows)
+                logger.error(f"Notification outbox full, {len(rows)} messages dropped")
+                return
+            self.rows.extend(rows)
+            stats["queued"] += len(rows)
+            stats["pending"] = len(self.rows)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="notifications", daemon=True)
+                self._thread.start()
+            if len(self.rows) >= NOTIFY_BATCH_SIZE:
+                self._cond.notify()
+
+    def _take(self) -> list:
+        with self._cond:
+            while not self.rows and not self._closing:
+                self._cond.wait()
+            if len(self.rows) < NOTIFY_BATCH_SIZE and not self._closing:
+                # Let the batch fill up for a moment
+                self._cond.wait(NOTIFY_FLUSH_INTERVAL)
+            batch, self.rows = self.rows[:NOTIFY_BATCH_SIZE], self.rows[NOTIFY_BATCH_SIZE:]
+            stats["pending"] = len(self.rows)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            if not batch:
+                return  # closing, and everything is written
+            try:
+                db = database.SessionLocal()
+                try:
+                    write(db, batch)
+                    db.commit()
+                finally:
+                    db.close()
+            except Exception as e:
+                stats["failed"] += 1
+                if self._closing:
+                    logger.error(f"Notification batch failed at shutdown, {len(batch)} messages lost: {e}")
+                    continue
+                logger.error(f"Notification batch failed, retrying: {e}")
+                with self._cond:
+                    self.rows[:0] = batch
+                time.sleep(NOTIFY_RETRY_DELAY)
+                continue
+            stats["written"] += len(batch)
+            stats["batches"] += 1
+
+    def close(self):
+        """
+        Write everything queued and stop the writer thread; the next put() starts a new one.
+        """
+        with self._cond:
+            thread = self._thread
+            if thread is None:
+                return
+            self._closing = True
+            self._cond.notify()
+        thread.join()
+        with self._cond:
+            self._thread = None
+            self._closing = False
+
+
+outbox = Outbox()
+
+
+def notify(db: Session, uid: int, asid, message_type: str, body: str) -> dict:
+    """
+    Queue a message for the user, to be written once db's transaction commits.
+    """
+    row = message_row(uid, asid, message_type, body)
+    database.after_commit(db, lambda: outbox.put([row]))
+    return row
+
+
+def unread_count(db: Session, uid: int) -> int:
+    return db.execute(select(unread_counters.c.unread).where(unread_counters.c.uid == uid)).scalar() or 0
+
+
+def inbox(db: Session, uid: int, after: str = None, limit: int = INBOX_PAGE_SIZE, unread: bool = False):
+    """
+    Up to limit of the user's messages, newest first, after the cursor; and the cursor of the
+    next page (None on the last one). Raises ValueError for a bad cursor.
+    """
+    statement = select(messages).where(messages.c.uid == uid)
+    if unread:
+        statement = statement.where(messages.c.read == False)
+    if after is not None:
+        (mid,) = listing.decode_cursor("message", after)
+        statement = statement.where(messages.c.mid < mid)
+    rows = serialization.rows(db.execute(statement.order_by(messages.c.mid.desc()).limit(limit + 1)))
+    next_after = listing.encode_cursor("message", rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_after
+
+
+def mark_read(db: Session, uid: int, mids: list = None, up_to: int = None, now: datetime = None) -> int:
+    """
+    Mark the user's messages read: those in mids, else every one up to mid up_to, else all.
+    Returns how many were unread; the counter goes down by as much, in db's transaction.
+    """
+    now = now or datetime.now(timezone.utc)
+    unread = (messages.c.uid == uid) & (messages.c.read == False)
+    if mids is not None:
+        conditions = [unread & messages.c.mid.in_(mids[i:i + CHUNK_SIZE]) for i in range(0, len(mids), CHUNK_SIZE)]
+    elif up_to is not None:
+        conditions = [unread & (messages.c.mid <= up_to)]
+    else:
+        conditions = [unread]
+    marked = 0
+    for condition in conditions:
+        marked += db.execute(update(messages).where(condition).values(read=True, time_read=now)).rowcount
+    if marked:
+        db.execute(update(unread_counters).where(unread_counters.c.uid == uid)
+                   .values(unread=unread_counters.c.unread - marked))
+    return marked
+
+
+def recount(db: Session, uid: int = None):
+    """
+    Rebuild the unread counters (of one user, or everyone's) from the message table.
+    """
+    statement = select(messages.c.uid, func.count().label("unread")).where(messages.c.read == False).group_by(messages.c.uid)
+    if uid is not None:
+        statement = statement.where(messages.c.uid == uid)
+        db.execute(delete(unread_counters).where(unread_counters.c.uid == uid))
+    else:
+        db.execute(delete(unread_counters))
+    counts = [{"uid": row.uid, "unread": row.unread} for row in db.execute(statement)]
+    if counts:
+        db.execute(insert(unread_counters), counts)
+    db.commit()
+    return len(counts)
+
+
+def prune(db: Session, now: datetime = None):
+    """
+    Delete read messages past retention, then compact inboxes with more than MESSAGE_KEEP_READ read messages.
+    """
+    now = now or datetime.now(timezone.utc)
+    read = messages.c.read == True
+    expired = delete_in_batches(db, models.Message, models.Message.mid,
+                                read & (messages.c.time_read < now - timedelta(days=MESSAGE_RETENTION_DAYS)))
+    compacted = 0
+    crowded = db.execute(
+        select(messages.c.uid).where(read).group_by(messages.c.uid).having(func.count() > MESSAGE_KEEP_READ)
+    ).scalars().all()
+    for uid in crowded:
+        # Newest read message past the ones kept
+        newest_dropped = db.execute(
+            select(messages.c.mid).where(messages.c.uid == uid, read)
+            .order_by(messages.c.mid.desc()).offset(MESSAGE_KEEP_READ).limit(1)
+        ).scalar()
+        if newest_dropped is not None:
+            compacted += delete_in_batches(db, models.Message, models.Message.mid,
+                                           (messages.c.uid == uid) & read & (messages.c.mid <= newest_dropped))
+    if expired or compacted:
+        logger.info(f"Message retention: {expired} expired, {compacted} compacted in {len(crowded)} inboxes")
+    return {"expired": expired, "compacted": compacted}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Message inbox maintenance")
+    parser.add_argument("command", choices=("recount", "prune"))
+    args = parser.parse_args()
+    session = database.SessionLocal()
+    try:
+        if args.command == "recount":
+            print(f"Unread counters rebuilt for {recount(session)} users")
+        else:
+            print(prune(session))
+    finally:
+        session.close()
@@ -0,0 +1,301 @@
+# server/portfolio.py
+"""
+Portfolio valuation and P&L on NumPy arrays.
+
+Holdings (Portfolio), the successful trade history (Transaction) and the newest Price per coin
+are read as flat columns and turned into per-position arrays; value, cost basis, realized /
+unrealized P&L, allocation weights and 24h change are array expressions, and per-user totals
+are np.bincount sums. The same code path serves one user (`summarize`) and every user in one
+pass for nightly reports (`value_all`).
+
+Conventions:
+  * Transaction.position is the signed quantity of `cid` (buy > 0, sell < 0) and ex_rate the
+    price paid per unit in the quote currency, which is taken to be USD like Price.
+  * Cost basis uses the average cost method. Sells beyond the traded quantity only close
+    what was bought; holdings without any trades have an unknown (None) cost basis.
+  * The Portfolio quantity is authoritative for market value; cost basis is that quantity
+    times the average cost from the trade history.
+  * A coin without a stored price has no market value and an unknown (None) unrealized P&L,
+    left out of the user's total.
+
+    python -m server.portfolio report portfolio_report.csv
+"""
+import argparse
+import csv
+import gc
+import logging
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import models, queries
+
+logger = logging.getLogger(__name__)
+
+
+def _codes(values, index: dict):
+    """
+    Dictionary-encode strings, extending `index` with unseen values.
+    """
+    return np.fromiter((index.setdefault(value, len(index)) for value in values), dtype=np.int64, count=len(values))
+
+
+def _floats(values):
+    return np.fromiter((np.nan if value is None else value for value in values), dtype=np.float64, count=len(values))
+
+
+def _columns(result, count: int):
+    """
+    Transpose a result into `count` lists, a partition at a time so no list of Row objects is ever held.
+    """
+    columns = [[] for _ in range(count)]
+    for partition in result.partitions(100_000):
+        for column, values in zip(columns, zip(*partition)):
+            column.extend(values)
+    return columns
+
+
+@contextmanager
+def _gc_paused():
+    """
+    Bulk reads allocate millions of short-lived Row tuples; letting the cyclic collector chase
+    them made loading every user's positions several times slower.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _average_cost(group, quantity, price, groups: int):
+    """
+    Replay each position's trades in order under the average cost method.
+
+    Trades are processed by their rank within the position: step r applies every position's
+    r-th trade at once, so the Python loop runs (longest trade history) times, not once per trade.
+    Returns (held quantity, remaining cost, realized P&L) per group.
+    """
+    held = np.zeros(groups)
+    cost = np.zeros(groups)
+    realized = np.zeros(groups)
+    if not len(group):
+        return held, cost, realized
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    rank = np.arange(len(group)) - np.repeat(starts, np.diff(np.r_[starts, len(group)]))
+    order = np.argsort(rank, kind="stable")
+    bounds = np.r_[0, np.cumsum(np.bincount(rank))]
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        step = order[lo:hi]
+        g, q, p = group[step], quantity[step], price[step]
+        buy = q > 0
+        gb = g[buy]
+        held[gb] += q[buy]
+        cost[gb] += q[buy] * p[buy]
+        sell = q < 0
+        gs = g[sell]
+        before = held[gs]
+        sold = np.minimum(-q[sell], before)
+        average = np.divide(cost[gs], before, out=np.zeros(len(gs)), where=before > 0)
+        realized[gs] += sold * (p[sell] - average)
+        cost[gs] -= sold * average
+        held[gs] = before - sold
+    return held, cost, realized
+
+
+class Valuation:
+    """
+    Per-position arrays for a set of users, ordered by (uid, coin).
+    """
+
+    def __init__(self, uid, coin, coins, quantity, price, change_24h, cost_basis, realized):
+        self.uid = uid
+        self.coin = coin
+        self.coins = coins
+        self.quantity = quantity
+        self.price = price
+        priced = ~np.isnan(price)
+        self.market_value = np.where(priced, quantity * np.nan_to_num(price), 0.0)
+        self.change_24h = np.where(priced, quantity * np.nan_to_num(change_24h), 0.0)
+        self.cost_basis = cost_basis
+        self.average_cost = np.divide(cost_basis, quantity, out=np.full(len(quantity), np.nan), where=quantity > 0)
+        # Unknown without a price, rather than the whole cost basis booked as a loss
+        self.unrealized = np.where(priced, self.market_value - cost_basis, np.nan)
+        self.realized = realized
+
+        self.users, self.user_index = np.unique(uid, return_inverse=True)
+        count = len(self.users)
+        self.total_value = np.bincount(self.user_index, self.market_value, count)
+        self.total_change_24h = np.bincount(self.user_index, self.change_24h, count)
+        self.total_cost_basis = np.bincount(self.user_index, np.nan_to_num(cost_basis), count)
+        self.total_unrealized = np.bincount(self.user_index, np.nan_to_num(self.unrealized), count)
+        self.total_realized = np.bincount(self.user_index, realized, count)
+        total = self.total_value[self.user_index]
+        self.weight = np.divide(self.market_value, total, out=np.zeros(len(total)), where=total > 0)
+
+    def __len__(self):
+        return len(self.users)
+
+    def _totals(self, i: int):
+        previous = self.total_value[i] - self.total_change_24h[i]
+        return {
+            "uid": int(self.users[i]),
+            "total_value": float(self.total_value[i]),
+            "total_cost_basis": float(self.total_cost_basis[i]),
+            "unrealized_pnl": float(self.total_unrealized[i]),
+            "realized_pnl": float(self.total_realized[i]),
+            "change_24h": float(self.total_change_24h[i]),
+            "change_24h_percentage": float(self.total_change_24h[i] * 100 / previous) if previous > 0 else None,
+        }
+
+    def user_totals(self):
+        """
+        One dict of totals per user, in uid order.
+        """
+        for i in range(len(self.users)):
+            yield self._totals(i)
+
+    def summary(self, uid: int):
+        matches = np.flatnonzero(self.users == uid)
+        if not len(matches):
+            return None
+        holdings = [
+            {
+                "cid": self.coins[self.coin[i]],
+                "quantity": float(self.quantity[i]),
+                "price": _optional(self.price[i]),
+                "market_value": float(self.market_value[i]),
+                "weight": float(self.weight[i]),
+                "change_24h": float(self.change_24h[i]),
+                "average_cost": _optional(self.average_cost[i]),
+                "cost_basis": _optional(self.cost_basis[i]),
+                "unrealized_pnl": _optional(self.unrealized[i]),
+                "realized_pnl": float(self.realized[i]),
+            }
+            for i in np.flatnonzero(self.user_index == matches[0])
+        ]
+        holdings.sort(key=lambda holding: (-holding["market_value"], holding["cid"]))
+        return {**self._totals(matches[0]), "holdings": holdings}
+
+
+def _optional(value):
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+def evaluate(positions, trades, prices):
+    """
+    Build a Valuation from plain columns:
+
+        positions: (uid, cid, quantity) holdings
+        trades:    (uid, cid, position, ex_rate) successful trades, grouped by (uid, cid) in time order
+        prices:    (cid, current_price, price_change_24h) latest price per coin
+    """
+    coin_index = {}
+    p_uid, p_cid, p_quantity = positions
+    t_uid, t_cid, t_position, t_rate = trades
+    p_coin = _codes(p_cid, coin_index)
+    t_coin = _codes(t_cid, coin_index)
+    price_coin = _codes(prices[0], coin_index)
+    coins = list(coin_index)
+    width = max(len(coins), 1)
+
+    p_key = np.asarray(p_uid, dtype=np.int64) * width + p_coin
+    t_key = np.asarray(t_uid, dtype=np.int64) * width + t_coin
+    keys = np.union1d(p_key, t_key)
+
+    quantity = np.zeros(len(keys))
+    quantity[np.searchsorted(keys, p_key)] = np.nan_to_num(_floats(p_quantity))
+
+    # Trades arrive grouped by position; group ids are positions in `keys`
+    group = np.searchsorted(keys, t_key)
+    held, cost, realized = _average_cost(group, _floats(t_position), np.nan_to_num(_floats(t_rate)), len(keys))
+    average = np.divide(cost, held, out=np.full(len(keys), np.nan), where=held > 0)
+    cost_basis = np.where(quantity > 0, quantity * average, 0.0)
+
+    coin = keys % width
+    price = np.full(width, np.nan)
+    change = np.zeros(width)
+    price[price_coin] = _floats(prices[1])
+    change[price_coin] = np.nan_to_num(_floats(prices[2]))
+    return Valuation(keys // width, coin, coins, quantity, price[coin], change[coin], cost_basis, realized)
+
+
+def _load(db: Session, uid: int = None):
+    positions = select(models.Portfolio.uid, models.Portfolio.cid, models.Portfolio.quantity)
+    trades = select(
+        models.Transaction.uid, models.Transaction.cid, models.Transaction.position, models.Transaction.ex_rate
+    ).where(
+        models.Transaction.success == True
+    ).order_by(
+        models.Transaction.uid, models.Transaction.cid, models.Transaction.time_transaction, models.Transaction.tid
+    )
+    prices = select(
+        models.Price.cid, models.Price.current_price, models.Price.price_change_24h
+    ).where(queries.latest_price_filter())
+    if uid is not None:
+        positions = positions.where(models.Portfolio.uid == uid)
+        trades = trades.where(models.Transaction.uid == uid)
+        held = select(models.Portfolio.cid).where(models.Portfolio.uid == uid)
+        traded = select(models.Transaction.cid).where(models.Transaction.uid == uid)
+        prices = prices.where(models.Price.cid.in_(held.union(traded)))
+    # Core execution on the session's connection: plain column tuples, no ORM result handling
+    conn = db.connection()
+    with _gc_paused():
+        return (
+            _columns(conn.execute(positions), 3),
+            _columns(conn.execute(trades), 4),
+            _columns(conn.execute(prices), 3),
+        )
+
+
+def summarize(db: Session, uid: int):
+    """
+    Value, P&L, weights and 24h change of one user's portfolio, None if the user holds and traded nothing.
+    """
+    return evaluate(*_load(db, uid)).summary(uid)
+
+
+def value_all(db: Session):
+    """
+    Valuation of every user in one pass.
+    """
+    started = time.perf_counter()
+    columns = _load(db)
+    loaded = time.perf_counter()
+    valuation = evaluate(*columns)
+    logger.info(
+        f"Valued {len(valuation)} portfolios ({len(valuation.uid)} positions): "
+        f"load {loaded - started:.2f}s, compute {time.perf_counter() - loaded:.2f}s"
+    )
+    return valuation
+
+
+def write_report(valuation: Valuation, path: str):
+    fields = ["uid", "total_value", "total_cost_basis", "unrealized_pnl", "realized_pnl", "change_24h", "change_24h_percentage"]
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(valuation.user_totals())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Portfolio valuation")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report_parser = sub.add_parser("report", help="write per-user totals of every portfolio as CSV")
+    report_parser.add_argument("path")
+    args = parser.parse_args()
+
+    from .database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        write_report(value_all(db), args.path)
+    finally:
+        db.close()
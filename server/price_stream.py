@@ -0,0 +1,310 @@
+# server/price_stream.py
+"""
+Live prices pushed to clients: /ws/prices (WebSocket) and /sse/prices (Server-Sent Events).
+
+A client subscribes to coin ids and gets the latest known prices of those coins, then, each
+time the server learns new prices, a message with only the coins whose price info changed:
+
+    {"type": "prices", "prices": {"bitcoin": {"coin_id": "bitcoin", "current_price": ...}}}
+
+The ingestion leader reads upstream once per tick and publish()es the tick on a host-local bus;
+every API worker receives it and fans it out to its own subscribers, so clients cause no reads.
+
+  bus           one unix datagram socket per worker in PRICE_BUS_DIR (prices-<pid>.sock).
+                publish() sends the tick to every socket there, from a thread so a full
+                receiver never blocks the event loop, and unlinks those whose worker is
+                gone; its own process's broker gets it directly, on the loop. It works
+                from the standalone ingest process too. A tick goes out in datagrams of at most
+                PRICE_BUS_DATAGRAM_BYTES, each a JSON object of some of its coins, so any
+                number of coins fits. A worker whose queue is full (net.unix.max_dgram_qlen
+                datagrams) gets PRICE_BUS_SEND_TIMEOUT seconds to catch up before it misses
+                the rest of the tick. Without AF_UNIX (Windows) a tick only reaches the local
+                broker.
+  broker        per worker, coin id -> subscriptions. A changed coin is encoded to JSON once
+                per tick and the fragment handed to each subscription of that coin.
+  backpressure  a subscription holds at most one unsent fragment per coin. A newer price
+                replaces one its client has not been sent yet (drop-to-latest), so a slow
+                client costs bounded memory and gets the latest prices when it catches up.
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+import socket
+from contextlib import contextmanager
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from . import locks
+
+logger = logging.getLogger(__name__)
+
+PRICE_BUS_DIR = os.getenv("PRICE_BUS_DIR", locks.LOCK_DIR)
+PRICE_STREAM_MAX_SUBSCRIBERS = int(os.getenv("PRICE_STREAM_MAX_SUBSCRIBERS", "20000"))
+PRICE_STREAM_MAX_COINS = int(os.getenv("PRICE_STREAM_MAX_COINS", "250"))
+SSE_KEEPALIVE = float(os.getenv("SSE_KEEPALIVE", "15"))
+# Below the default socket send buffer (net.core.wmem_default), which bounds a datagram's size
+PRICE_BUS_DATAGRAM_BYTES = int(os.getenv("PRICE_BUS_DATAGRAM_BYTES", "65536"))
+PRICE_BUS_SEND_TIMEOUT = float(os.getenv("PRICE_BUS_SEND_TIMEOUT", "0.05"))
+
+stats = {"subscribers": 0, "ticks": 0, "changed": 0, "pushed": 0, "dropped": 0, "bus_sent": 0, "bus_failed": 0}
+
+_encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+
+class Overloaded(Exception):
+    """
+    PRICE_STREAM_MAX_SUBSCRIBERS connections are open on this worker.
+    """
+
+
+class Subscription:
+    def __init__(self):
+        self.coins = set()
+        self.pending = {}  # coin id -> encoded fragment not yet sent
+        self.ready = asyncio.Event()
+
+    def push(self, cid: str, fragment: str):
+        if cid in self.pending:
+            stats["dropped"] += 1
+        elif not self.pending:
+            self.ready.set()
+        self.pending[cid] = fragment
+
+    async def next_message(self) -> str:
+        """
+        Wait for price changes, then everything pending as one message.
+        """
+        while not self.pending:
+            # ready may be set by coins since unsubscribed
+            self.ready.clear()
+            await self.ready.wait()
+        pending, self.pending = self.pending, {}
+        return '{"type":"prices","prices":{' + ",".join(pending.values()) + "}}"
+
+
+class Broker:
+    def __init__(self):
+        self.latest = {}  # coin id -> (price info, fragment)
+        self.subscriptions = {}  # coin id -> set of Subscription
+
+    def subscribe(self, subscription: Subscription, coins):
+        """
+        Add coins to a subscription; their latest prices are queued for it at once.
+        """
+        added = [cid for cid in dict.fromkeys(coins) if cid not in subscription.coins]
+        if len(subscription.coins) + len(added) > PRICE_STREAM_MAX_COINS:
+            raise ValueError(f"At most {PRICE_STREAM_MAX_COINS} coins per subscription")
+        for cid in added:
+            subscription.coins.add(cid)
+            self.subscriptions.setdefault(cid, set()).add(subscription)
+            if cid in self.latest:
+                subscription.push(cid, self.latest[cid][1])
+
+    def unsubscribe(self, subscription: Subscription, coins=None):
+        for cid in list(subscription.coins if coins is None else coins):
+            subscription.coins.discard(cid)
+            subscription.pending.pop(cid, None)
+            subscribers = self.subscriptions.get(cid)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscriptions[cid]
+
+    def publish(self, prices: dict):
+        """
+        Fan one tick (coin id -> price info) out to the subscribers of the coins that changed.
+        """
+        stats["ticks"] += 1
+        for cid, info in prices.items():
+            last = self.latest.get(cid)
+            if last is not None and last[0] == info:
+                continue
+            fragment = f"{_encode(cid)}:{_encode(info)}"
+            self.latest[cid] = (info, fragment)
+            stats["changed"] += 1
+            subscribers = self.subscriptions.get(cid, ())
+            for subscription in subscribers:
+                subscription.push(cid, fragment)
+            stats["pushed"] += len(subscribers)
+
+
+broker = Broker()
+
+
+class Bus(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.path = os.path.join(PRICE_BUS_DIR, f"prices-{os.getpid()}.sock")
+        self.transport = None
+
+    async def start(self):
+        if not hasattr(socket, "AF_UNIX"):
+            return
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: self, local_addr=self.path, family=socket.AF_UNIX,
+        )
+
+    def datagram_received(self, data, addr):
+        try:
+            broker.publish(json.loads(data))
+        except ValueError as e:
+            logger.error(f"Bad price tick on the bus: {e}")
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+bus = Bus()
+
+
+def datagrams(prices: dict, size: int = PRICE_BUS_DATAGRAM_BYTES):
+    """
+    A tick as JSON objects of up to `size` bytes (or a single coin, if that is larger).
+    """
+    parts, length = [], 2
+    for cid, info in prices.items():
+        part = f"{_encode(cid)}:{_encode(info)}".encode()
+        if parts and length + len(part) + 1 > size:
+            yield b"{" + b",".join(parts) + b"}"
+            parts, length = [], 2
+        parts.append(part)
+        length += len(part) + 1
+    if parts:
+        yield b"{" + b",".join(parts) + b"}"
+
+
+async def publish(prices: dict):
+    """
+    Send a tick (coin id -> price info) to the brokers of all workers on this host.
+
+    This worker's broker gets it on the event loop. The datagrams to the others are sent from a
+    thread: sendto blocks while a slow worker's queue is full, which must not stall the loop.
+    """
+    if not prices:
+        return
+    if not hasattr(socket, "AF_UNIX"):
+        broker.publish(prices)
+        return
+    paths = glob.glob(os.path.join(PRICE_BUS_DIR, "prices-*.sock"))
+    if bus.transport is not None and bus.path in paths:
+        # Our own socket is read by this event loop, which is busy sending
+        paths.remove(bus.path)
+        broker.publish(prices)
+        stats["bus_sent"] += 1
+    if paths:
+        await asyncio.to_thread(_send, list(datagrams(prices)), paths)
+
+
+def _send(payloads: list, paths: list):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        # Blocks while a receiver's queue is full, for at most the timeout per datagram
+        sock.settimeout(PRICE_BUS_SEND_TIMEOUT)
+        for path in paths:
+            try:
+                for payload in payloads:
+                    sock.sendto(payload, path)
+                stats["bus_sent"] += 1
+            except (ConnectionRefusedError, FileNotFoundError):
+                # The worker is gone
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except OSError as e:
+                # Receiver still full after the timeout, or a single coin too large for a datagram
+                stats["bus_failed"] += 1
+                logger.warning(f"Price tick not delivered to {path}: {e}")
+
+
+def parse_ids(ids: str) -> list:
+    return list(dict.fromkeys(c.strip() for c in (ids or "").split(",") if c.strip()))
+
+
+@contextmanager
+def subscription(coins):
+    """
+    A Subscription to coins, counted against PRICE_STREAM_MAX_SUBSCRIBERS and removed on exit.
+    Raises Overloaded, or ValueError for too many coins.
+    """
+    if stats["subscribers"] >= PRICE_STREAM_MAX_SUBSCRIBERS:
+        raise Overloaded()
+    stats["subscribers"] += 1
+    sub = Subscription()
+    try:
+        broker.subscribe(sub, coins)
+        yield sub
+    finally:
+        broker.unsubscribe(sub)
+        stats["subscribers"] -= 1
+
+
+def _coin_list(value) -> list:
+    if not isinstance(value, list) or not all(isinstance(cid, str) for cid in value):
+        raise ValueError("subscribe/unsubscribe take a list of coin ids")
+    return value
+
+
+async def _send_loop(websocket: WebSocket, sub: Subscription):
+    while True:
+        await websocket.send_text(await sub.next_message())
+
+
+async def serve_websocket(websocket: WebSocket, ids: str = None):
+    """
+    Push prices over a WebSocket. Clients change their coins with
+    {"subscribe": [...]} and {"unsubscribe": [...]} messages.
+    """
+    await websocket.accept()
+    try:
+        with subscription(parse_ids(ids)) as sub:
+            sender = asyncio.create_task(_send_loop(websocket, sub))
+            try:
+                while True:
+                    text = await websocket.receive_text()
+                    try:
+                        message = json.loads(text)
+                        broker.subscribe(sub, _coin_list(message.get("subscribe", [])))
+                        broker.unsubscribe(sub, _coin_list(message.get("unsubscribe", [])))
+                    except (ValueError, AttributeError) as e:
+                        await websocket.send_text(_encode({"type": "error", "detail": str(e)}))
+            except WebSocketDisconnect:
+                pass
+            finally:
+                sender.cancel()
+    except Overloaded:
+        await websocket.close(code=1013, reason="Too many subscribers, retry later")
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e))
+
+
+def admit(coins):
+    """
+    Checks before a stream starts: raises Overloaded or ValueError.
+    """
+    if stats["subscribers"] >= PRICE_STREAM_MAX_SUBSCRIBERS:
+        raise Overloaded()
+    if len(coins) > PRICE_STREAM_MAX_COINS:
+        raise ValueError(f"At most {PRICE_STREAM_MAX_COINS} coins per subscription")
+
+
+async def sse(coins):
+    """
+    Server-Sent Events of a subscription to coins, with a comment line every SSE_KEEPALIVE seconds.
+    """
+    with subscription(coins) as sub:
+        while True:
+            try:
+                message = await asyncio.wait_for(sub.next_message(), SSE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield f"data: {message}\n\n"
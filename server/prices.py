@@ -0,0 +1,61 @@
+# server/prices.py
+"""
+Price info for the /crypto routes, shared by the sync handlers (main.py) and the async ones
+(async_routes.py): a fresh enough row of the Price table, or the upstream through market_client.
+"""
+import logging
+import os
+from datetime import datetime, timezone
+
+from fastapi import HTTPException
+
+from . import ingest, market_client
+
+logger = logging.getLogger(__name__)
+
+# 数据库中的价格在此时间内视为新鲜，直接返回而不访问上游
+PRICE_DB_MAX_AGE = float(os.getenv("PRICE_DB_MAX_AGE", str(2 * ingest.INGEST_INTERVAL)))
+
+
+async def fetch_crypto_data(coin_id: str):
+    """
+    从 CoinGecko API 获取加密货币数据。
+    重试、截止时间、并发限制和熔断由 market_client 负责。
+    """
+    return await market_client.client.get_json(f"/coins/{coin_id}", label=f"coin_id {coin_id}")
+
+
+async def fetch_price_info(coin_id: str):
+    logger.debug("Fetching data for coin_id: %s", coin_id)
+    try:
+        data = await fetch_crypto_data(coin_id)
+        logger.debug("Successfully fetched data for coin_id: %s", coin_id)
+    except HTTPException as e:
+        logger.error("Error fetching data for coin_id %s: %s", coin_id, e.detail)
+        raise
+    return market_client.extract_price_info(coin_id, data)
+
+
+async def fetch_price_infos(coin_ids: list):
+    logger.debug("Fetching market data for %d coins", len(coin_ids))
+    rows = await market_client.client.get_markets(coin_ids)
+    return {row["id"]: market_client.extract_market_price_info(row) for row in rows}
+
+
+def price_info_from_db(price):
+    return {
+        "coin_id": price.cid,
+        "current_price": price.current_price,
+        "market_cap": price.market_cap,
+        "market_cap_rank": price.market_cap_rank,
+        "total_volume": price.total_volume,
+        "high_24h": price.high_24h,
+        "low_24h": price.low_24h,
+    }
+
+
+def is_fresh(price):
+    time_stamp = price.time_stamp
+    if time_stamp.tzinfo is None:
+        time_stamp = time_stamp.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - time_stamp).total_seconds() <= PRICE_DB_MAX_AGE
@@ -0,0 +1,418 @@
+# server/profiling.py
+"""
+Per-request profiles and the slow-query log, for finding out why a route is slow.
+
+Profiles. A request is profiled when it is sampled (PROFILE_SAMPLE_RATE, e.g. 0.01 for 1%) or
+when it carries an X-Debug-Profile header and the bearer token of an admin
+(auth.get_current_admin_user). While it runs, a sampler thread records its stack every
+PROFILE_INTERVAL seconds, wherever the request is:
+
+  running      the event loop thread's stack, from this middleware down
+  awaiting     the chain of suspended coroutines, down to the await it is blocked on
+  in a thread  then also the stack of the threadpool thread running its sync handler or
+               dependency
+
+so a profile is a wall-clock one: time spent waiting on the database, a lock or upstream shows
+up as much as CPU time. Below an @app.middleware("http") middleware (read_your_writes, with
+replicas) the handler runs in a task of its own, and stacks end in that middleware's call_next.
+
+The statements the request executed are recorded too, with their timings (not their
+parameters). The last PROFILE_KEEP profiles of each worker are kept in memory; profiled
+responses carry their id in an X-Profile-Id header. Admins read them at
+GET /debug/profiles and GET /debug/profiles/{profile_id}, ?format=collapsed for the stacks in
+the collapsed format of flamegraph.pl and speedscope.
+
+Slow-query log. Every statement taking SLOW_QUERY_MS or more is logged with the route it ran
+for and kept (the last SLOW_QUERY_KEEP, GET /debug/slow-queries) with its plan: EXPLAIN QUERY
+PLAN on SQLite, EXPLAIN on PostgreSQL, run on the same connection with the same parameters,
+at most once per statement every SLOW_QUERY_EXPLAIN_EVERY seconds.
+
+A request that is not profiled costs a random draw and a contextvar; each statement, a pair of
+cursor events. PROFILING_ENABLED=false removes both.
+"""
+import asyncio
+import contextvars
+import itertools
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from fastapi import HTTPException
+from sqlalchemy import event
+from starlette.concurrency import run_in_threadpool
+
+from .utils import LRUCache
+
+logger = logging.getLogger(__name__)
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "true").lower() == "true"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+# Beyond these a request runs unprofiled, and a long one (a stream) is no longer sampled
+PROFILE_MAX_ACTIVE = int(os.getenv("PROFILE_MAX_ACTIVE", "4"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "30"))
+PROFILE_MAX_QUERIES = int(os.getenv("PROFILE_MAX_QUERIES", "500"))
+PROFILE_HEADER = b"x-debug-profile"
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "250"))
+SLOW_QUERY_KEEP = int(os.getenv("SLOW_QUERY_KEEP", "100"))
+SLOW_QUERY_EXPLAIN_EVERY = float(os.getenv("SLOW_QUERY_EXPLAIN_EVERY", "300"))
+
+STATEMENT_MAX_LENGTH = 2000
+
+# Plan of a statement, as each backend explains it
+EXPLAINS = {
+    "sqlite": "EXPLAIN QUERY PLAN ",
+    "postgresql": "EXPLAIN ",
+}
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+stats = {"profiled": 0, "skipped": 0, "samples": 0, "slow_queries": 0, "explained": 0}
+
+profiles = deque(maxlen=PROFILE_KEEP)
+slow_queries = deque(maxlen=SLOW_QUERY_KEEP)
+_plans = LRUCache(1000)
+_ids = itertools.count(1)
+
+# The profile of the request being served, None when it isn't profiled
+_profile = contextvars.ContextVar("profile", default=None)
+# ASGI scope of the request being served, for the route of its slow queries
+_scope = contextvars.ContextVar("request_scope", default=None)
+
+_labels = {}
+
+
+def _label(code, lineno: int) -> str:
+    name = _labels.get(code.co_filename)
+    if name is None:
+        # Paths from the project or site-packages root: server/main.py, starlette/routing.py
+        parts = code.co_filename.replace("\\", "/").split("/")
+        name = _labels[code.co_filename] = "/".join(parts[-2:])
+    return f"{code.co_name} ({name}:{lineno})"
+
+
+def _thread_stack(leaf, stop=None) -> list:
+    """
+    Frames from leaf up to stop (included), outermost first; empty if stop isn't on the stack.
+    Without stop, up to the thread's first frame.
+    """
+    frames = []
+    while leaf is not None:
+        frames.append(leaf)
+        if leaf is stop:
+            break
+        leaf = leaf.f_back
+    else:
+        if stop is not None:
+            return []
+    frames.reverse()
+    return frames
+
+
+def _await_chain(coro):
+    """
+    (awaitable, frame) of each coroutine or generator awaited, from coro inwards.
+    """
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            return  # a Future, or finished
+        yield coro, frame
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+
+
+def _running(coro) -> bool:
+    return bool(getattr(coro, "cr_running", False) or getattr(coro, "gi_running", False) or getattr(coro, "ag_running", False))
+
+
+class Profile:
+    def __init__(self, scope: dict, reason: str):
+        self.id = f"{os.getpid()}-{next(_ids)}"
+        self.scope = scope
+        self.reason = reason
+        self.task = asyncio.current_task()
+        self.loop_thread = threading.get_ident()
+        self.frame = None  # the middleware's, where stacks start
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.duration = None
+        self.status = None
+        self.stacks = Counter()  # ((code, line), ...) outermost first -> samples
+        self.samples = 0
+        self.queries = []
+        self.query_count = 0
+        self.query_seconds = 0.0
+
+    def add_query(self, statement: str, elapsed: float):
+        self.query_count += 1
+        self.query_seconds += elapsed
+        if len(self.queries) < PROFILE_MAX_QUERIES:
+            self.queries.append({"statement": statement[:STATEMENT_MAX_LENGTH], "ms": round(elapsed * 1000, 3),
+                                 "at_ms": round((time.perf_counter() - self.started) * 1000, 3)})
+
+    def sample(self, frames: dict):
+        """
+        Record where the request is, from the stacks of all threads (sys._current_frames()).
+        """
+        stack = None
+        inside = False
+        for coro, frame in _await_chain(self.task.get_coro()):
+            inside = inside or frame is self.frame
+            if not inside:
+                continue
+            if _running(coro):
+                # Running on the event loop thread: its live stack, from this middleware down
+                stack = _thread_stack(frames.get(self.loop_thread), self.frame)
+                break
+            stack = (stack or []) + [frame]
+            worker = frame.f_locals.get("worker") if frame.f_code.co_name == "run_sync_in_worker_thread" else None
+            if worker is not None and worker.ident in frames:
+                # Waiting on the threadpool thread running our sync code; skip the pool's own frames
+                pool_files = (threading.__file__, sys.modules[type(worker).__module__].__file__)
+                stack += [f for f in _thread_stack(frames[worker.ident]) if f.f_code.co_filename not in pool_files]
+                break
+        if stack:
+            # Labelled when read, a sample only keeps code objects and line numbers
+            self.stacks[tuple((f.f_code, f.f_lineno) for f in stack)] += 1
+            self.samples += 1
+            stats["samples"] += 1
+
+    def summary(self) -> dict:
+        route = self.scope.get("route")
+        return {
+            "id": self.id,
+            "reason": self.reason,
+            "method": self.scope.get("method"),
+            "path": self.scope.get("path"),
+            "route": getattr(route, "path", None),
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": None if self.duration is None else round(self.duration * 1000, 3),
+            "samples": self.samples,
+            "query_count": self.query_count,
+            "query_ms": round(self.query_seconds * 1000, 3),
+        }
+
+    def collapsed_stacks(self) -> dict:
+        """
+        "outer;...;inner" -> samples, most sampled first.
+        """
+        return {";".join(_label(code, lineno) for code, lineno in stack): count for stack, count in self.stacks.most_common()}
+
+    def report(self) -> dict:
+        return dict(self.summary(), interval_ms=PROFILE_INTERVAL * 1000, stacks=self.collapsed_stacks(),
+                    queries=self.queries)
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.collapsed_stacks().items())
+
+
+class Sampler:
+    """
+    Thread sampling the stacks of the requests being profiled, running while there are some.
+    """
+
+    def __init__(self):
+        self.active = set()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def add(self, profile: Profile) -> bool:
+        with self._cond:
+            if len(self.active) >= PROFILE_MAX_ACTIVE:
+                return False
+            self.active.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+            return True
+
+    def remove(self, profile: Profile):
+        with self._cond:
+            self.active.discard(profile)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self.active:
+                    self._cond.wait()
+            time.sleep(PROFILE_INTERVAL)
+            frames = sys._current_frames()
+            now = time.perf_counter()
+            for profile in list(self.active):
+                if now - profile.started > PROFILE_MAX_SECONDS:
+                    self.remove(profile)
+                    continue
+                try:
+                    profile.sample(frames)
+                except Exception as e:
+                    logger.debug(f"Profile sample of {profile.id} failed: {e}")
+            del frames
+
+
+sampler = Sampler()
+
+
+def _bearer(scope) -> str:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            return token if scheme.lower() == "bearer" else None
+    return None
+
+
+def _admin_check(token: str) -> bool:
+    from . import auth, database
+
+    db = database.SessionLocal()
+    try:
+        auth.get_current_admin_user(auth.get_current_active_user(auth.get_current_user(db, token)))
+        return True
+    except HTTPException:
+        return False
+    finally:
+        db.close()
+
+
+async def _reason(scope):
+    """
+    Why the request is to be profiled, or None.
+    """
+    if any(name == PROFILE_HEADER for name, _ in scope["headers"]):
+        token = _bearer(scope)
+        if token and await run_in_threadpool(_admin_check, token):
+            return "header"
+        logger.warning(f"{PROFILE_HEADER.decode()} ignored on {scope['path']}: not an admin")
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling sampled and admin-requested requests.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        scope_token = _scope.set(scope)
+        try:
+            reason = await _reason(scope)
+            if reason is None:
+                await self.app(scope, receive, send)
+                return
+            profile = Profile(scope, reason)
+            profile.frame = sys._getframe()
+            if not sampler.add(profile):
+                stats["skipped"] += 1
+                await self.app(scope, receive, send)
+                return
+            await self._profiled(profile, scope, receive, send)
+        finally:
+            _scope.reset(scope_token)
+
+    async def _profiled(self, profile: Profile, scope, receive, send):
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                message = dict(message, headers=list(message.get("headers", [])) + [(b"x-profile-id", profile.id.encode())])
+            await send(message)
+
+        token = _profile.set(profile)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _profile.reset(token)
+            sampler.remove(profile)
+            profile.duration = time.perf_counter() - profile.started
+            stats["profiled"] += 1
+            profiles.append(profile)
+            logger.info(f"Profiled {scope['method']} {scope['path']} ({profile.reason}): "
+                        f"{profile.duration * 1000:.1f} ms, {profile.samples} samples, {profile.query_count} queries, "
+                        f"id {profile.id}")
+
+
+def _explain(conn, statement: str, parameters, executemany: bool):
+    prefix = EXPLAINS.get(conn.dialect.name)
+    if prefix is None or executemany or not statement.lstrip()[:6].upper().startswith(EXPLAINABLE):
+        return None
+    plan = _plans.get(statement)
+    if plan is not None:
+        return plan
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        plan = [str(row[-1]) for row in cursor.fetchall()]
+        stats["explained"] += 1
+    except Exception as e:
+        plan = [f"EXPLAIN failed: {e}"]
+    finally:
+        cursor.close()
+    _plans.set(statement, plan, time.time() + SLOW_QUERY_EXPLAIN_EVERY)
+    return plan
+
+
+def _log_slow(conn, engine_name: str, statement: str, parameters, executemany: bool, elapsed: float):
+    scope = _scope.get()
+    route = None
+    if scope is not None:
+        route = f"{scope['method']} {getattr(scope.get('route'), 'path', scope['path'])}"
+    plan = _explain(conn, statement, parameters, executemany)
+    stats["slow_queries"] += 1
+    slow_queries.append({"at": time.time(), "ms": round(elapsed * 1000, 3), "engine": engine_name, "route": route,
+                         "statement": statement[:STATEMENT_MAX_LENGTH], "plan": plan})
+    logger.warning(f"Slow query, {elapsed * 1000:.0f} ms on {engine_name} for {route or 'a job'}: "
+                   f"{statement[:200]!r} plan {plan}")
+
+
+def instrument_engine(engine, name: str):
+    """
+    Record the statements of profiled requests, and log slow ones, on a (sync) engine.
+    """
+    if not PROFILING_ENABLED:
+        return
+    slow = SLOW_QUERY_MS / 1000 if SLOW_QUERY_MS > 0 else None
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._profiling_started = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_profiling_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        profile = _profile.get()
+        if profile is not None:
+            profile.add_query(statement, elapsed)
+        if slow is not None and elapsed >= slow:
+            try:
+                _log_slow(conn, name, statement, parameters, executemany, elapsed)
+            except Exception as e:
+                logger.error(f"Slow query log failed: {e}")
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+def install(app):
+    if PROFILING_ENABLED:
+        app.add_middleware(ProfilingMiddleware)
+
+
+def get(profile_id: str):
+    for profile in profiles:
+        if profile.id == profile_id:
+            return profile
+    return None
@@ -0,0 +1,31 @@
+# server/queries.py
+"""
+Query expressions shared by the data-access modules (crud, alerts, lots, portfolio, ...).
+
+They depend on the models only, so any of those modules can use them without importing crud.
+"""
+from sqlalchemy import and_, func, select, tuple_
+from sqlalchemy.orm import aliased
+
+from . import models
+
+# Keys per IN (...) list wherever a statement is chunked, well below SQLite's bound-parameter limit
+CHUNK_SIZE = 500
+
+
+def latest_price_filter():
+    """
+    Filter keeping only the newest Price row per coin, as a correlated subquery on idx_price_cid_timestamp.
+    """
+    newer = aliased(models.Price)
+    return models.Price.time_stamp == (
+        select(func.max(newer.time_stamp)).where(newer.cid == models.Price.cid).scalar_subquery()
+    )
+
+
+def uid_cid_in(uid_column, cid_column, keys):
+    """
+    (uid, cid) IN keys. SQLite scans the whole table for a row-value IN list; the extra uid IN
+    lets it search a (uid, cid, ...) index and filter the few rows per user.
+    """
+    return and_(uid_column.in_({uid for uid, _ in keys}), tuple_(uid_column, cid_column).in_(keys))
@@ -0,0 +1,165 @@
+# server/replicas.py
+"""
+Read replicas for the read-only routes.
+
+SQLALCHEMY_REPLICA_URLS is a comma-separated list of replica URLs, each built with the same
+engine profile as the primary. Routes that only read take their session from get_read_db
+instead of database.get_db, and it is bound to:
+
+  * the primary when this client wrote within REPLICA_STICKY_SECONDS (read-your-writes). A
+    request whose unit of work wrote something answers with a `db_last_write` cookie; a client
+    that sends it back reads from the primary until it expires, on every worker;
+  * otherwise the next healthy replica, round robin;
+  * the primary when no replica is healthy.
+
+Health comes from a heartbeat. Every REPLICA_CHECK_INTERVAL seconds monitor() stamps the
+replica_heartbeat row on the primary and reads it back from each replica. A replica whose copy
+is more than REPLICA_MAX_LAG seconds old, or that does not answer, gets no reads until it
+catches up. Measuring lag through the replicated data works with any replication: streaming
+replicas on PostgreSQL, or locally a second SQLite file refreshed with
+`sqlite3 crypto.db ".backup replica.db"` (see bench/replica_routing.py).
+
+Read sessions refuse to flush, so a read route that starts writing fails instead of writing
+to a replica.
+"""
+import asyncio
+import itertools
+import logging
+import math
+import os
+import time
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import event, insert, select, update
+
+from . import database, models
+
+logger = logging.getLogger(__name__)
+
+REPLICA_URLS = [u.strip() for u in os.getenv("SQLALCHEMY_REPLICA_URLS", "").split(",") if u.strip()]
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "5"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "1"))
+# A write is on every healthy replica after at most REPLICA_MAX_LAG plus one check
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", str(REPLICA_MAX_LAG + REPLICA_CHECK_INTERVAL)))
+STICKY_COOKIE = "db_last_write"
+
+stats = {"replica_reads": 0, "sticky_reads": 0, "fallback_reads": 0}
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.counters = database.pool_counters()
+        self.engine = database.create_engine_for(url, self.counters, "replica")
+        self.name = self.engine.url.render_as_string(hide_password=True)
+        self.healthy = False  # until the first check
+        self.lag = None
+        self.error = None
+        self.reads = 0
+
+    def status(self) -> dict:
+        return {
+            "url": self.name, "healthy": self.healthy, "lag": self.lag, "error": self.error,
+            "reads": self.reads, "pool": database.engine_stats(self.engine, self.counters),
+        }
+
+
+replicas = [Replica(url) for url in REPLICA_URLS]
+_round_robin = itertools.count()
+
+
+def _sticky(request: Request) -> bool:
+    try:
+        wrote_at = float(request.cookies.get(STICKY_COOKIE, "0"))
+    except ValueError:
+        return False
+    return time.time() - wrote_at < REPLICA_STICKY_SECONDS
+
+
+def pick(request: Request):
+    """
+    Engine for a read-only request: primary after a recent write or when no replica is healthy.
+    """
+    if not replicas:
+        return database.engine
+    if _sticky(request):
+        stats["sticky_reads"] += 1
+        return database.engine
+    healthy = [replica for replica in replicas if replica.healthy]
+    if not healthy:
+        stats["fallback_reads"] += 1
+        return database.engine
+    replica = healthy[next(_round_robin) % len(healthy)]
+    replica.reads += 1
+    stats["replica_reads"] += 1
+    return replica.engine
+
+
+def get_read_db(request: Request):
+    """
+    Session for read-only routes, on the engine pick() chooses. Never commits.
+    """
+    db = database.SessionLocal(bind=pick(request))
+    db.info["read_only"] = True
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+@event.listens_for(database.UnitOfWorkSession, "before_flush")
+def _refuse_writes(db, flush_context, instances):
+    if db.info.get("read_only") and (db.new or db.dirty or db.deleted):
+        raise RuntimeError("Write through a read-only session; use get_db for routes that write")
+
+
+def stick(request: Request, response):
+    """
+    Give a client that just wrote the read-your-writes cookie.
+    """
+    if getattr(request.state, "db_wrote", False):
+        response.set_cookie(STICKY_COOKIE, f"{time.time():.3f}", max_age=math.ceil(REPLICA_STICKY_SECONDS),
+                            httponly=True, samesite="lax")
+
+
+def check():
+    """
+    Stamp the heartbeat on the primary and update each replica's lag and health from its copy.
+    """
+    heartbeat = models.ReplicaHeartbeat.__table__
+    now = time.time()
+    with database.engine.begin() as conn:
+        if not conn.execute(update(heartbeat).where(heartbeat.c.id == 1).values(stamped_at=now)).rowcount:
+            conn.execute(insert(heartbeat).values(id=1, stamped_at=now))
+    for replica in replicas:
+        try:
+            with replica.engine.connect() as conn:
+                stamped_at = conn.execute(select(heartbeat.c.stamped_at).where(heartbeat.c.id == 1)).scalar()
+            replica.lag = None if stamped_at is None else round(now - stamped_at, 3)
+            replica.error = None if stamped_at is not None else "no heartbeat yet"
+        except Exception as e:
+            replica.lag, replica.error = None, str(e)
+        healthy = replica.lag is not None and replica.lag <= REPLICA_MAX_LAG
+        if healthy != replica.healthy:
+            logger.warning(f"Replica {replica.name} {'back in rotation' if healthy else 'out of rotation'}"
+                           f" (lag {replica.lag}s{', ' + replica.error if replica.error else ''})")
+        replica.healthy = healthy
+
+
+async def monitor(interval: float = REPLICA_CHECK_INTERVAL):
+    while True:
+        try:
+            await run_in_threadpool(check)
+        except Exception as e:
+            # Primary unreachable: leave the replicas' state as it was
+            logger.error(f"Replica heartbeat failed: {e}")
+        await asyncio.sleep(interval)
+
+
+def status() -> dict:
+    return dict(stats, max_lag=REPLICA_MAX_LAG, replicas=[replica.status() for replica in replicas])
+
+
+def dispose():
+    for replica in replicas:
+        replica.engine.dispose()
@@ -0,0 +1,228 @@
+# server/scheduler.py
+"""
+Periodic jobs of the service: price ingestion, alert evaluation, rollups and retention.
+
+Each job runs on its own asyncio task, on a fixed grid of `interval` seconds:
+
+  jitter      every run starts up to SCHEDULER_JITTER x interval after its slot, at random,
+              so jobs with the same interval, and the same job on several hosts, don't fire
+              in lockstep.
+  coalescing  slots missed while a run overran its interval, or while the event loop was
+              blocked, are not caught up one by one. The job runs once, counted in
+              `coalesced`, and resumes on the grid.
+  leadership  a job runs in one process per host: the holder of its file lock
+              (server/locks.py), kept until the process exits. The other gunicorn workers
+              retry the lock at every slot and take over when the leader dies. Jobs sharing
+              in-process state share a lock, so they run in the same process: the ingest
+              job feeds the tick-driven alert book that alert_sync maintains.
+
+Per job, /scheduler/stats reports runs, failures, coalesced slots, the leader, and histograms
+of run time and lag (how late a run started against its slot, jitter excluded). Run times and
+failures are also exported at /metrics (server/metrics.py).
+
+Runs inside the API with SCHEDULER_IN_APP=true (by default the value of INGEST_IN_APP), or as
+its own process:
+
+    python -m server.scheduler
+
+SCHEDULER_JOBS=ingest,rollups limits a process to some of the jobs.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from bisect import bisect_left
+
+from . import alert_stream, alerts, archive, ingest, metrics, notifications, timeseries
+from .database import SessionLocal
+from .locks import FileLock
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_IN_APP = os.getenv("SCHEDULER_IN_APP", str(ingest.INGEST_IN_APP)).lower() == "true"
+SCHEDULER_JITTER = float(os.getenv("SCHEDULER_JITTER", "0.1"))
+SCHEDULER_JOBS = [j.strip() for j in os.getenv("SCHEDULER_JOBS", "").split(",") if j.strip()]
+
+# Seconds; run times and lags above the last bucket fall in +Inf
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Histogram:
+    """
+    Counts of observations per bucket (upper bounds, cumulative as in Prometheus), with their sum.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float):
+        """
+        Upper bound of the bucket holding the q-quantile (None past the last bucket or when empty).
+        """
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def snapshot(self) -> dict:
+        cumulative, seen = {}, 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            seen += count
+            cumulative[str(bound)] = seen
+        return {"count": self.count, "sum": round(self.sum, 6), "p50": self.quantile(0.5),
+                "p99": self.quantile(0.99), "buckets": cumulative}
+
+
+_locks = {}
+
+
+def _lock(name: str) -> FileLock:
+    # One FileLock per name: flock conflicts between two descriptors of the same process too
+    if name not in _locks:
+        _locks[name] = FileLock(name)
+    return _locks[name]
+
+
+class Job:
+    def __init__(self, name: str, run, interval: float, lock: str = None, jitter: float = SCHEDULER_JITTER, details=None):
+        """
+        run is a coroutine function taking no arguments; details, if given, returns the job's own stats.
+        """
+        self.name = name
+        self.details = details
+        self.run = run
+        self.interval = interval
+        self.jitter = jitter
+        self.lock = _lock(lock or f"job-{name}")
+        self.runtime = Histogram()
+        self.lag = Histogram()
+        self._duration_metric = metrics.job_duration.labels(name)
+        self._failures_metric = metrics.job_failures.labels(name)
+        self.stats = {"runs": 0, "failures": 0, "coalesced": 0, "leader": False, "running": False,
+                      "last_run_at": None, "last_duration": None, "last_lag": None, "last_error": None}
+
+    async def _run_once(self, slot: float):
+        started = time.monotonic()
+        lag = max(0.0, started - slot)
+        self.lag.observe(lag)
+        self.stats.update(running=True, last_lag=lag, last_run_at=time.time())
+        try:
+            await self.run()
+        except Exception as e:
+            self.stats["failures"] += 1
+            self._failures_metric.inc()
+            self.stats["last_error"] = str(e)
+            logger.error(f"Job {self.name} failed: {e}")
+        finally:
+            duration = time.monotonic() - started
+            self.runtime.observe(duration)
+            self._duration_metric.observe(duration)
+            self.stats.update(running=False, last_duration=duration, runs=self.stats["runs"] + 1)
+
+    async def loop(self):
+        slot = time.monotonic()
+        while True:
+            delay = random.uniform(0, self.jitter * self.interval)
+            await asyncio.sleep(max(0.0, slot + delay - time.monotonic()))
+            if self.lock.acquire():
+                if not self.stats["leader"]:
+                    logger.info(f"Process {os.getpid()} runs job {self.name}")
+                self.stats["leader"] = True
+                await self._run_once(slot + delay)
+            # Next slot on the grid; the ones already past are coalesced into it
+            slot += self.interval
+            missed = int((time.monotonic() - slot) // self.interval)
+            if missed > 0:
+                self.stats["coalesced"] += missed
+                slot += missed * self.interval
+
+    def status(self) -> dict:
+        status = dict(self.stats, interval=self.interval, runtime=self.runtime.snapshot(), lag=self.lag.snapshot())
+        if self.details is not None:
+            status["details"] = self.details()
+        return status
+
+
+def in_session(fn):
+    """
+    A job running fn(db) in a worker thread, on a session of its own.
+    """
+    def call():
+        db = SessionLocal()
+        try:
+            return fn(db)
+        finally:
+            db.close()
+
+    async def run():
+        await asyncio.to_thread(call)
+    return run
+
+
+def _sync_alert_book(db):
+    if alert_stream.pipeline.active:
+        alert_stream.pipeline.sync(db)
+
+
+def _rollups(db):
+    timeseries.roll_up(db)
+    archive.compact(db)
+    timeseries.prune(db)
+
+
+def default_jobs() -> list:
+    jobs = [
+        Job("ingest", ingest.ingest_job, ingest.INGEST_INTERVAL, lock="ingest"),
+        Job("rollups", in_session(_rollups), ingest.ROLLUP_INTERVAL),
+        Job("message_retention", in_session(notifications.prune), notifications.MESSAGE_PRUNE_INTERVAL),
+    ]
+    if ingest.ALERT_STREAM_ENABLED:
+        # The ingest job fires alerts tick by tick; keep its alert book in sync with other workers' changes
+        jobs.append(Job("alert_sync", in_session(_sync_alert_book), ingest.ALERT_STREAM_SYNC_INTERVAL, lock="ingest"))
+    else:
+        # Set-based evaluation, volatile coins more often than calm ones
+        jobs.append(Job("alerts", in_session(alerts.schedule.run), alerts.ALERT_EVAL_INTERVAL,
+                        details=lambda: alerts.schedule.stats))
+    return [job for job in jobs if not SCHEDULER_JOBS or job.name in SCHEDULER_JOBS]
+
+
+jobs = default_jobs()
+
+
+async def run(selected: list = None):
+    """
+    Run the jobs until cancelled, then give up their locks.
+    """
+    tasks = [asyncio.create_task(job.loop(), name=f"job-{job.name}") for job in (selected or jobs)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for job in selected or jobs:
+            job.stats["leader"] = False
+        for lock in _locks.values():
+            lock.release()
+
+
+def status() -> dict:
+    return {"pid": os.getpid(), "jobs": {job.name: job.status() for job in jobs}}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run())
@@ -1,6 +1,6 @@
 # server/schemas.py
-from pydantic import BaseModel, EmailStr
-from typing import Optional
+from pydantic import BaseModel, ConfigDict, EmailStr
+from typing import List, Optional
 from datetime import datetime
 
 class UserCreate(BaseModel):
@@ -33,31 +33,35 @@ class UserOut(BaseModel):
     role: str
     time_registered: Optional[datetime]
 
-    class Config:
-        orm_mode = True  # 允许从 ORM 对象中读取字段
-        json_encoders = {
-            datetime: lambda v: v.isoformat()  # 将 datetime 转换为 ISO 格式字符串
-        }
+    model_config = ConfigDict(from_attributes=True)  # 允许从 ORM 对象中读取字段，datetime 默认输出 ISO 格式
+
+# Authenticated user as kept in auth.user_cache, frozen since one instance serves many requests
+class CurrentUser(UserOut):
+    deactivated: Optional[bool] = False
+
+    model_config = ConfigDict(from_attributes=True, frozen=True)
 
 
 
 class PriceOut(BaseModel):
     pid: int
     cid: str
-    current_price: str
+    current_price: float
     market_cap: Optional[int]
     market_cap_rank: Optional[int]
     total_volume: Optional[int]
-    high_24h: Optional[str]
-    low_24h: Optional[str]
-    price_change_24h: Optional[str]
-    price_change_percentage_24h: Optional[str]
+    high_24h: Optional[float]
+    low_24h: Optional[float]
+    price_change_24h: Optional[float]
+    price_change_percentage_24h: Optional[float]
     market_cap_change_24h: Optional[int]
     time_stamp: datetime
 
-    class Config:
-        orm_mode = True  # 允许 Pydantic 从 ORM 对象中读取数据
+    model_config = ConfigDict(from_attributes=True)  # 允许 Pydantic 从 ORM 对象中读取数据
+
 
+class CryptoBatchRequest(BaseModel):
+    ids: List[str]
 
 
 class Token(BaseModel):
@@ -76,15 +80,47 @@ class PortfolioCreate(BaseModel):
 class PortfolioUpdate(BaseModel):
     amount: float
     
-class PortfolioOut(PortfolioCreate):
-    pid: int
-    time_added: datetime
+class PortfolioOut(BaseModel):
+    uid: int
+    cid: str
+    quantity: Optional[float]
+    asid: Optional[int]
+    time_created: Optional[datetime]
+
+    model_config = ConfigDict(from_attributes=True)
+
+class PortfolioHoldingSummary(BaseModel):
+    cid: str
+    quantity: float
+    price: Optional[float]  # None when the coin has no stored price
+    market_value: float
+    weight: float
+    change_24h: float
+    average_cost: Optional[float]  # None without a trade history for the holding
+    cost_basis: Optional[float]
+    unrealized_pnl: Optional[float]
+    realized_pnl: float
+
+class PortfolioSummary(BaseModel):
+    uid: int
+    total_value: float
+    total_cost_basis: float
+    unrealized_pnl: float
+    realized_pnl: float
+    change_24h: float
+    change_24h_percentage: Optional[float]
+    holdings: List[PortfolioHoldingSummary]
+
+class LotPositionOut(BaseModel):
+    cid: str
+    method: str
+    quantity: float
+    cost_basis: float
+    realized_pnl: float
+    lots: List[list]  # [quantity, unit_cost, time_acquired]
+    last_time: Optional[datetime]
 
-    class Config:
-        from_attributes = True
-        json_encoders = {
-            datetime: lambda v: v.isoformat()
-        }
+    model_config = ConfigDict(from_attributes=True)
 
 class AlertCreate(BaseModel):
     uid: int
@@ -92,16 +128,33 @@ class AlertCreate(BaseModel):
     price_target: Optional[float] = 0.0
     threshold_percentage: Optional[float] = 0.0
 
-class AlertOut(AlertCreate):    
-    aid: int
-    time_created: datetime
+class AlertOut(AlertCreate):
+    asid: int
+    alert_type: str
+    subscription_active: bool
+    time_subscribed: datetime
+    time_triggered: Optional[datetime] = None
+    price_target: Optional[float] = None
+    threshold_percentage: Optional[float] = None
 
-    class Config:
-        from_attributes = True
-        json_encoders = {
-            datetime: lambda v: v.isoformat()
-        }
+    model_config = ConfigDict(from_attributes=True)
         
+class MessageOut(BaseModel):
+    mid: int
+    uid: int
+    asid: Optional[int] = None
+    message_type: str
+    body: str
+    time_sent: datetime
+    read: bool
+    time_read: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+class MessagesRead(BaseModel):
+    mids: Optional[List[int]] = None  # these messages
+    up_to: Optional[int] = None  # or every message with mid <= up_to; neither marks the whole inbox
+
 class WalletCreate(BaseModel):
     uid: int
     wname: Optional[str] = None
@@ -115,14 +168,8 @@ class WalletUpdate(BaseModel):
 
 class WalletOut(WalletCreate):
     wid: int
-    address: str
-    time_created: datetime
 
-    class Config:
-        from_attributes = True
-        json_encoders = {
-            datetime: lambda v: v.isoformat()
-        }
+    model_config = ConfigDict(from_attributes=True)
 
 class TransactionCreate(BaseModel):
     uid: int
@@ -130,7 +177,7 @@ class TransactionCreate(BaseModel):
     cid: str
     cid_target: str
     ex_rate: float
-    position: str
+    position: float
     network: str
     success: bool = False
     time_transaction: datetime
@@ -141,10 +188,5 @@ class TransactionUpdate(BaseModel):
 
 class TransactionOut(TransactionCreate):
     tid: int
-    time_transaction: datetime
 
-    class Config:
-        from_attributes = True
-        json_encoders = {
-            datetime: lambda v: v.isoformat()
-        }
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
@@ -0,0 +1,105 @@
+# server/serialization.py
+"""
+Response serialization for the high-volume read routes.
+
+FastAPI's default path runs whatever a route returns through jsonable_encoder, a recursive
+Python walk over every value, and for ORM objects after the session has hydrated each row into
+the identity map. On the list endpoints that is most of the request's CPU. The routes here read
+Core result tuples instead, build plain row dicts and encode them in one of three modes:
+
+  encoder    the FastAPI default: jsonable_encoder, then json.dumps
+  validated  TypeAdapter(List[schema]): validated and dumped to JSON bytes by pydantic-core
+  raw        orjson.dumps of the rows as they come from the database, no validation
+
+ROUTE_MODES holds each route's mode; SERIALIZATION_MODES="transaction=validated,history=encoder"
+overrides it per route. Without orjson installed, raw falls back to validated for routes with
+a schema and to encoder for the others.
+"""
+import json
+import os
+from datetime import datetime
+from functools import lru_cache
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from pydantic import TypeAdapter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+MODES = ("encoder", "validated", "raw")
+
+
+def _parse_modes(spec: str) -> dict:
+    modes = {}
+    for item in filter(None, spec.split(",")):
+        route, _, mode = (part.strip() for part in item.partition("="))
+        if mode not in MODES:
+            raise ValueError(f"SERIALIZATION_MODES: unknown mode {mode!r} for {route!r}")
+        modes[route] = mode
+    return modes
+
+
+ROUTE_MODES = {
+    "transaction": "raw",
+    "wallet": "raw",
+    "portfolio": "raw",
+    "lots": "validated",
+    "history": "raw",
+    "message": "raw",
+    **_parse_modes(os.getenv("SERIALIZATION_MODES", "")),
+}
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+# Same output as Starlette's JSONResponse, plus datetimes
+_encode = json.JSONEncoder(default=_json_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode
+
+
+@lru_cache(maxsize=None)
+def _adapter(schema):
+    return TypeAdapter(List[schema])
+
+
+def rows(result) -> list:
+    """
+    Row dicts straight from a Core result's tuples.
+    """
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
+
+def dumps(content, schema=None, mode: str = "raw") -> bytes:
+    """
+    JSON bytes of content (a list of rows when a schema is given) in the given mode.
+    """
+    if mode == "raw" and orjson is not None:
+        return orjson.dumps(content)
+    if mode != "encoder" and schema is not None:
+        adapter = _adapter(schema)
+        return adapter.dump_json(adapter.validate_python(content))
+    return _encode(jsonable_encoder(content)).encode()
+
+
+def ndjson(keys: list, batch) -> bytes:
+    """
+    One JSON object per line for a batch of row tuples.
+    """
+    if orjson is not None:
+        return b"".join([orjson.dumps(dict(zip(keys, row))) + b"\n" for row in batch])
+    return "".join([_encode(dict(zip(keys, row))) + "\n" for row in batch]).encode()
+
+
+def response(route: str, content, schema=None, headers: dict = None) -> Response:
+    """
+    JSON response for a route in its ROUTE_MODES mode, bypassing FastAPI's response_model/jsonable_encoder pass.
+    """
+    return Response(dumps(content, schema, ROUTE_MODES.get(route, "encoder")), media_type="application/json", headers=headers)
@@ -0,0 +1,298 @@
+# server/timeseries.py
+"""
+OHLCV rollups and retention on top of the raw Price table.
+
+Raw ticks are rolled up into 1m candles, 1m into 5m, 5m into 1h and 1h into 1d. Each level
+only processes closed buckets past its watermark (RollupWatermark), inserting the candles and
+advancing the watermark in one transaction, so a crashed run never double counts.
+Retention prunes raw ticks and fine candles once they are older than their retention window
+and already rolled up.
+
+History queries read the coarsest level that evenly divides the requested interval, plus the
+not yet rolled up tail from raw ticks.
+
+    python -m server.timeseries   # one rollup + retention pass
+"""
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# Level -> (bucket seconds, source level), "raw" is the Price table
+LEVELS = {
+    "1m": (60, "raw"),
+    "5m": (300, "1m"),
+    "1h": (3600, "5m"),
+    "1d": (86400, "1h"),
+}
+
+RETENTION_DAYS = {
+    "raw": float(os.getenv("RETENTION_RAW_DAYS", "7")),
+    "1m": float(os.getenv("RETENTION_1M_DAYS", "30")),
+    "5m": float(os.getenv("RETENTION_5M_DAYS", "180")),
+    "1h": float(os.getenv("RETENTION_1H_DAYS", "1095")),
+    "1d": None,  # kept forever
+}
+
+DELETE_BATCH = 10000
+WINDOW_BUCKETS = 1440
+INTERVAL_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def utcnow():
+    # TIMESTAMP columns hold naive UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def naive_utc(value: datetime):
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def floor_time(value: datetime, seconds: int):
+    epoch = int(value.replace(tzinfo=timezone.utc).timestamp())
+    return datetime.fromtimestamp(epoch - epoch % seconds, timezone.utc).replace(tzinfo=None)
+
+
+def parse_interval(interval: str):
+    """
+    "5m" / "1h" / "1d" -> seconds.
+    """
+    try:
+        seconds = int(interval[:-1]) * INTERVAL_UNITS[interval[-1]]
+    except (KeyError, ValueError, IndexError):
+        seconds = 0
+    if seconds <= 0:
+        raise ValueError(f"Invalid interval {interval!r}, expected e.g. 1m, 5m, 1h, 1d")
+    return seconds
+
+
+class Candle:
+    __slots__ = ("open", "high", "low", "close", "volume", "samples")
+
+    def __init__(self, open, high, low, close, volume, samples):
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.samples = samples
+
+    def merge(self, other: "Candle"):
+        # `other` is later in time
+        self.high = max(self.high, other.high)
+        self.low = min(self.low, other.low)
+        self.close = other.close
+        if other.volume is not None:
+            self.volume = other.volume
+        self.samples += other.samples
+
+    def as_dict(self, bucket_start: datetime):
+        return {
+            "time": bucket_start.isoformat(),
+            "open": self.open,
+            "high": self.high,
+            "low": self.low,
+            "close": self.close,
+            "volume": self.volume,
+            "samples": self.samples,
+        }
+
+
+def _source_rows(db: Session, source: str, start: datetime, end: datetime, cid: str = None):
+    """
+    (cid, time, Candle) in (cid, time) order, from raw ticks or a finer rollup level.
+    """
+    if source == "raw":
+        query = select(
+            models.Price.cid, models.Price.time_stamp, models.Price.current_price, models.Price.total_volume
+        ).where(
+            models.Price.time_stamp >= start, models.Price.time_stamp < end, models.Price.current_price.isnot(None)
+        ).order_by(models.Price.cid, models.Price.time_stamp)
+        if cid is not None:
+            query = query.where(models.Price.cid == cid)
+        for row_cid, time_stamp, price, volume in db.execute(query.execution_options(yield_per=10000)):
+            yield row_cid, time_stamp, Candle(price, price, price, price, volume, 1)
+        return
+
+    rollup = models.PriceRollup
+    query = select(
+        rollup.cid, rollup.bucket_start, rollup.open, rollup.high, rollup.low, rollup.close, rollup.volume, rollup.samples
+    ).where(
+        rollup.granularity == source, rollup.bucket_start >= start, rollup.bucket_start < end
+    ).order_by(rollup.cid, rollup.bucket_start)
+    if cid is not None:
+        query = query.where(rollup.cid == cid)
+    for row in db.execute(query.execution_options(yield_per=10000)):
+        yield row[0], row[1], Candle(*row[2:])
+
+
+def aggregate(rows, seconds: int):
+    """
+    Fold (cid, time, Candle) rows sorted by (cid, time) into {(cid, bucket_start): Candle}.
+    """
+    buckets = {}
+    for cid, time_stamp, candle in rows:
+        key = (cid, floor_time(time_stamp, seconds))
+        current = buckets.get(key)
+        if current is None:
+            buckets[key] = candle
+        else:
+            current.merge(candle)
+    return buckets
+
+
+def _watermark(db: Session, level: str):
+    row = db.get(models.RollupWatermark, level)
+    return row.rolled_up_to if row is not None else None
+
+
+def roll_up_level(db: Session, level: str, now: datetime = None):
+    seconds, source = LEVELS[level]
+    now = naive_utc(now or utcnow())
+    # Only buckets whose source data is complete: bounded by the source's own watermark
+    limit = now if source == "raw" else _watermark(db, source)
+    if limit is None:
+        return 0
+    end = floor_time(limit, seconds)
+    start = _watermark(db, level)
+    if start is None:
+        first = db.execute(
+            select(models.Price.time_stamp).order_by(models.Price.time_stamp).limit(1)
+            if source == "raw" else
+            select(models.PriceRollup.bucket_start).where(models.PriceRollup.granularity == source)
+            .order_by(models.PriceRollup.bucket_start).limit(1)
+        ).scalar()
+        if first is None:
+            return 0
+        start = floor_time(first, seconds)
+    written = 0
+    # Commit every WINDOW_BUCKETS buckets so catching up on a large backlog stays bounded in memory
+    while start < end:
+        window_end = min(end, start + timedelta(seconds=seconds * WINDOW_BUCKETS))
+        buckets = aggregate(_source_rows(db, source, start, window_end), seconds)
+        if buckets:
+            db.execute(insert(models.PriceRollup), [
+                {
+                    "cid": cid,
+                    "granularity": level,
+                    "bucket_start": bucket_start,
+                    "open": candle.open,
+                    "high": candle.high,
+                    "low": candle.low,
+                    "close": candle.close,
+                    "volume": candle.volume,
+                    "samples": candle.samples,
+                }
+                for (cid, bucket_start), candle in buckets.items()
+            ])
+        watermark = db.get(models.RollupWatermark, level)
+        if watermark is None:
+            db.add(models.RollupWatermark(granularity=level, rolled_up_to=window_end))
+        else:
+            watermark.rolled_up_to = window_end
+        db.commit()
+        written += len(buckets)
+        start = window_end
+    return written
+
+
+def roll_up(db: Session, now: datetime = None):
+    """
+    Advance every level, finest first. Returns {level: candles written}.
+    """
+    written = {level: roll_up_level(db, level, now) for level in LEVELS}
+    if any(written.values()):
+        logger.info(f"Rollups written: {written}")
+    return written
+
+
+def delete_in_batches(db: Session, table, pk, condition):
+    deleted = 0
+    while True:
+        ids = db.execute(select(pk).where(condition).limit(DELETE_BATCH)).scalars().all()
+        if not ids:
+            return deleted
+        db.execute(delete(table).where(pk.in_(ids)))
+        db.commit()
+        deleted += len(ids)
+
+
+def prune(db: Session, now: datetime = None):
+    """
+    Apply retention, never deleting data that its next level hasn't rolled up yet.
+    """
+    now = naive_utc(now or utcnow())
+    deleted = {}
+    for level, days in RETENTION_DAYS.items():
+        if days is None:
+            continue
+        # The level this one feeds into
+        consumer = next((name for name, (_, source) in LEVELS.items() if source == level), None)
+        cutoff = now - timedelta(days=days)
+        rolled = _watermark(db, consumer) if consumer else cutoff
+        if rolled is None:
+            continue
+        cutoff = min(cutoff, rolled)
+        if level == "raw":
+            deleted[level] = delete_in_batches(
+                db, models.Price, models.Price.pid, models.Price.time_stamp < cutoff
+            )
+        else:
+            deleted[level] = delete_in_batches(
+                db, models.PriceRollup, models.PriceRollup.rid,
+                (models.PriceRollup.granularity == level) & (models.PriceRollup.bucket_start < cutoff),
+            )
+    if any(deleted.values()):
+        logger.info(f"Retention pruned: {deleted}")
+    return deleted
+
+
+def pick_level(seconds: int):
+    """
+    Coarsest stored level whose bucket evenly divides the requested interval ("raw" below 1m).
+    """
+    best = "raw"
+    for level, (size, _) in LEVELS.items():
+        if size <= seconds and seconds % size == 0:
+            best = level
+    return best
+
+
+def history(db: Session, cid: str, seconds: int, start: datetime, end: datetime):
+    """
+    OHLCV candles of `seconds` width for one coin in [start, end).
+    """
+    start, end = naive_utc(start), naive_utc(end)
+    level = pick_level(seconds)
+    rows = []
+    tail_start = start
+    if level != "raw":
+        watermark = _watermark(db, level)
+        if watermark is not None and watermark > start:
+            tail_start = min(watermark, end)
+            rows.extend(_source_rows(db, level, start, tail_start, cid=cid))
+    # Not yet rolled up (or sub-minute): aggregate raw ticks on the fly
+    if tail_start < end:
+        rows.extend(_source_rows(db, "raw", tail_start, end, cid=cid))
+    buckets = aggregate(rows, seconds)
+    return [candle.as_dict(bucket_start) for (_, bucket_start), candle in sorted(buckets.items())]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    from .database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        roll_up(db)
+        prune(db)
+    finally:
+        db.close()
@@ -0,0 +1,399 @@
+# server/transaction_import.py
+"""
+Bulk import of transaction history from CSV or NDJSON.
+
+`POST /transaction/import` streams the upload: the request body is split into lines as it
+arrives and handed over IMPORT_CHUNK_ROWS lines at a time, so memory stays flat no matter
+how large the file is. Each chunk is
+
+  * parsed (CSV with a header row naming TransactionCreate fields, or one JSON object per line),
+  * validated row by row with schemas.TransactionCreate; invalid rows are counted and the
+    first MAX_REPORTED_ERRORS reported with their row number, the rest of the file still imports,
+  * inserted with one executemany (COPY on PostgreSQL with psycopg 3).
+
+Every IMPORT_COMMIT_ROWS rows the quantity changes of the successful trades, summed per
+(uid, cid), are applied to the portfolio with a few set-based statements instead of one
+update per trade. Summing gives update_portfolio's result as long as a position only moves
+one way within the batch; where buys and sells mix, the position can close and reopen, so its
+trades are replayed from the stored quantity first and the summed change replaced by the
+outcome. Lot snapshots that already cover later trades are marked stale, and the
+batch is committed. An interrupted import keeps its committed batches; `committed_rows` in
+the progress report is the `skip` to resume with. Each user gets one message per import,
+not one per trade. Uploads commit after every chunk instead: a transaction left open while
+waiting for the client's next bytes would hold SQLite's write lock for the whole upload.
+
+Progress of running and recent imports is kept per worker, like ingest.stats:
+
+    GET /transaction/import/{import_id}
+
+    python -m server.transaction_import history.csv
+"""
+import argparse
+import codecs
+import csv
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+
+from pydantic import ValidationError
+from sqlalchemy import (
+    TIMESTAMP, Column, Integer, MetaData, String, Table, and_, delete, exists, func, insert, literal, select, update,
+)
+from sqlalchemy.orm import Session
+
+from . import models, notifications, queries, schemas
+from .queries import CHUNK_SIZE
+from .timeseries import naive_utc
+
+logger = logging.getLogger(__name__)
+
+IMPORT_CHUNK_ROWS = int(os.getenv("IMPORT_CHUNK_ROWS", "5000"))
+IMPORT_COMMIT_ROWS = int(os.getenv("IMPORT_COMMIT_ROWS", "100000"))
+MAX_REPORTED_ERRORS = 100
+# Progress entries kept per worker
+MAX_IMPORTS = 100
+
+FORMATS = ("csv", "ndjson")
+FIELDS = list(schemas.TransactionCreate.model_fields)
+COLUMNS = ["uid", "wid", "cid", "cid_target", "ex_rate", "position", "network", "success", "time_transaction"]
+
+imports = {}
+
+# Per-position changes of the batch being committed, staged on the import's connection so the
+# portfolio and lot snapshot updates are set-based statements instead of one statement per position
+_changes = Table(
+    "import_position_change",
+    MetaData(),
+    Column("uid", Integer, primary_key=True),
+    Column("cid", String, primary_key=True),
+    Column("delta", models.Amount),
+    Column("first_trade", TIMESTAMP),
+    prefixes=["TEMPORARY"],
+)
+
+
+def format_for(content_type: str):
+    """
+    Import format from a Content-Type header, None if it isn't one we read.
+    """
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in ("text/csv", "application/csv"):
+        return "csv"
+    if media_type in ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/json"):
+        return "ndjson"
+    return None
+
+
+async def line_chunks(byte_stream, size: int = IMPORT_CHUNK_ROWS):
+    """
+    Lists of up to `size` text lines from an async stream of UTF-8 bytes.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    lines = []
+    async for data in byte_stream:
+        parts = (pending + decoder.decode(data)).split("\n")
+        pending = parts.pop()
+        lines.extend(parts)
+        while len(lines) >= size:
+            yield lines[:size]
+            del lines[:size]
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        lines.append(pending)
+    if lines:
+        yield lines
+
+
+def _executemany(conn, statement, rows: list):
+    """
+    Execute a Core INSERT for a batch of row dicts as one DBAPI executemany.
+
+    SQLAlchemy processes every row's parameters on the way, which cost as much as the insert
+    itself for batches this size; here the statement is compiled once and only the bind
+    processors that exist (dates on SQLite) run per value.
+    """
+    dialect = conn.dialect
+    compiled = statement.compile(dialect=dialect, column_keys=list(rows[0]))
+    processors = []
+    for name, bind in compiled.binds.items():
+        process = bind.type.dialect_impl(dialect).bind_processor(dialect)
+        if process is not None:
+            processors.append((name, process))
+    for row in rows:
+        for name, process in processors:
+            if row[name] is not None:
+                row[name] = process(row[name])
+    if compiled.positiontup is not None:
+        conn.exec_driver_sql(compiled.string, [tuple(row[name] for name in compiled.positiontup) for row in rows])
+    else:
+        conn.exec_driver_sql(compiled.string, rows)
+
+
+def _describe(error: ValidationError):
+    return "; ".join(f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" for item in error.errors())
+
+
+class TransactionImport:
+    """
+    One import: feed it lines with `feed`, then call `finish` (or `fail`). Not thread-safe,
+    but may be moved between threads between calls.
+    """
+
+    def __init__(self, db: Session, fmt: str, import_id: str = None, skip: int = 0,
+                 commit_rows: int = IMPORT_COMMIT_ROWS):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown import format {fmt!r}, expected one of {', '.join(FORMATS)}")
+        self.db = db
+        self.format = fmt
+        self.skip = skip
+        self.commit_rows = commit_rows
+        self.header = None
+        self.started = time.perf_counter()
+        self.uncommitted = 0
+        # (uid, cid) -> [summed position, earliest time, positions in file order] of this batch's successful trades
+        self.changes = {}
+        self.per_user = {}  # uid -> imported trades, for the closing message
+        self.progress = {
+            "import_id": import_id or uuid.uuid4().hex,
+            "status": "running",
+            "format": fmt,
+            "rows": 0,
+            "imported": 0,
+            "rejected": 0,
+            "committed_rows": skip,
+            "rows_per_sec": None,
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "finished_at": None,
+            "errors": [],
+        }
+        imports[self.progress["import_id"]] = self.progress
+        while len(imports) > MAX_IMPORTS:
+            del imports[next(iter(imports))]
+
+    def _reject(self, row: int, message: str):
+        self.progress["rejected"] += 1
+        if len(self.progress["errors"]) < MAX_REPORTED_ERRORS:
+            self.progress["errors"].append({"row": row, "error": message})
+
+    def _records(self, lines: list):
+        """
+        (row number, dict) per data line; row numbers count data rows from 1, as `skip` does.
+        """
+        if self.format == "csv":
+            if self.header is None and lines:
+                self.header = [name.strip() for name in next(csv.reader(lines[:1]))]
+                lines = lines[1:]
+                unknown = set(self.header) - set(FIELDS)
+                if unknown:
+                    raise ValueError(f"Unknown CSV columns: {', '.join(sorted(unknown))}")
+            width = len(self.header)
+            for values in csv.reader(line for line in lines if line.strip()):
+                self.progress["rows"] += 1
+                if len(values) != width:
+                    self._reject(self.progress["rows"], f"expected {width} fields, got {len(values)}")
+                    continue
+                # Empty cells fall back to the schema defaults
+                yield self.progress["rows"], {name: value for name, value in zip(self.header, values) if value != ""}
+        else:
+            for line in lines:
+                if not line.strip():
+                    continue
+                self.progress["rows"] += 1
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    self._reject(self.progress["rows"], f"invalid JSON: {e}")
+                    continue
+                if not isinstance(record, dict):
+                    self._reject(self.progress["rows"], "expected a JSON object")
+                    continue
+                yield self.progress["rows"], record
+
+    def feed(self, lines: list):
+        """
+        Parse, validate and insert a chunk of lines; commits when commit_rows are pending.
+        """
+        read = self.progress["rows"]
+        rows = []
+        for number, record in self._records(lines):
+            if number <= self.skip:
+                continue
+            try:
+                transaction = schemas.TransactionCreate.model_validate(record)
+            except ValidationError as e:
+                self._reject(number, _describe(e))
+                continue
+            row = dict(transaction.__dict__)  # the TransactionCreate fields are the COLUMNS
+            row["time_transaction"] = naive_utc(row["time_transaction"])
+            rows.append(row)
+            if row["success"]:
+                key = (row["uid"], row["cid"])
+                change = self.changes.get(key)
+                if change is None:
+                    self.changes[key] = [row["position"], row["time_transaction"], [row["position"]]]
+                else:
+                    change[0] += row["position"]
+                    change[1] = min(change[1], row["time_transaction"])
+                    change[2].append(row["position"])
+            self.per_user[row["uid"]] = self.per_user.get(row["uid"], 0) + 1
+        if rows:
+            self._insert(rows)
+            self.progress["imported"] += len(rows)
+        self.uncommitted += self.progress["rows"] - read
+        if self.uncommitted >= self.commit_rows:
+            self._commit()
+        elapsed = time.perf_counter() - self.started
+        self.progress["rows_per_sec"] = self.progress["rows"] / elapsed if elapsed else None
+
+    def _insert(self, rows: list):
+        conn = self.db.connection()
+        if conn.dialect.driver == "psycopg":
+            # COPY FROM STDIN on the session's own DBAPI connection, same transaction
+            columns = ", ".join(COLUMNS)
+            with conn.connection.cursor() as cursor:
+                with cursor.copy(f'COPY "transaction" ({columns}) FROM STDIN') as copy:
+                    for row in rows:
+                        copy.write_row([row[name] for name in COLUMNS])
+        else:
+            _executemany(conn, insert(models.Transaction.__table__), rows)
+
+    def _replay_mixed(self, conn):
+        """
+        Summed changes of the positions with both buys and sells in the batch, replaced by what
+        applying their trades one at a time with update_portfolio's rules leaves: the final
+        quantity less the stored one.
+        """
+        mixed = [key for key, (_, _, positions) in self.changes.items()
+                 if min(positions) < 0 < max(positions)]
+        table = models.Portfolio.__table__
+        stored = {}
+        for i in range(0, len(mixed), CHUNK_SIZE):
+            keys = mixed[i:i + CHUNK_SIZE]
+            for uid, cid, quantity in conn.execute(
+                select(table.c.uid, table.c.cid, table.c.quantity).where(queries.uid_cid_in(table.c.uid, table.c.cid, keys))
+            ):
+                stored[uid, cid] = quantity
+        for key in mixed:
+            quantity = start = stored.get(key)
+            for position in self.changes[key][2]:
+                if quantity is None:
+                    quantity = position if position > 0 else None
+                else:
+                    quantity += position
+                    if quantity <= 0:
+                        quantity = None
+            # Applied below as for any other position: a drop to zero deletes, a rise from nothing inserts
+            self.changes[key][0] = (quantity or 0) - (start or 0)
+
+    def _apply_portfolio(self, conn):
+        """
+        Apply the batch's quantity changes with update_portfolio's rules: positions that drop to
+        zero or below are removed, new ones are only created for a buy.
+        """
+        table = models.Portfolio.__table__
+        same = and_(table.c.uid == _changes.c.uid, table.c.cid == _changes.c.cid)
+        conn.execute(update(table).where(same).values(quantity=func.coalesce(table.c.quantity, 0) + _changes.c.delta))
+        conn.execute(insert(table).from_select(
+            ["uid", "cid", "quantity", "time_created"],
+            select(_changes.c.uid, _changes.c.cid, _changes.c.delta, literal(datetime.now(timezone.utc), table.c.time_created.type))
+            .where(_changes.c.delta > 0, ~exists().where(same)),
+        ))
+        conn.execute(delete(table).where(
+            table.c.quantity <= 0, exists().where(same, _changes.c.delta < 0),
+        ))
+
+    def _invalidate_lots(self, conn):
+        """
+        Snapshots that already cover trades after the earliest imported one can't be extended
+        and are marked stale (see lots.invalidate); the rest pick the imported trades up from
+        the ledger on their next catch_up.
+        """
+        table = models.LotSnapshot.__table__
+        conn.execute(update(table).where(
+            table.c.uid == _changes.c.uid, table.c.cid == _changes.c.cid, table.c.last_time >= _changes.c.first_trade,
+        ).values(stale=True))
+
+    def _commit(self):
+        if self.changes:
+            conn = self.db.connection()
+            self._replay_mixed(conn)
+            _changes.create(conn, checkfirst=True)
+            _executemany(conn, insert(_changes), [
+                {"uid": uid, "cid": cid, "delta": delta, "first_trade": first}
+                for (uid, cid), (delta, first, _) in self.changes.items()
+            ])
+            self._apply_portfolio(conn)
+            self._invalidate_lots(conn)
+            conn.execute(delete(_changes))
+        self.db.commit()
+        self.changes = {}
+        self.uncommitted = 0
+        self.progress["committed_rows"] = self.progress["rows"]
+
+    def finish(self):
+        now = datetime.now(timezone.utc)
+        if self.per_user:
+            notifications.write(self.db, [
+                notifications.message_row(uid, None, "Import", f"Imported {count} transactions.", now)
+                for uid, count in self.per_user.items()
+            ])
+        self._commit()
+        elapsed = time.perf_counter() - self.started
+        self.progress.update(status="done", finished_at=now.isoformat(), rows_per_sec=self.progress["rows"] / elapsed if elapsed else None)
+        logger.info(
+            f"Import {self.progress['import_id']}: {self.progress['imported']} transactions imported, "
+            f"{self.progress['rejected']} rejected in {elapsed:.1f}s"
+        )
+        return self.progress
+
+    def fail(self, error: Exception):
+        self.db.rollback()
+        self.progress.update(status="failed", finished_at=datetime.now(timezone.utc).isoformat(), error=str(error))
+        logger.error(f"Import {self.progress['import_id']} failed after {self.progress['committed_rows']} committed rows: {error}")
+        return self.progress
+
+
+def import_file(db: Session, path: str, fmt: str = None, skip: int = 0):
+    """
+    Import a CSV or NDJSON file, the format taken from its extension unless given.
+    """
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "ndjson")
+    job = TransactionImport(db, fmt, skip=skip)
+    try:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            lines = []
+            for line in f:
+                lines.append(line.rstrip("\r\n"))
+                if len(lines) >= IMPORT_CHUNK_ROWS:
+                    job.feed(lines)
+                    lines = []
+            if lines:
+                job.feed(lines)
+    except Exception as e:
+        job.fail(e)
+        raise
+    return job.finish()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Bulk transaction import")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS)
+    parser.add_argument("--skip", type=int, default=0, help="data rows to skip, to resume an interrupted import")
+    args = parser.parse_args()
+
+    from .database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        progress = import_file(db, args.path, args.format, args.skip)
+        print(json.dumps({key: value for key, value in progress.items() if key != "errors"}, indent=2))
+        for error in progress["errors"]:
+            print(f"  row {error['row']}: {error['error']}")
+    finally:
+        db.close()
@@ -1,6 +1,15 @@
+import os
+import threading
+import time
+from collections import OrderedDict
 from argon2 import PasswordHasher
 
-ph = PasswordHasher()
+# Argon2 cost. Stored hashes made with other values are upgraded on the next login (see hashing.py).
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+
+ph = PasswordHasher(time_cost=ARGON2_TIME_COST, memory_cost=ARGON2_MEMORY_COST, parallelism=ARGON2_PARALLELISM)
 
 def verify_password(hashed, password):
     try:
@@ -10,4 +19,47 @@ def verify_password(hashed, password):
         return False
 
 def get_password_hash(password):
-    return ph.hash(password)
\ No newline at end of file
+    return ph.hash(password)
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded LRU mapping.
+    Entries may carry an absolute expiry (epoch seconds); expired entries are dropped on read.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at: float = None):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return default if item is None else item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,63 @@
+import os
+import tempfile
+
+# The server reads its settings when imported: point everything it writes at a scratch directory
+workdir = tempfile.mkdtemp(prefix="server-tests-")
+os.environ.update({
+    "SQLALCHEMY_DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'test.db')}",
+    "LEADER_LOCK_DIR": workdir,
+    "PRICE_BUS_DIR": workdir,
+    "MARKET_CACHE_PATH": os.path.join(workdir, "market_cache.db"),
+    "PRICE_ARCHIVE_DIR": os.path.join(workdir, "price_archive"),
+    # Hash in the threadpool, cheaply
+    "HASH_WORKERS": "0",
+    "ARGON2_TIME_COST": "1",
+    "ARGON2_MEMORY_COST": "1024",
+    "ARGON2_PARALLELISM": "1",
+    "INGEST_IN_APP": "false",
+    "SCHEDULER_IN_APP": "false",
+})
+
+import pytest
+
+from server import auth, database, market_cache, market_client, models
+from server.fake_upstream import start_fake_upstream
+
+
+@pytest.fixture(autouse=True)
+def tables():
+    models.Base.metadata.drop_all(database.engine)
+    models.Base.metadata.create_all(database.engine)
+    # The same uids come back in every test
+    auth.token_cache.clear()
+    auth.user_cache.clear()
+
+
+@pytest.fixture
+def db():
+    session = database.SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def upstream():
+    """
+    (base url, FakeMarket) of a fake CoinGecko on a free port.
+    """
+    server, market = start_fake_upstream()
+    yield f"http://127.0.0.1:{server.server_address[1]}", market
+    server.shutdown()
+
+
+@pytest.fixture
+def client(upstream, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from server import main
+
+    # Fresh per test: the module-level client binds to the event loop it first ran on
+    monkeypatch.setattr(market_client, "client", market_client.MarketClient(upstream[0]))
+    monkeypatch.setattr(market_cache, "cache", market_cache.MarketDataCache())
+    with TestClient(main.app) as test_client:
+        yield test_client
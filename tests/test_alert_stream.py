@@ -0,0 +1,121 @@
+import pytest
+from sqlalchemy import select
+
+from server import alert_stream, crud, models, schemas
+from server.alert_stream import AlertEntry, AlertPipeline, write_fired
+
+
+def recording_pipeline(*entries):
+    batches = []
+    pipeline = AlertPipeline(sink=lambda fired, rearmed: batches.append(([e.asid for e in fired], list(rearmed))))
+    for entry in entries:
+        pipeline.add(entry)
+    return pipeline, batches
+
+
+def test_alert_fires_entering_its_band_and_rearms_leaving_it():
+    # Band [95, 105]
+    pipeline, batches = recording_pipeline(AlertEntry(1, 1, "bitcoin", 100, 5))
+    pipeline.process([("bitcoin", 90)])
+    pipeline.process([("bitcoin", 96)])
+    pipeline.process([("bitcoin", 104)])
+    pipeline.process([("bitcoin", 110)])
+    pipeline.process([("bitcoin", 100)])
+    assert batches == [([1], []), ([], [1]), ([1], [])]
+
+
+def test_first_tick_settles_against_every_band():
+    pipeline, batches = recording_pipeline(
+        AlertEntry(1, 1, "bitcoin", 100, 5),
+        AlertEntry(2, 1, "bitcoin", 200, 5, triggered=True),
+        AlertEntry(3, 1, "bitcoin", 101, 5, triggered=True),
+    )
+    pipeline.process([("bitcoin", 100)])
+    assert batches == [([1], [2])]
+
+
+def test_tick_jumping_over_a_band_fires_and_rearms_it():
+    pipeline, batches = recording_pipeline(AlertEntry(1, 1, "bitcoin", 100, 5))
+    pipeline.process([("bitcoin", 90)])
+    fired, rearmed = pipeline.process([("bitcoin", 110)])
+    assert [entry.asid for entry in fired] == [1]
+    assert rearmed == [1]
+    assert not pipeline.alerts[1].triggered
+
+
+def test_failed_sink_undoes_the_batch():
+    def failing(fired, rearmed):
+        raise RuntimeError("database is down")
+
+    pipeline = AlertPipeline(sink=failing)
+    pipeline.add(AlertEntry(1, 1, "bitcoin", 100, 5))
+    pipeline.process([("bitcoin", 90)])
+    with pytest.raises(RuntimeError):
+        pipeline.process([("bitcoin", 100)])
+    assert not pipeline.alerts[1].triggered
+
+    fired = []
+    pipeline.sink = lambda entries, rearmed: fired.extend(entries)
+    # Same price: the coin is settled again and the alert still in its band fires
+    pipeline.process([("bitcoin", 100)])
+    assert [entry.asid for entry in fired] == [1]
+
+
+def time_triggered(db, asid):
+    db.expire_all()
+    return db.execute(
+        select(models.AlertSubscription.time_triggered).where(models.AlertSubscription.asid == asid)
+    ).scalar()
+
+
+def test_triggered_state_survives_a_reload(db):
+    alert = crud.create_alert_subscription(db, schemas.AlertCreate(uid=1, cid="bitcoin", price_target=100, threshold_percentage=5))
+    db.commit()
+    asid = alert.asid
+
+    pipeline = AlertPipeline(sink=write_fired)
+    pipeline.load(db)
+    pipeline.process([("bitcoin", 100)])
+    assert time_triggered(db, asid) is not None
+    assert db.execute(select(models.Message.asid)).scalars().all() == [asid]
+
+    # A restarted process doesn't fire it again while the price stays in the band
+    pipeline = AlertPipeline(sink=write_fired)
+    pipeline.load(db)
+    assert pipeline.alerts[asid].triggered
+    fired, _ = pipeline.process([("bitcoin", 101)])
+    assert fired == []
+
+    # Leaving the band re-arms it, and a reload sees it armed
+    pipeline.process([("bitcoin", 120)])
+    assert time_triggered(db, asid) is None
+    pipeline = AlertPipeline(sink=write_fired)
+    pipeline.load(db)
+    assert not pipeline.alerts[asid].triggered
+
+
+def create_alert(db, price_target, cid="bitcoin"):
+    alert = crud.create_alert_subscription(db, schemas.AlertCreate(uid=1, cid=cid, price_target=price_target, threshold_percentage=5))
+    db.commit()
+    return alert.asid
+
+
+def test_sync_picks_up_alerts_committed_before_the_hooks_added_newer_ones(db, monkeypatch):
+    pipeline = AlertPipeline()
+    monkeypatch.setattr(alert_stream, "pipeline", pipeline)
+    # Committed by another worker while this process's book isn't loaded yet, or out of asid order
+    older = create_alert(db, 100)
+    pipeline.active = True
+    newer = create_alert(db, 200)
+    assert list(pipeline.alerts) == [newer]
+
+    pipeline.sync(db)
+    assert sorted(pipeline.alerts) == [older, newer]
+
+    # Deactivated elsewhere: the hook doesn't run in this process
+    pipeline.active = False
+    crud.deactivate_alert(db, older)
+    db.commit()
+    pipeline.active = True
+    pipeline.sync(db)
+    assert list(pipeline.alerts) == [newer]
@@ -0,0 +1,55 @@
+from server import auth, database, models
+
+
+def add_user(email, role="user"):
+    db = database.SessionLocal()
+    try:
+        user = models.User(email=email, username=email.split("@")[0], hashed_password="x", role=role)
+        db.add(user)
+        db.commit()
+        return user.uid
+    finally:
+        db.close()
+
+
+def bearer(uid, email, role="user"):
+    token = auth.create_access_token({"sub": email, "uid": uid, "role": role})
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_role_change_takes_effect_on_the_next_request(client):
+    root = bearer(add_user("root@example.com", "admin"), "root@example.com", "admin")
+    uid = add_user("ops@example.com", "admin")
+    ops = bearer(uid, "ops@example.com", "admin")
+    assert client.get("/admin", headers=ops).status_code == 200
+    assert auth.user_cache.get(uid) is not None
+
+    assert client.patch(f"/users/{uid}", json={"role": "user"}, headers=root).status_code == 200
+    assert auth.user_cache.get(uid) is None
+    # The token still claims admin; the role comes from the (reloaded) user
+    assert client.get("/admin", headers=ops).status_code == 403
+
+
+def test_deactivation_and_email_change_drop_the_cached_user(client):
+    root = bearer(add_user("root@example.com", "admin"), "root@example.com", "admin")
+    uid = add_user("ops@example.com", "admin")
+    ops = bearer(uid, "ops@example.com", "admin")
+    assert client.get("/admin", headers=ops).status_code == 200
+
+    assert client.post(f"/users/{uid}/deactivate", headers=root).status_code == 200
+    assert client.get("/admin", headers=ops).status_code == 400
+
+    other = add_user("dev@example.com")
+    dev = bearer(other, "dev@example.com")
+    assert client.get("/users/me", headers=dev).status_code == 200
+    client.patch(f"/users/{other}", json={"email": "dev2@example.com"}, headers=root)
+    # Tokens issued to the old email no longer match the user
+    assert client.get("/users/me", headers=dev).status_code == 401
+
+
+def test_token_claims_are_cached_and_bad_tokens_rejected(client):
+    uid = add_user("dev@example.com")
+    headers = bearer(uid, "dev@example.com")
+    assert client.get("/users/me", headers=headers).json()["uid"] == uid
+    assert auth.token_cache.get(headers["Authorization"].split()[1])["uid"] == uid
+    assert client.get("/users/me", headers={"Authorization": "Bearer not-a-token"}).status_code == 401
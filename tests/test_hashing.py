@@ -0,0 +1,60 @@
+import asyncio
+import threading
+
+import pytest
+from argon2 import PasswordHasher
+
+from server import hashing, utils
+
+
+def register_and_login(client, email="dev@example.com", password="secret"):
+    assert client.post("/users/", json={"email": email, "password": password}).status_code == 200
+    return client.post("/token", data={"username": email, "password": password})
+
+
+def test_login_hashes_and_verifies_off_the_event_loop(client):
+    response = register_and_login(client)
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+    assert client.get("/users/me", headers={"Authorization": f"Bearer {token}"}).json()["email"] == "dev@example.com"
+    assert client.post("/token", data={"username": "dev@example.com", "password": "wrong"}).status_code == 401
+    assert hashing.stats["pending"] == 0
+
+
+def test_logins_beyond_the_pending_limit_are_shed(client, monkeypatch):
+    assert register_and_login(client).status_code == 200
+    monkeypatch.setattr(hashing, "HASH_MAX_PENDING", 0)
+    shed = hashing.stats["shed"]
+    response = client.post("/token", data={"username": "dev@example.com", "password": "secret"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(hashing.HASH_RETRY_AFTER)
+    assert hashing.stats["shed"] == shed + 1
+
+
+def test_admission_counts_hashes_in_flight(monkeypatch):
+    monkeypatch.setattr(hashing, "HASH_MAX_PENDING", 1)
+    release = threading.Event()
+
+    async def run():
+        first = asyncio.ensure_future(hashing._run(release.wait))
+        await asyncio.sleep(0.05)
+        try:
+            with pytest.raises(hashing.Overloaded):
+                await hashing._run(int)
+        finally:
+            release.set()
+            await first
+        # The slot is free again once the first hash is done
+        return await hashing._run(int)
+
+    assert asyncio.run(run()) == 0
+    assert hashing.stats["pending"] == 0
+
+
+def test_hash_with_old_parameters_is_replaced_on_login():
+    old = PasswordHasher(time_cost=2, memory_cost=2048, parallelism=1).hash("secret")
+    matches, new_hash = asyncio.run(hashing.verify_password(old, "secret"))
+    assert matches
+    assert not utils.ph.check_needs_rehash(new_hash)
+    assert asyncio.run(hashing.verify_password(new_hash, "secret")) == (True, None)
+    assert asyncio.run(hashing.verify_password(new_hash, "wrong")) == (False, None)
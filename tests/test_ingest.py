@@ -0,0 +1,46 @@
+import asyncio
+
+from sqlalchemy import select
+
+from server import alert_stream, ingest, market_cache, market_client, models
+
+
+def test_ingest_once_writes_prices_and_fills_the_cache(upstream, db, monkeypatch):
+    base_url, market = upstream
+    monkeypatch.setattr(market_client, "client", market_client.MarketClient(base_url))
+    monkeypatch.setattr(market_cache, "cache", market_cache.MarketDataCache())
+    monkeypatch.setattr(alert_stream, "pipeline", alert_stream.AlertPipeline())
+
+    async def run():
+        try:
+            return await ingest.ingest_once(["bitcoin", "ethereum"])
+        finally:
+            await market_client.client.aclose()
+
+    assert asyncio.run(run()) == 2
+    assert market.requests == 1
+    rows = db.execute(select(models.Price.cid, models.Price.current_price).order_by(models.Price.cid)).all()
+    assert [cid for cid, _ in rows] == ["bitcoin", "ethereum"]
+    assert market_cache.cache.memory.get("bitcoin")[0]["current_price"] == rows[0].current_price
+    assert ingest.stats["last_rows"] == 2
+
+
+def test_ingest_feeds_ticks_to_the_alert_pipeline(upstream, monkeypatch):
+    base_url, market = upstream
+    price = market.quote("bitcoin")["current_price"]
+    fired = []
+    pipeline = alert_stream.AlertPipeline(sink=lambda entries, rearmed: fired.extend(entries))
+    pipeline.add(alert_stream.AlertEntry(1, 1, "bitcoin", price, 10))
+    pipeline.active = True
+    monkeypatch.setattr(market_client, "client", market_client.MarketClient(base_url))
+    monkeypatch.setattr(market_cache, "cache", market_cache.MarketDataCache())
+    monkeypatch.setattr(alert_stream, "pipeline", pipeline)
+
+    async def run():
+        try:
+            await ingest.ingest_once(["bitcoin"])
+        finally:
+            await market_client.client.aclose()
+
+    asyncio.run(run())
+    assert [entry.asid for entry in fired] == [1]
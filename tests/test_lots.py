@@ -0,0 +1,72 @@
+from datetime import datetime
+
+import pytest
+
+from server import crud, lots, schemas
+from server.lots import LotBook
+
+# Buy 2 @ 100, buy 1 @ 200, sell 1.5 @ 300
+TRADES = [(2, 100), (1, 200), (-1.5, 300)]
+
+
+def book_after(method, trades=TRADES):
+    book = LotBook(method)
+    for tid, (quantity, price) in enumerate(trades, 1):
+        book.apply(quantity, price, datetime(2024, 1, tid), tid)
+    return book
+
+
+def test_fifo_sells_the_oldest_lots_first():
+    book = book_after("fifo")
+    assert book.realized == pytest.approx(1.5 * (300 - 100))
+    assert [lot[:2] for lot in book.lots] == [[0.5, 100], [1, 200]]
+    assert book.cost_basis == pytest.approx(250)
+
+
+def test_lifo_sells_the_newest_lots_first():
+    book = book_after("lifo")
+    assert book.realized == pytest.approx(1 * (300 - 200) + 0.5 * (300 - 100))
+    assert [lot[:2] for lot in book.lots] == [[1.5, 100]]
+    assert book.cost_basis == pytest.approx(150)
+
+
+def test_average_keeps_one_lot_at_the_average_cost():
+    book = book_after("average")
+    assert book.realized == pytest.approx(1.5 * (300 - 400 / 3))
+    assert book.quantity == pytest.approx(1.5)
+    assert book.cost_basis == pytest.approx(200)
+
+
+def test_selling_more_than_held_only_closes_the_open_lots():
+    book = book_after("fifo", [(1, 100), (-3, 150)])
+    assert book.realized == pytest.approx(50)
+    assert book.quantity == 0
+
+
+def test_unknown_method_is_rejected(db):
+    with pytest.raises(ValueError):
+        lots.positions(db, 1, "hifo")
+
+
+def test_positions_follow_the_ledger(db):
+    for tid, (quantity, price) in enumerate(TRADES, 1):
+        crud.create_transaction(db, schemas.TransactionCreate(
+            uid=1, wid=1, cid="bitcoin", cid_target="usd", ex_rate=price, position=quantity,
+            network="n", success=True, time_transaction=datetime(2024, 1, tid),
+        ))
+    for method in ("fifo", "lifo"):
+        [position] = lots.positions(db, 1, method)
+        expected = book_after(method)
+        assert position["quantity"] == pytest.approx(expected.quantity)
+        assert position["cost_basis"] == pytest.approx(expected.cost_basis)
+        assert position["realized_pnl"] == pytest.approx(expected.realized)
+
+    # A back-dated trade replays the position
+    crud.create_transaction(db, schemas.TransactionCreate(
+        uid=1, wid=1, cid="bitcoin", cid_target="usd", ex_rate=50, position=1,
+        network="n", success=True, time_transaction=datetime(2023, 12, 31),
+    ))
+    [position] = lots.positions(db, 1, "fifo")
+    expected = book_after("fifo", [(1, 50)] + TRADES)
+    assert position["realized_pnl"] == pytest.approx(expected.realized)
+    assert position["cost_basis"] == pytest.approx(expected.cost_basis)
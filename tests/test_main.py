@@ -1 +1,142 @@
-#Place holder for the test cases
\ No newline at end of file
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from server import database, models, serialization, timeseries
+
+
+def test_crypto_price_is_served_from_the_cache(client, upstream):
+    _, market = upstream
+    first = client.get("/crypto/bitcoin")
+    assert first.status_code == 200
+    assert client.get("/crypto/bitcoin").json() == first.json()
+    assert market.requests == 1
+
+
+def test_crypto_price_prefers_a_fresh_ingested_row(client, upstream):
+    _, market = upstream
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.Price), [
+            {"cid": "bitcoin", "current_price": 1, "time_stamp": timeseries.utcnow() - timedelta(days=1)},
+            {"cid": "ethereum", "current_price": 2, "time_stamp": timeseries.utcnow()},
+        ])
+    assert client.get("/crypto/ethereum").json()["current_price"] == 2
+    assert market.requests == 0
+    assert client.get("/crypto/bitcoin").json()["current_price"] != 1
+    assert market.requests == 1
+
+
+def test_crypto_batch_makes_one_upstream_call(client, upstream):
+    _, market = upstream
+    response = client.get("/crypto", params={"ids": "bitcoin,ethereum,bitcoin"})
+    assert [price["coin_id"] for price in response.json()] == ["bitcoin", "ethereum"]
+    assert market.requests == 1
+    client.get("/crypto/ethereum")
+    assert market.requests == 1
+
+
+def add_transactions(count, time_transaction=datetime(2024, 1, 1)):
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.Transaction), [
+            {"uid": 1, "wid": 1, "cid": "bitcoin", "cid_target": "usd", "ex_rate": 100, "position": 1,
+             "network": "n", "success": True,
+             # Pairs of equal times: the tid breaks the tie
+             "time_transaction": time_transaction + timedelta(hours=i // 2)}
+            for i in range(count)
+        ])
+
+
+def test_keyset_pages_cover_the_listing_once(client):
+    add_transactions(7)
+    tids = []
+    url, params = "/transaction/1", {"limit": 3}
+    while url:
+        response = client.get(url, params=params)
+        assert response.status_code == 200
+        tids += [row["tid"] for row in response.json()]
+        url, params = response.links.get("next", {}).get("url"), None
+    assert tids == list(range(1, 8))
+
+
+def test_ndjson_listing_streams_everything_after_the_cursor(client):
+    add_transactions(5)
+    next_page = client.get("/transaction/1", params={"limit": 2}).links["next"]["url"]
+    response = client.get(next_page, params={"format": "ndjson"})
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert [json.loads(line)["tid"] for line in response.text.splitlines()] == [3, 4, 5]
+
+
+def test_invalid_cursor_is_rejected(client):
+    add_transactions(1)
+    assert client.get("/transaction/1", params={"after": "bm90IGEgY3Vyc29y"}).status_code == 400
+    assert client.get("/transaction/2").status_code == 404
+
+
+def add_prices(start, minutes):
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.Price), [
+            {"cid": "bitcoin", "current_price": 100 + i, "total_volume": 1, "time_stamp": start + timedelta(minutes=i)}
+            for i in range(minutes)
+        ])
+
+
+def test_history_accepts_naive_and_aware_bounds(client):
+    start = timeseries.floor_time(timeseries.utcnow(), 3600) - timedelta(hours=3)
+    add_prices(start, 180)
+    db = database.SessionLocal()
+    try:
+        timeseries.roll_up(db)
+    finally:
+        db.close()
+
+    naive = client.get("/crypto/bitcoin/history", params={
+        "start": start.isoformat(), "end": (start + timedelta(hours=3)).isoformat(),
+    })
+    aware = client.get("/crypto/bitcoin/history", params={
+        "start": start.isoformat() + "Z", "end": (start + timedelta(hours=3)).isoformat() + "+00:00",
+    })
+    assert naive.status_code == 200
+    assert naive.json() == aware.json()
+    candles = naive.json()["candles"]
+    assert [(c["open"], c["close"], c["samples"]) for c in candles] == [(100, 159, 60), (160, 219, 60), (220, 279, 60)]
+
+    # Only start given: the window runs to now
+    assert len(client.get("/crypto/bitcoin/history", params={"start": start.isoformat()}).json()["candles"]) == 3
+
+
+def test_history_rejects_bad_windows(client):
+    for interval in ("1x", "0m", "-5m"):
+        assert client.get("/crypto/bitcoin/history", params={"interval": interval}).status_code == 400
+    assert client.get("/crypto/bitcoin/history", params={
+        "start": "2024-01-02T00:00:00", "end": "2024-01-01T00:00:00",
+    }).status_code == 400
+    assert client.get("/crypto/bitcoin/history", params={"start": "yesterday"}).status_code == 422
+
+
+def test_import_route_commits_and_reports(client):
+    body = "\n".join([
+        "uid,wid,cid,cid_target,ex_rate,position,network,success,time_transaction",
+        "1,1,ethereum,usd,10,5,n,true,2024-02-01T00:00:00",
+        "1,1,ethereum,usd,12,-2,n,true,2024-02-02T00:00:00",
+    ]) + "\n"
+    report = client.post("/transaction/import", content=body, headers={"content-type": "text/csv"}).json()
+    assert report["status"] == "done"
+    assert report["imported"] == report["committed_rows"] == 2
+    assert [row["quantity"] for row in client.get("/portfolio/1").json()] == [3]
+    assert client.get(f"/transaction/import/{report['import_id']}").json() == report
+
+
+def test_serialization_modes_encode_amounts_alike(client, monkeypatch):
+    client.post("/transaction/import", content="\n".join([
+        "uid,wid,cid,cid_target,ex_rate,position,network,success,time_transaction",
+        "1,1,ethereum,usd,10,3,n,true,2024-02-01T00:00:00",
+    ]) + "\n", headers={"content-type": "text/csv"})
+    bodies = []
+    for mode in serialization.MODES:
+        monkeypatch.setitem(serialization.ROUTE_MODES, "portfolio", mode)
+        body = client.get("/portfolio/1").content
+        # Whole amounts come back from SQLite as int, and must still be encoded as floats
+        assert b'"quantity":3.0' in body
+        bodies.append(json.loads(body))
+    assert bodies[0] == bodies[1] == bodies[2]
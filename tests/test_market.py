@@ -0,0 +1,186 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from server.fake_upstream import start_fake_upstream
+from server.market_cache import MarketDataCache
+from server.market_client import CircuitBreaker, MarketClient
+
+
+def test_breaker_opens_after_threshold_and_lets_one_probe_through():
+    breaker = CircuitBreaker(threshold=2, cooldown=60)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    breaker.opened_at -= 60
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_breaker_release_frees_the_probe_slot():
+    breaker = CircuitBreaker(threshold=1, cooldown=0)
+    breaker.record_failure()
+    probe = breaker.allow()
+    assert probe == "half-open"
+    assert not breaker.allow()
+    breaker.release(probe)
+    assert breaker.allow()
+
+
+def test_calls_admitted_before_the_breaker_opened_keep_the_probe_slot():
+    breaker = CircuitBreaker(threshold=1, cooldown=60)
+    earlier = breaker.allow()
+    assert earlier == "closed"
+    breaker.record_failure()
+    breaker.opened_at -= 60
+    assert breaker.allow() == "half-open"
+    # A call admitted while closed ends without an outcome while the probe is in flight
+    breaker.release(earlier)
+    assert not breaker.allow()
+
+
+def test_cancelled_probe_does_not_keep_the_breaker_shut():
+    server, _ = start_fake_upstream(latency=1)
+    client = MarketClient(f"http://127.0.0.1:{server.server_address[1]}")
+    client.breaker = CircuitBreaker(threshold=1, cooldown=0)
+    client.breaker.record_failure()
+
+    async def run():
+        probe = asyncio.create_task(client.get_json("/coins/bitcoin"))
+        await asyncio.sleep(0.1)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        await client.aclose()
+
+    try:
+        asyncio.run(run())
+    finally:
+        server.shutdown()
+    assert client.breaker.allow()
+
+
+def test_failing_upstream_opens_the_breaker():
+    server, market = start_fake_upstream(fail_rate=1)
+    client = MarketClient(f"http://127.0.0.1:{server.server_address[1]}", max_attempts=2)
+    client.breaker = CircuitBreaker(threshold=1, cooldown=60)
+
+    async def run():
+        try:
+            with pytest.raises(HTTPException) as failed:
+                await client.get_json("/coins/bitcoin")
+            with pytest.raises(HTTPException) as short_circuited:
+                await client.get_json("/coins/bitcoin")
+        finally:
+            await client.aclose()
+        return failed.value, short_circuited.value
+
+    try:
+        failed, short_circuited = asyncio.run(run())
+    finally:
+        server.shutdown()
+    assert failed.status_code == 500
+    assert short_circuited.status_code == 503
+    assert market.requests == 2
+    assert client.stats["short_circuited"] == 1
+
+
+def test_get_markets_reads_the_fake_upstream(upstream):
+    base_url, _ = upstream
+    client = MarketClient(base_url)
+
+    async def run():
+        try:
+            return await client.get_markets(["bitcoin", "ethereum"])
+        finally:
+            await client.aclose()
+
+    assert [row["id"] for row in asyncio.run(run())] == ["bitcoin", "ethereum"]
+
+
+def test_cache_coalesces_concurrent_misses():
+    cache = MarketDataCache()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"current_price": 1.0}
+
+    async def run():
+        values = await asyncio.gather(*(cache.get("bitcoin", fetch) for _ in range(10)))
+        return values, await cache.get("bitcoin", fetch)
+
+    values, cached = asyncio.run(run())
+    assert len(calls) == 1
+    assert values == [{"current_price": 1.0}] * 10
+    assert cached == {"current_price": 1.0}
+    assert cache.counters["coalesced"] == 9
+    assert cache.counters["hits"] == 1
+
+
+def test_cache_serves_stale_values_while_refreshing():
+    cache = MarketDataCache(default_ttl=0, stale_ttl=60)
+    prices = iter([1.0, 2.0])
+
+    async def fetch():
+        return next(prices)
+
+    async def run():
+        first = await cache.get("bitcoin", fetch)
+        stale = await cache.get("bitcoin", fetch)
+        await asyncio.sleep(0.05)
+        return first, stale, cache.memory.get("bitcoin")[0]
+
+    assert asyncio.run(run()) == (1.0, 1.0, 2.0)
+    assert cache.counters["stale_hits"] == 1
+
+
+def test_cache_does_not_keep_failures():
+    cache = MarketDataCache()
+
+    async def failing():
+        raise HTTPException(status_code=500)
+
+    async def fetch():
+        return 1.0
+
+    async def run():
+        with pytest.raises(HTTPException):
+            await cache.get("bitcoin", failing)
+        return await cache.get("bitcoin", fetch)
+
+    assert asyncio.run(run()) == 1.0
+    assert cache.counters["errors"] == 1
+
+
+def test_batch_fetches_keys_whose_coalesced_fetch_failed():
+    cache = MarketDataCache()
+    calls = []
+
+    async def failing(keys):
+        calls.append(keys)
+        await asyncio.sleep(0.05)
+        raise HTTPException(status_code=500)
+
+    async def fetch_many(keys):
+        calls.append(keys)
+        return {key: 1.0 for key in keys}
+
+    async def run():
+        first = asyncio.create_task(cache.get_many(["bitcoin"], failing))
+        await asyncio.sleep(0)
+        values = await cache.get_many(["bitcoin", "ethereum"], fetch_many)
+        with pytest.raises(HTTPException):
+            await first
+        return values
+
+    assert asyncio.run(run()) == {"bitcoin": 1.0, "ethereum": 1.0}
+    assert calls == [["bitcoin"], ["ethereum"], ["bitcoin"]]
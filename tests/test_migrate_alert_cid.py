@@ -0,0 +1,46 @@
+from sqlalchemy import inspect, select, text
+
+from server import database, models, notifications
+from server.migrate_alert_cid import migrate
+
+# The alert, message and transaction tables as they were before the columns and indexes were added
+OLD_TABLES = [
+    "CREATE TABLE alert_subscription (asid INTEGER PRIMARY KEY, uid INTEGER, cid VARCHAR, alert_type VARCHAR,"
+    " time_subscribed TIMESTAMP, subscription_active BOOLEAN)",
+    "CREATE TABLE price_alert_subscription (pasid INTEGER PRIMARY KEY, asid INTEGER, threshold NUMERIC,"
+    " threshold_percentage NUMERIC)",
+    "CREATE TABLE message (mid INTEGER PRIMARY KEY, uid INTEGER, asid INTEGER, message_type VARCHAR, body VARCHAR,"
+    " time_sent TIMESTAMP, read BOOLEAN, time_read TIMESTAMP)",
+    'CREATE TABLE "transaction" (tid INTEGER PRIMARY KEY, uid INTEGER, wid INTEGER, cid VARCHAR, cid_target VARCHAR,'
+    " ex_rate NUMERIC, position NUMERIC, network VARCHAR, success BOOLEAN, time_transaction TIMESTAMP)",
+    "INSERT INTO alert_subscription VALUES (1, 7, 'bitcoin', 'price', NULL, 1), (2, 7, 'ethereum', 'price', NULL, 1)",
+    "INSERT INTO price_alert_subscription VALUES (1, 1, 100, 5), (2, 2, 10, 5)",
+    "INSERT INTO message VALUES (1, 7, NULL, 'x', 'x', NULL, 0, NULL), (2, 7, NULL, 'x', 'x', NULL, 0, NULL),"
+    " (3, 8, NULL, 'x', 'x', NULL, 1, NULL)",
+]
+
+
+def test_migrate_upgrades_an_existing_database(db):
+    models.Base.metadata.drop_all(database.engine)
+    with database.engine.begin() as conn:
+        for statement in OLD_TABLES:
+            conn.execute(text(statement))
+
+    migrate(batch_size=1)
+    migrate(batch_size=1)
+
+    inspector = inspect(database.engine)
+    assert "time_triggered" in {c["name"] for c in inspector.get_columns("alert_subscription")}
+    for table, index in [
+        ("alert_subscription", "idx_alert_subscription_cid_active"),
+        ("price_alert_subscription", "idx_price_alert_cid_threshold"),
+        ("transaction", "idx_transaction_uid_time_tid"),
+        ("message", "idx_message_uid_mid"),
+        ("message", "idx_message_uid_read_mid"),
+    ]:
+        assert index in {i["name"] for i in inspector.get_indexes(table)}
+    assert db.execute(
+        select(models.PriceAlertSubscription.asid, models.PriceAlertSubscription.cid).order_by(models.PriceAlertSubscription.asid)
+    ).all() == [(1, "bitcoin"), (2, "ethereum")]
+    assert notifications.unread_count(db, 7) == 2
+    assert notifications.unread_count(db, 8) == 0
@@ -0,0 +1,88 @@
+from datetime import datetime
+
+from sqlalchemy import select, update
+
+from server import auth, database, models, notifications
+
+
+def deliver(db, uid, count):
+    notifications.write(db, [notifications.message_row(uid, None, "alert", f"message {i}") for i in range(count)])
+    db.commit()
+
+
+def mids(db, uid):
+    return db.execute(select(models.Message.mid).where(models.Message.uid == uid).order_by(models.Message.mid)).scalars().all()
+
+
+def test_counters_follow_writes_and_reads(db):
+    deliver(db, 1, 3)
+    deliver(db, 2, 1)
+    deliver(db, 1, 2)
+    assert notifications.unread_count(db, 1) == 5
+    assert notifications.unread_count(db, 2) == 1
+    assert notifications.unread_count(db, 3) == 0
+
+    first, second, third, *_ = mids(db, 1)
+    # Another user's message and one already read don't count
+    assert notifications.mark_read(db, 1, mids=[first, second, mids(db, 2)[0]]) == 2
+    assert notifications.mark_read(db, 1, mids=[first]) == 0
+    assert notifications.unread_count(db, 1) == 3
+    assert notifications.mark_read(db, 1, up_to=third) == 1
+    assert notifications.mark_read(db, 1) == 2
+    db.commit()
+    assert notifications.unread_count(db, 1) == 0
+    assert notifications.unread_count(db, 2) == 1
+
+
+def test_recount_rebuilds_drifted_counters(db):
+    deliver(db, 1, 2)
+    deliver(db, 2, 3)
+    db.execute(update(notifications.unread_counters).values(unread=7))
+    db.commit()
+
+    assert notifications.recount(db, uid=1) == 1
+    assert (notifications.unread_count(db, 1), notifications.unread_count(db, 2)) == (2, 7)
+    notifications.mark_read(db, 2, up_to=mids(db, 2)[0])
+    db.commit()
+    assert notifications.recount(db) == 2
+    assert (notifications.unread_count(db, 1), notifications.unread_count(db, 2)) == (2, 2)
+
+
+def record_and_notify(db, body):
+    # Like the transaction routes: notify in a unit of work that wrote
+    db.add(models.Wallet(uid=1, wname=body))
+    db.flush()
+    notifications.notify(db, 1, None, "transaction", body)
+
+
+def test_notify_writes_once_the_request_commits(db):
+    record_and_notify(db, "dropped")
+    db.rollback()
+    record_and_notify(db, "kept")
+    db.commit()
+    notifications.outbox.close()
+    assert db.execute(select(models.Message.body)).scalars().all() == ["kept"]
+    assert notifications.unread_count(db, 1) == 1
+
+
+def test_unread_routes(client):
+    db = database.SessionLocal()
+    try:
+        user = models.User(email="dev@example.com", username="dev", hashed_password="x", role="user")
+        db.add(user)
+        db.commit()
+        uid = user.uid
+        deliver(db, uid, 3)
+        deliver(db, uid + 1, 1)
+        newest = mids(db, uid)[-1]
+    finally:
+        db.close()
+    token = auth.create_access_token({"sub": "dev@example.com", "uid": uid, "role": "user"})
+    headers = {"Authorization": f"Bearer {token}"}
+
+    assert client.get("/messages/unread", headers=headers).json() == {"uid": uid, "unread": 3}
+    assert [m["mid"] for m in client.get("/messages", params={"unread": True}, headers=headers).json()] == [newest, newest - 1, newest - 2]
+    assert client.post("/messages/read", json={"mids": [newest]}, headers=headers).json() == {"marked": 1, "unread": 2}
+    assert client.get("/messages/unread", headers=headers).json()["unread"] == 2
+    assert client.post("/messages/read", json={}, headers=headers).json() == {"marked": 2, "unread": 0}
+    assert client.get("/messages", params={"unread": True}, headers=headers).json() == []
@@ -0,0 +1,81 @@
+import asyncio
+import json
+import os
+import socket
+import time
+
+from server import price_stream
+
+
+def test_datagrams_split_a_tick_and_keep_every_coin():
+    prices = {f"coin{i}": {"current_price": i, "pad": "x" * 100} for i in range(50)}
+    payloads = list(price_stream.datagrams(prices, size=1000))
+    assert len(payloads) > 1
+    assert all(len(payload) <= 1000 for payload in payloads)
+    merged = {}
+    for payload in payloads:
+        merged.update(json.loads(payload))
+    assert merged == prices
+
+
+def other_worker(name):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    path = os.path.join(price_stream.PRICE_BUS_DIR, f"prices-{name}.sock")
+    if os.path.exists(path):
+        os.unlink(path)
+    sock.bind(path)
+    return sock, path
+
+
+def test_publish_reaches_this_worker_and_the_others():
+    sock, path = other_worker("test-reader")
+
+    async def run():
+        await price_stream.bus.start()
+        try:
+            with price_stream.subscription(["bitcoin"]) as sub:
+                await price_stream.publish({"bitcoin": {"current_price": 1.0}})
+                return json.loads(await asyncio.wait_for(sub.next_message(), 1))
+        finally:
+            price_stream.bus.close()
+
+    try:
+        message = asyncio.run(run())
+        assert json.loads(sock.recv(65536)) == {"bitcoin": {"current_price": 1.0}}
+    finally:
+        sock.close()
+        os.unlink(path)
+    assert message == {"type": "prices", "prices": {"bitcoin": {"current_price": 1.0}}}
+
+
+def test_a_full_receiver_does_not_stall_the_event_loop(monkeypatch):
+    monkeypatch.setattr(price_stream, "PRICE_BUS_SEND_TIMEOUT", 0.3)
+    # Never read: its queue fills after a few datagrams
+    sock, path = other_worker("test-stuck")
+    prices = {f"coin{i}": {"pad": "x" * 60000} for i in range(100)}
+
+    async def run():
+        gaps = []
+
+        async def ticker():
+            while True:
+                started = time.perf_counter()
+                await asyncio.sleep(0.01)
+                gaps.append(time.perf_counter() - started)
+
+        task = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        await price_stream.publish(prices)
+        elapsed = time.perf_counter() - started
+        task.cancel()
+        return elapsed, max(gaps)
+
+    failed = price_stream.stats["bus_failed"]
+    try:
+        elapsed, longest_gap = asyncio.run(run())
+    finally:
+        sock.close()
+        os.unlink(path)
+    assert elapsed >= 0.3
+    assert longest_gap < 0.1
+    assert price_stream.stats["bus_failed"] == failed + 1
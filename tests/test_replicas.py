@@ -0,0 +1,88 @@
+import sqlite3
+import time
+
+import pytest
+from fastapi import Request, Response
+from sqlalchemy import update
+
+from server import database, models, replicas
+
+
+def request(wrote_at=None):
+    headers = [] if wrote_at is None else [(b"cookie", f"{replicas.STICKY_COOKIE}={wrote_at}".encode())]
+    return Request({"type": "http", "headers": headers})
+
+
+@pytest.fixture
+def replica(monkeypatch, tmp_path):
+    replica = replicas.Replica(f"sqlite:///{tmp_path / 'replica.db'}")
+    monkeypatch.setattr(replicas, "replicas", [replica])
+    yield replica
+    replica.engine.dispose()
+
+
+def refresh(replica):
+    # What `sqlite3 crypto.db ".backup replica.db"` does
+    source = sqlite3.connect(database.engine.url.database)
+    target = sqlite3.connect(replica.engine.url.database)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+
+
+def test_reads_go_to_a_replica_once_it_has_the_heartbeat(replica):
+    replicas.check()
+    assert not replica.healthy
+    assert replicas.pick(request()) is database.engine
+
+    refresh(replica)
+    replicas.check()
+    assert replica.healthy
+    assert replicas.pick(request()) is replica.engine
+    assert replica.reads == 1
+
+
+def test_lagging_replica_is_taken_out_of_rotation(replica):
+    replicas.check()
+    refresh(replica)
+    replicas.check()
+    assert replica.healthy
+
+    heartbeat = models.ReplicaHeartbeat.__table__
+    with replica.engine.begin() as conn:
+        conn.execute(update(heartbeat).values(stamped_at=time.time() - 2 * replicas.REPLICA_MAX_LAG))
+    replicas.check()
+    assert not replica.healthy
+    assert replica.lag > replicas.REPLICA_MAX_LAG
+    fallback = replicas.stats["fallback_reads"]
+    assert replicas.pick(request()) is database.engine
+    assert replicas.stats["fallback_reads"] == fallback + 1
+
+
+def test_client_that_wrote_reads_from_the_primary(replica):
+    replica.healthy = True
+    wrote = request()
+    wrote.state.db_wrote = True
+    response = Response()
+    replicas.stick(wrote, response)
+    wrote_at = response.headers["set-cookie"].split(";")[0].split("=")[1]
+
+    assert replicas.pick(request(wrote_at)) is database.engine
+    assert replicas.pick(request(time.time() - replicas.REPLICA_STICKY_SECONDS - 1)) is replica.engine
+    assert replicas.pick(request("garbage")) is replica.engine
+
+    # A request that didn't write gets no cookie
+    response = Response()
+    replicas.stick(request(), response)
+    assert "set-cookie" not in response.headers
+
+
+def test_read_sessions_refuse_to_write():
+    sessions = replicas.get_read_db(request())
+    db = next(sessions)
+    db.add(models.User(email="dev@example.com"))
+    with pytest.raises(RuntimeError):
+        db.flush()
+    sessions.close()
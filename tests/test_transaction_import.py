@@ -0,0 +1,96 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, select
+
+from server import database, models
+from server.transaction_import import TransactionImport
+
+HEADER = "uid,wid,cid,cid_target,ex_rate,position,network,success,time_transaction"
+
+
+def trade(position, day, cid="bitcoin", success="true"):
+    return f"1,1,{cid},usd,100,{position},n,{success},2024-01-{day:02d}T00:00:00"
+
+
+def hold(db, quantity, cid="bitcoin"):
+    db.add(models.Portfolio(uid=1, cid=cid, quantity=quantity, time_created=datetime(2023, 12, 1)))
+    db.commit()
+
+
+def quantities(db):
+    db.expire_all()
+    return dict(db.execute(select(models.Portfolio.cid, models.Portfolio.quantity).where(models.Portfolio.uid == 1)).all())
+
+
+def committed_transactions():
+    # Another connection only sees committed rows
+    with database.engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(models.Transaction)).scalar()
+
+
+def test_selling_out_and_buying_back_keeps_the_new_buy(db):
+    # update_portfolio closes the position at the sell and opens a new one with the buy
+    hold(db, 2)
+    job = TransactionImport(db, "csv")
+    job.feed([HEADER, trade(-5, 1), trade(3, 2)])
+    job.finish()
+    assert quantities(db) == {"bitcoin": 3}
+
+
+@pytest.mark.parametrize("held, positions, expected", [
+    (None, [2, 3], {"bitcoin": 5}),
+    (4, [-1, -1], {"bitcoin": 2}),
+    (4, [-4], {}),
+    (None, [-1, 2], {"bitcoin": 2}),
+    (1, [2, -5, 1, 1], {"bitcoin": 2}),
+])
+def test_imported_positions_match_update_portfolio(db, held, positions, expected):
+    if held is not None:
+        hold(db, held)
+    job = TransactionImport(db, "csv")
+    job.feed([HEADER] + [trade(position, day) for day, position in enumerate(positions, 1)])
+    job.finish()
+    assert quantities(db) == expected
+
+
+def test_failed_trades_are_stored_but_not_held(db):
+    job = TransactionImport(db, "csv")
+    job.feed([HEADER, trade(2, 1), trade(5, 2, success="false"), "1,1,bitcoin,usd,x,1,n,true,2024-01-03T00:00:00"])
+    progress = job.finish()
+    assert quantities(db) == {"bitcoin": 2}
+    assert progress["imported"] == 2
+    assert progress["rejected"] == 1
+    assert progress["errors"][0]["row"] == 3
+
+
+def test_each_batch_is_committed_with_its_portfolio_changes(db):
+    job = TransactionImport(db, "csv", commit_rows=2)
+    job.feed([HEADER, trade(1, 1), trade(1, 2)])
+    assert job.progress["committed_rows"] == 2
+    assert committed_transactions() == 2
+
+    job.feed([trade(1, 3)])
+    assert committed_transactions() == 2
+    job.fail(RuntimeError("client went away"))
+    assert committed_transactions() == 2
+    assert quantities(db) == {"bitcoin": 2}
+
+    # Resuming with skip imports only the rest
+    job = TransactionImport(db, "csv", skip=2)
+    job.feed([HEADER, trade(1, 1), trade(1, 2), trade(1, 3)])
+    job.finish()
+    assert committed_transactions() == 3
+    assert quantities(db) == {"bitcoin": 3}
+
+
+def test_ndjson_import(db):
+    job = TransactionImport(db, "ndjson")
+    job.feed([
+        '{"uid": 1, "wid": 1, "cid": "ethereum", "cid_target": "usd", "ex_rate": 10, "position": 4,'
+        ' "network": "n", "success": true, "time_transaction": "2024-02-01T00:00:00Z"}',
+        "not json",
+    ])
+    progress = job.finish()
+    assert quantities(db) == {"ethereum": 4}
+    assert progress["rejected"] == 1